@@ -0,0 +1,271 @@
+"""
+熔断器 - 按上游主机统计近期调用的错误率和慢调用比例，上游故障时快速失败
+
+状态:
+    closed     正常放行，统计时间窗口内的调用结果
+    open       错误率或慢调用比例超过阈值后打开，open_seconds 内的请求立即抛出 CircuitOpenError
+    half_open  打开时间到期后放行少量试探请求，全部成功则关闭，任一失败则重新打开；
+               试探请求被取消时交还名额，超过 trial_timeout 仍无结果的试探作废
+
+网络错误、5xx 和 429 计为失败；耗时超过 slow_call_seconds 的调用计为慢调用
+（流式响应只计到收到响应头为止）。
+"""
+import threading
+import time
+from collections import deque
+
+import httpx
+import requests
+
+from config import CIRCUIT_BREAKER_CONFIG
+from apis.log import get_logger
+from apis.metrics import counter, gauge
+
+logger = get_logger("circuit_breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BREAKER_STATE = gauge("my_ai_circuit_breaker_state", "熔断器状态（当前状态为1）", ("host", "state"))
+BREAKER_TRANSITIONS = counter("my_ai_circuit_breaker_transitions_total", "熔断器状态切换次数", ("host", "state"))
+BREAKER_REJECTED = counter("my_ai_circuit_breaker_rejected_total", "熔断器打开期间快速失败的请求数", ("host",))
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求未发出即失败"""
+
+    def __init__(self, host, retry_after):
+        self.host = host
+        self.retry_after = retry_after
+        super().__init__(f"上游服务 {host} 暂时不可用（熔断中），请{max(1, round(retry_after))}秒后重试")
+
+
+class RequestsCircuitOpenError(CircuitOpenError, requests.exceptions.ConnectionError):
+    """requests 调用方的熔断错误 - 现有的 RequestException 处理直接生效"""
+
+
+class HttpxCircuitOpenError(CircuitOpenError, httpx.TransportError):
+    """httpx 调用方的熔断错误 - 现有的 httpx.HTTPError 处理直接生效"""
+
+
+class CircuitBreaker:
+    """单个上游主机的熔断器"""
+
+    def __init__(self, host, config=None):
+        self.host = host
+        self.config = config or CIRCUIT_BREAKER_CONFIG
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        self._calls = deque()  # (时间, 是否失败, 是否慢调用)
+        self._opened_at = 0.0
+        self._trials = 0  # 半开状态下已放行的试探请求
+        self._trial_successes = 0
+        self._trial_started = 0.0  # 最近一次放行试探请求的时间
+        self._generation = 0  # 每次状态切换加一，用于识别过期的试探名额
+        self._stats = {"opened": 0, "rejected": 0}
+        BREAKER_STATE.inc(host, CLOSED)
+
+    def check(self, error_class=CircuitOpenError, acquire=True):
+        """
+        请求前检查，熔断中时抛出 error_class
+
+        Args:
+            error_class: 抛出的异常类型
+            acquire (bool): 是否占用半开状态的试探名额；只做预检、随后由传输层发出请求时传 False
+
+        Returns:
+            占用了试探名额时返回名额标识（请求没有结果时交给 abandon 交还），否则返回 None
+
+        Raises:
+            CircuitOpenError: 熔断器打开（或半开状态的试探名额已用完）
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.config['open_seconds'] - now
+                if remaining > 0:
+                    self._reject()
+                    raise error_class(self.host, remaining)
+                if not acquire:
+                    return None
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                self._expire_trials(now)
+                if self._trials >= self.config['half_open_max_calls']:
+                    self._reject()
+                    raise error_class(self.host, self.config['open_seconds'])
+                if acquire:
+                    self._trials += 1
+                    self._trial_started = now
+                    return self._generation
+            return None
+
+    def abandon(self, trial):
+        """
+        交还没有结果的试探名额（请求被取消等情况，不计为成功或失败）
+
+        Args:
+            trial: check 返回的名额标识
+        """
+        with self._lock:
+            if trial is None or trial != self._generation or self.state != HALF_OPEN:
+                return
+            if self._trials > self._trial_successes:
+                self._trials -= 1
+
+    def available(self):
+        """当前是否会放行请求（不占用半开状态的试探名额）"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() >= self._opened_at + self.config['open_seconds']
+            if self.state == HALF_OPEN:
+                self._expire_trials(time.monotonic())
+                return self._trials < self.config['half_open_max_calls']
+            return True
+
+    def record(self, elapsed, failed):
+        """
+        记录一次调用结果
+
+        Args:
+            elapsed (float): 耗时（秒）
+            failed (bool): 是否失败
+        """
+        slow = elapsed >= self.config['slow_call_seconds']
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._open(now)
+                    return
+                self._trial_successes += 1
+                if self._trial_successes >= self.config['half_open_max_calls']:
+                    self._calls.clear()
+                    self._transition(CLOSED)
+                return
+            if self.state == OPEN:
+                # 打开前发出的请求返回得晚，结果不再计入
+                return
+
+            self._calls.append((now, failed, slow))
+            self._prune(now)
+            total = len(self._calls)
+            if total < self.config['min_calls']:
+                return
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            if failures / total >= self.config['error_rate_threshold'] or \
+                    slow_calls / total >= self.config['slow_call_rate_threshold']:
+                logger.warning("上游 %s 熔断：%d 次调用中失败 %d 次、慢调用 %d 次", self.host, total, failures, slow_calls)
+                self._open(now)
+
+    def stats(self):
+        """获取熔断器状态"""
+        with self._lock:
+            self._prune(time.monotonic())
+            total = len(self._calls)
+            failures = sum(1 for _, failed, _ in self._calls if failed)
+            slow_calls = sum(1 for _, _, slow in self._calls if slow)
+            result = dict(
+                self._stats,
+                state=self.state,
+                window_calls=total,
+                error_rate=round(failures / total, 4) if total else 0,
+                slow_call_rate=round(slow_calls / total, 4) if total else 0
+            )
+            if self.state == OPEN:
+                result["retry_after"] = round(
+                    max(0.0, self._opened_at + self.config['open_seconds'] - time.monotonic()), 1
+                )
+            return result
+
+    def _open(self, now):
+        self._opened_at = now
+        self._calls.clear()
+        self._stats["opened"] += 1
+        self._transition(OPEN)
+
+    def _expire_trials(self, now):
+        """超过 trial_timeout 仍无结果的试探请求作废，交还名额（调用方持有锁）"""
+        if self._trials > self._trial_successes and \
+                now - self._trial_started >= self.config.get('trial_timeout', 30):
+            logger.info("上游 %s 的 %d 个试探请求超时无结果，重新放行试探", self.host, self._trials - self._trial_successes)
+            self._trials = self._trial_successes
+
+    def _reject(self):
+        self._stats["rejected"] += 1
+        BREAKER_REJECTED.inc(self.host)
+
+    def _transition(self, state):
+        """切换状态（调用方持有锁），重置半开状态的试探计数"""
+        BREAKER_STATE.dec(self.host, self.state)
+        BREAKER_STATE.inc(self.host, state)
+        BREAKER_TRANSITIONS.inc(self.host, state)
+        logger.info("上游 %s 熔断器: %s -> %s", self.host, self.state, state)
+        self.state = state
+        self._generation += 1
+        self._trials = 0
+        self._trial_successes = 0
+
+    def _prune(self, now):
+        """丢弃时间窗口之外的调用记录"""
+        horizon = now - self.config['window_seconds']
+        while self._calls and self._calls[0][0] < horizon:
+            self._calls.popleft()
+
+
+class CircuitBreakerRegistry:
+    """按主机管理熔断器"""
+
+    def __init__(self, config=None):
+        self.config = config or CIRCUIT_BREAKER_CONFIG
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    @property
+    def enabled(self):
+        return self.config.get('enabled', True)
+
+    def get(self, host):
+        """获取（或创建）主机的熔断器"""
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(host)
+                if breaker is None:
+                    breaker = self._breakers[host] = CircuitBreaker(host, self.config)
+        return breaker
+
+    def check(self, host, error_class=CircuitOpenError, acquire=True):
+        """请求前检查主机的熔断器，未启用熔断时直接放行；返回试探名额标识（见 CircuitBreaker.check）"""
+        if self.enabled:
+            return self.get(host).check(error_class, acquire)
+        return None
+
+    def abandon(self, host, trial):
+        """交还没有结果的试探名额"""
+        if self.enabled and trial is not None:
+            self.get(host).abandon(trial)
+
+    def record(self, host, status_code, elapsed):
+        """记录调用结果，status_code 为 None 表示网络错误"""
+        if self.enabled:
+            failed = status_code is None or status_code >= 500 or status_code == 429
+            self.get(host).record(elapsed, failed)
+
+    def available(self, host):
+        """主机当前是否会放行请求"""
+        if not self.enabled:
+            return True
+        breaker = self._breakers.get(host)
+        return breaker is None or breaker.available()
+
+    def stats(self):
+        """获取各主机的熔断器状态"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {
+            "enabled": self.enabled,
+            "hosts": {breaker.host: breaker.stats() for breaker in breakers}
+        }
@@ -1,8 +1,20 @@
 import requests
 import json
-import time
 import uuid
 from config import COGVIDEO_CONFIG
+from apis.circuit_breaker import CircuitOpenError
+from apis.http_client import get_transport
+from apis.log import get_logger
+from apis.metrics import counter
+from apis.retry import RETRYABLE_STATUS, RetryableError, attempt_once, retry_after_seconds
+from apis.status_cache import TaskStatusCache
+from apis.single_flight import SingleFlight
+from apis.tracing import span, traced
+
+logger = get_logger("cogvideo")
+TASK_POLLS = counter(
+	"my_ai_task_polls_total", "任务状态查询次数（source: cache 命中本地缓存，upstream 访问上游）", ("provider", "source")
+)
 
 class CogVideoAPI:
 	"""GLM CogVideoX 视频生成 API 类"""
@@ -11,6 +23,9 @@ class CogVideoAPI:
 		"""初始化 GLM CogVideoX API"""
 		from config import COGVIDEO_CONFIG
 		self.config = COGVIDEO_CONFIG
+		self.transport = get_transport()
+		self.status_cache = TaskStatusCache()
+		self.single_flight = SingleFlight()
 	
 	def get_model_info(self):
 		"""获取模型信息"""
@@ -20,6 +35,7 @@ class CogVideoAPI:
 			"type": "video"
 		}
 	
+	@traced("cogvideo.create_video_task")
 	def create_video_task(self, prompt=None, image_url=None, quality="speed", 
 						 with_audio=False, size="1920x1080", fps=30, duration=5, 
 						 request_id=None, user_id=None):
@@ -119,32 +135,31 @@ class CogVideoAPI:
 		if user_id:
 			data["user_id"] = user_id
 		
-		# 重试机制
-		max_retries = 3
-		retry_delay = 2  # 秒
-		
-		for attempt in range(max_retries):
+		def attempt(index):
+			"""发送一次创建请求，可重试的失败抛出 RetryableError"""
 			try:
-				print(f"🎬 创建 GLM CogVideoX 视频生成任务... (尝试 {attempt + 1}/{max_retries})")
-				if prompt:
-					print(f"📝 文本描述: {prompt}")
-				if image_url:
-					print(f"🖼️  基础图像: {image_url[:100]}...")
-				print(f"⚡ 质量模式: {quality}")
-				print(f"📐 分辨率: {size}")
-				print(f"🎞️  帧率: {fps} FPS")
-				print(f"⏱️  时长: {duration} 秒")
-				print(f"🎵 音效: {with_audio}")
+				logger.info(
+					"🎬 创建 GLM CogVideoX 视频生成任务...",
+					extra={"fields": {
+						"prompt": (prompt or "")[:100],
+						"has_image": bool(image_url),
+						"quality": quality,
+						"size": size,
+						"fps": fps,
+						"duration": duration,
+						"with_audio": with_audio
+					}}
+				)
 				
-				response = requests.post(create_url, headers=headers, json=data, timeout=self.config.get('timeout', 60))
+				response = self.transport.post(create_url, headers=headers, json=data, timeout=self.config.get('timeout', 60))
 				
-				print(f"📡 请求URL: {create_url}")
-				print(f"📦 请求数据: {json.dumps(data, ensure_ascii=False, indent=2)}")
-				print(f"📊 响应状态: {response.status_code}")
+				logger.debug("📡 请求URL: %s", create_url)
+				logger.debug("📦 请求数据: %s", data)
+				logger.debug("📊 响应状态: %s", response.status_code)
 				
 				if response.status_code == 200:
 					result = response.json()
-					print(f"✅ 任务创建成功: {json.dumps(result, ensure_ascii=False, indent=2)}")
+					logger.info("✅ 任务创建成功: %s", result)
 					
 					# GLM API 返回格式: {"model": "cogvideox-3", "id": "task_id", "request_id": "...", "task_status": "PROCESSING"}
 					task_id = result.get("id")
@@ -156,8 +171,8 @@ class CogVideoAPI:
 							"error": "创建任务响应格式错误，缺少任务ID"
 						}
 					
-					print(f"📋 任务ID: {task_id}")
-					print(f"📊 任务状态: {task_status}")
+					logger.debug("📋 任务ID: %s", task_id)
+					logger.debug("📊 任务状态: %s", task_status)
 					
 					return {
 						"success": True,
@@ -167,119 +182,88 @@ class CogVideoAPI:
 						"request_id": result.get("request_id", request_id),
 						"task_status": task_status
 					}
-				else:
-					# 处理HTTP错误
-					error_text = response.text
-					print(f"❌ 创建任务失败: HTTP {response.status_code}")
-					print(f"📄 响应内容: {error_text}")
-					
-					# 解析错误信息
-					try:
-						error_json = response.json()
-						error_msg = error_json.get("error", {}).get("message", error_text)
-						error_code = error_json.get("error", {}).get("code", "unknown")
-						
-						# 针对特定错误提供友好提示
-						if "1113" in str(error_code) or "余额不足" in error_msg:
-							return {
-								"success": False,
-								"error": "账户余额不足或无可用资源包，请充值后重试",
-								"status_code": response.status_code,
-								"error_code": error_code
-							}
-						elif "1104" in str(error_code) or "无效" in error_msg:
-							return {
-								"success": False,
-								"error": "API Key 无效，请检查配置",
-								"status_code": response.status_code,
-								"error_code": error_code
-							}
-						elif "1110" in str(error_code) or "限制" in error_msg:
-							# 频率限制错误，可以重试
-							if attempt < max_retries - 1:
-								print(f"⏰ 请求频率限制，{retry_delay}秒后重试...")
-								time.sleep(retry_delay)
-								retry_delay *= 2  # 指数退避
-								continue
-							else:
-								return {
-									"success": False,
-									"error": "请求频率过高，请稍后重试",
-									"status_code": response.status_code,
-									"error_code": error_code
-								}
-						else:
-							# 其他错误，如果不是最后一次尝试则重试
-							if attempt < max_retries - 1:
-								print(f"⚠️ 请求失败，{retry_delay}秒后重试...")
-								time.sleep(retry_delay)
-								retry_delay *= 2
-								continue
-							else:
-								return {
-									"success": False,
-									"error": error_msg,
-									"status_code": response.status_code,
-									"error_code": error_code
-								}
-						
-					except json.JSONDecodeError:
-						# JSON解析失败，如果不是最后一次尝试则重试
-						if attempt < max_retries - 1:
-							print(f"⚠️ 响应解析失败，{retry_delay}秒后重试...")
-							time.sleep(retry_delay)
-							retry_delay *= 2
-							continue
-						else:
-							return {
-								"success": False,
-								"error": f"请求失败: HTTP {response.status_code}",
-								"status_code": response.status_code
-							}
 				
-			except requests.exceptions.Timeout:
-				if attempt < max_retries - 1:
-					print(f"⏰ 请求超时，{retry_delay}秒后重试...")
-					time.sleep(retry_delay)
-					retry_delay *= 2
-					continue
-				else:
-					return {
+				# 处理HTTP错误
+				error_text = response.text
+				logger.warning("❌ 创建任务失败: HTTP %s", response.status_code)
+				logger.debug("📄 响应内容: %s", error_text)
+				
+				# 解析错误信息
+				try:
+					error_json = response.json()
+				except json.JSONDecodeError:
+					# 响应无法解析，可以重试
+					raise RetryableError({
 						"success": False,
-						"error": "请求超时，请稍后重试"
-					}
-			except requests.exceptions.RequestException as e:
-				if attempt < max_retries - 1:
-					print(f"🌐 网络错误，{retry_delay}秒后重试: {str(e)}")
-					time.sleep(retry_delay)
-					retry_delay *= 2
-					continue
-				else:
+						"error": f"请求失败: HTTP {response.status_code}",
+						"status_code": response.status_code
+					})
+				error_msg = error_json.get("error", {}).get("message", error_text)
+				error_code = error_json.get("error", {}).get("code", "unknown")
+				
+				# 针对特定错误提供友好提示
+				if "1113" in str(error_code) or "余额不足" in error_msg:
 					return {
 						"success": False,
-						"error": f"网络请求失败: {str(e)}"
+						"error": "账户余额不足或无可用资源包，请充值后重试",
+						"status_code": response.status_code,
+						"error_code": error_code
 					}
-			except Exception as e:
-				if attempt < max_retries - 1:
-					print(f"❌ 未知错误，{retry_delay}秒后重试: {str(e)}")
-					time.sleep(retry_delay)
-					retry_delay *= 2
-					continue
-				else:
+				if "1104" in str(error_code) or "无效" in error_msg:
 					return {
 						"success": False,
-						"error": f"未知错误: {str(e)}"
+						"error": "API Key 无效，请检查配置",
+						"status_code": response.status_code,
+						"error_code": error_code
 					}
+				
+				failure = {
+					"success": False,
+					"error": error_msg,
+					"status_code": response.status_code,
+					"error_code": error_code
+				}
+				if "1110" in str(error_code) or "限制" in error_msg:
+					# 频率限制错误，可以重试
+					failure["error"] = "请求频率过高，请稍后重试"
+					raise RetryableError(failure, retry_after_seconds(response))
+				if response.status_code in RETRYABLE_STATUS:
+					raise RetryableError(failure, retry_after_seconds(response))
+				return failure
+				
+			except CircuitOpenError as e:
+				# 上游熔断中，重试也会立即失败，直接返回
+				return {
+					"success": False,
+					"error": str(e),
+					"circuit_open": True
+				}
+			except requests.exceptions.Timeout:
+				raise RetryableError({
+					"success": False,
+					"error": "请求超时，请稍后重试"
+				})
+			except requests.exceptions.RequestException as e:
+				raise RetryableError({
+					"success": False,
+					"error": f"网络请求失败: {str(e)}"
+				})
+			except RetryableError:
+				raise
+			except Exception as e:
+				raise RetryableError({
+					"success": False,
+					"error": f"未知错误: {str(e)}"
+				})
 		
-		# 如果所有重试都失败了
-		return {
-			"success": False,
-			"error": f"经过{max_retries}次重试后仍然失败，请稍后重试"
-		}
+		# 只尝试一次，不在当前线程中等待重试：可重试的失败带 retryable 标记返回，
+		# 由事件循环上的 aretry_result 退避后重新创建，或由客户端按 retry_after 重试
+		return attempt_once(attempt, name="cogvideo.create_video_task")
 	
+	@traced("cogvideo.query_task_status")
 	def query_task_status(self, task_id):
 		"""
-		查询视频生成任务状态
+		查询视频生成任务状态 - 已结束任务直接返回本地缓存，不再访问上游
 		
 		Args:
 			task_id (str): 任务ID
@@ -287,6 +271,27 @@ class CogVideoAPI:
 		Returns:
 			dict: 包含任务状态和结果信息
 		"""
+		cached = self.status_cache.get(task_id)
+		if cached is not None:
+			TASK_POLLS.inc("cogvideo", "cache")
+			return cached
+		
+		# 同一任务的并发查询合并为一次上游请求
+		return self.single_flight.do(task_id, self._fetch_and_cache, task_id)
+	
+	def _fetch_and_cache(self, task_id):
+		"""
+		查询上游并写入状态缓存
+		"""
+		TASK_POLLS.inc("cogvideo", "upstream")
+		result = self._fetch_task_status(task_id)
+		self.status_cache.put(task_id, result)
+		return result
+	
+	def _fetch_task_status(self, task_id):
+		"""
+		从上游查询视频生成任务状态
+		"""
 		api_key = self.config['api_key']
 		
 		if not api_key:
@@ -311,23 +316,20 @@ class CogVideoAPI:
 			"Authorization": f"Bearer {api_key}"
 		}
 		
-		# 重试机制
-		max_retries = 3
-		retry_delay = 1  # 秒
-		
-		for attempt in range(max_retries):
+		def attempt(index):
+			"""发送一次查询请求，可重试的失败抛出 RetryableError"""
 			try:
-				print(f"📊 查询GLM视频任务状态: {task_id} (尝试 {attempt + 1}/{max_retries})")
-				print(f"📡 查询URL: {query_url}")
+				logger.debug("📊 查询GLM视频任务状态: %s", task_id)
+				logger.debug("📡 查询URL: %s", query_url)
 				
-				response = requests.get(query_url, headers=headers, timeout=self.config.get('timeout', 60))
+				response = self.transport.get(query_url, headers=headers, timeout=self.config.get('timeout', 60))
 				
 				if response.status_code == 200:
 					result = response.json()
-					print(f"📋 任务查询结果: {json.dumps(result, ensure_ascii=False, indent=2)}")
 					
 					# GLM API 返回格式分析
 					task_status = result.get("task_status", "PROCESSING")
+					logger.debug("📋 任务状态: %s -> %s", task_id, task_status)
 					
 					if task_status == "SUCCESS":
 						# 任务成功完成
@@ -389,133 +391,93 @@ class CogVideoAPI:
 							"message": "视频正在生成中，请稍后再查询",
 							"progress": progress_info
 						}
-				else:
-					# 处理HTTP错误
-					print(f"❌ 查询任务失败: HTTP {response.status_code}")
-					print(f"📄 响应内容: {response.text}")
-					
-					error_msg = f"查询任务失败: HTTP {response.status_code}"
-					
-					if response.status_code == 404:
-						return {
-							"success": False,
-							"error": "任务不存在或已过期",
-							"status": "error",
-							"status_code": response.status_code
-						}
-					elif response.status_code == 401:
-						return {
-							"success": False,
-							"error": "API Key 无效或已过期",
-							"status": "error",
-							"status_code": response.status_code
-						}
-					elif response.status_code == 429:
-						# 频率限制，可以重试
-						if attempt < max_retries - 1:
-							print(f"⏰ 查询频率限制，{retry_delay}秒后重试...")
-							time.sleep(retry_delay)
-							retry_delay *= 2
-							continue
-						else:
-							return {
-								"success": False,
-								"error": "查询频率过高，请稍后重试",
-								"status": "error",
-								"status_code": response.status_code
-							}
-					else:
-						# 其他错误，如果不是最后一次尝试则重试
-						if attempt < max_retries - 1:
-							print(f"⚠️ 查询失败，{retry_delay}秒后重试...")
-							time.sleep(retry_delay)
-							retry_delay *= 2
-							continue
-						else:
-							return {
-								"success": False,
-								"error": error_msg,
-								"status": "error",
-								"status_code": response.status_code
-							}
 				
-			except requests.exceptions.Timeout:
-				if attempt < max_retries - 1:
-					print(f"⏰ 查询超时，{retry_delay}秒后重试...")
-					time.sleep(retry_delay)
-					retry_delay *= 2
-					continue
-				else:
+				# 处理HTTP错误
+				logger.warning("❌ 查询任务失败: HTTP %s", response.status_code)
+				logger.debug("📄 响应内容: %s", response.text)
+				
+				if response.status_code == 404:
 					return {
 						"success": False,
-						"error": "查询请求超时",
-						"status": "error"
+						"error": "任务不存在或已过期",
+						"status": "error",
+						"status_code": response.status_code
 					}
-			except requests.exceptions.RequestException as e:
-				if attempt < max_retries - 1:
-					print(f"🌐 网络错误，{retry_delay}秒后重试: {str(e)}")
-					time.sleep(retry_delay)
-					retry_delay *= 2
-					continue
-				else:
+				if response.status_code == 401:
 					return {
 						"success": False,
-						"error": f"网络请求失败: {str(e)}",
-						"status": "error"
+						"error": "API Key 无效或已过期",
+						"status": "error",
+						"status_code": response.status_code
 					}
+				
+				failure = {
+					"success": False,
+					"error": "查询频率过高，请稍后重试" if response.status_code == 429 else f"查询任务失败: HTTP {response.status_code}",
+					"status": "error",
+					"status_code": response.status_code
+				}
+				if response.status_code in RETRYABLE_STATUS:
+					raise RetryableError(failure, retry_after_seconds(response))
+				return failure
+				
+			except CircuitOpenError as e:
+				# 上游熔断中，重试也会立即失败，直接返回
+				return {
+					"success": False,
+					"error": str(e),
+					"status": "error",
+					"circuit_open": True
+				}
+			except requests.exceptions.Timeout:
+				raise RetryableError({
+					"success": False,
+					"error": "查询请求超时",
+					"status": "error"
+				})
+			except requests.exceptions.RequestException as e:
+				raise RetryableError({
+					"success": False,
+					"error": f"网络请求失败: {str(e)}",
+					"status": "error"
+				})
 			except json.JSONDecodeError:
-				if attempt < max_retries - 1:
-					print(f"⚠️ 响应解析失败，{retry_delay}秒后重试...")
-					time.sleep(retry_delay)
-					retry_delay *= 2
-					continue
-				else:
-					return {
-						"success": False,
-						"error": "API响应格式错误",
-						"status": "error"
-					}
+				raise RetryableError({
+					"success": False,
+					"error": "API响应格式错误",
+					"status": "error"
+				})
+			except RetryableError:
+				raise
 			except Exception as e:
-				if attempt < max_retries - 1:
-					print(f"❌ 未知错误，{retry_delay}秒后重试: {str(e)}")
-					time.sleep(retry_delay)
-					retry_delay *= 2
-					continue
-				else:
-					return {
-						"success": False,
-						"error": f"未知错误: {str(e)}",
-						"status": "error"
-					}
+				raise RetryableError({
+					"success": False,
+					"error": f"未知错误: {str(e)}",
+					"status": "error"
+				})
 		
-		# 如果所有重试都失败了
-		return {
-			"success": False,
-			"error": f"经过{max_retries}次重试后仍然查询失败，请稍后重试",
-			"status": "error"
-		}
+		# 只查询一次：任务监视器按退避安排失败后的下一次查询，客户端轮询时自行重试
+		return attempt_once(attempt, name="cogvideo.query_task_status")
 	
 	def _calculate_video_progress(self, task_status):
-		"""计算视频生成进度"""
+		"""
+		根据上游状态给出阶段说明
+
+		完成百分比和剩余时间与任务已运行时长有关，由应用层根据历史耗时估算后补充。
+		"""
 		if task_status == "PENDING":
 			return {
-				"percentage": 20,
 				"message": "视频任务已排队...",
-				"estimated_time": "预计还需5-8分钟",
 				"current_stage": "排队等待中"
 			}
 		elif task_status == "PROCESSING":
 			return {
-				"percentage": 70,
 				"message": "AI正在渲染视频...",
-				"estimated_time": "预计还需2-4分钟",
 				"current_stage": "视频渲染中"
 			}
 		else:
 			return {
-				"percentage": 50,
 				"message": "视频处理中...",
-				"estimated_time": "预计还需3-6分钟",
 				"current_stage": "处理中"
 			}
 	
@@ -536,6 +498,7 @@ class CogVideoAPI:
 			"default_duration": 5
 		}
 	
+	@traced("cogvideo.chat")
 	def chat(self, messages, **kwargs):
 		"""
 		为了兼容统一接口，提供chat方法
@@ -0,0 +1,418 @@
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from openai import OpenAI, AsyncOpenAI
+
+from config import HTTP_CONFIG
+from apis.circuit_breaker import CircuitBreakerRegistry, HttpxCircuitOpenError, RequestsCircuitOpenError
+from apis.metrics import counter, histogram
+from apis.tracing import span
+
+UPSTREAM_REQUESTS = counter(
+    "my_ai_upstream_requests_total", "上游API调用次数（status 为 error 表示网络错误）", ("host", "status")
+)
+UPSTREAM_LATENCY = histogram("my_ai_upstream_request_duration_seconds", "上游API调用耗时（秒）", ("host",))
+
+
+class HttpTransport:
+    """共享HTTP传输层 - 按上游主机复用 keep-alive 连接池，并按主机熔断"""
+
+    def __init__(self, config=None):
+        """初始化传输层（连接池按需创建）"""
+        self.config = config or HTTP_CONFIG
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._host_stats = {}
+        self._http_client = None
+        self._async_http_client = None
+        self._openai_clients = {}
+        self._async_openai_clients = {}
+        self.breakers = CircuitBreakerRegistry()
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        通过共享连接池发送请求
+
+        Args:
+            method (str): HTTP方法
+            url (str): 请求地址
+            timeout (float): 读取超时（秒），默认使用 HTTP_CONFIG['read_timeout']
+            **kwargs: 透传给 requests 的其他参数
+
+        Returns:
+            requests.Response: 响应对象
+
+        Raises:
+            RequestsCircuitOpenError: 上游主机熔断中（requests.exceptions.ConnectionError 的子类）
+        """
+        host = _host_of(url)
+        trial = self.breakers.check(host, RequestsCircuitOpenError)
+        session = self._get_session(host)
+        with span(f"http {method}", host=host, path=urlsplit(url).path) as current:
+            start_time = time.monotonic()
+            try:
+                response = session.request(method, url, timeout=self._timeout(timeout), **kwargs)
+            except requests.exceptions.RequestException:
+                self._record(host, None, time.monotonic() - start_time)
+                raise
+            except BaseException:
+                # 请求被中断，没有结果：交还熔断器半开状态的试探名额
+                self.breakers.abandon(host, trial)
+                raise
+
+            self._record(host, response.status_code, time.monotonic() - start_time)
+            _record_status(current, response.status_code)
+            return response
+
+    def get(self, url, **kwargs):
+        """发送GET请求"""
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """发送POST请求"""
+        return self.request("POST", url, **kwargs)
+
+    def check_circuit(self, url):
+        """
+        请求前检查上游主机的熔断器（供 OpenAI SDK 客户端在调用前快速失败，避免 SDK 对熔断错误重试）
+
+        Raises:
+            CircuitOpenError: 上游主机熔断中
+        """
+        self.breakers.check(_host_of(url), acquire=False)
+
+    def is_available(self, url):
+        """上游主机当前是否可用（熔断器未打开）"""
+        return self.breakers.available(_host_of(url))
+
+    def get_http_client(self):
+        """获取共享的同步 httpx 客户端（供 OpenAI SDK 使用）"""
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    transport=_PooledHTTPTransport(self, limits=self._httpx_limits()),
+                    timeout=self._httpx_timeout()
+                )
+            return self._http_client
+
+    def get_async_http_client(self):
+        """获取共享的异步 httpx 客户端"""
+        with self._lock:
+            if self._async_http_client is None:
+                self._async_http_client = httpx.AsyncClient(
+                    transport=_AsyncPooledHTTPTransport(self, limits=self._httpx_limits()),
+                    timeout=self._httpx_timeout()
+                )
+            return self._async_http_client
+
+    def get_openai_client(self, api_key, base_url):
+        """获取共享的 OpenAI 兼容客户端 - 相同上游地址和密钥复用同一实例"""
+        key = (base_url, api_key)
+        client = self._openai_clients.get(key)
+        if client is None:
+            http_client = self.get_http_client()
+            with self._lock:
+                client = self._openai_clients.get(key)
+                if client is None:
+                    client = OpenAI(
+                        api_key=api_key,
+                        base_url=base_url,
+                        http_client=http_client,
+                        max_retries=self.config.get('openai_max_retries', 2)
+                    )
+                    self._openai_clients[key] = client
+        return client
+
+    def get_async_openai_client(self, api_key, base_url):
+        """获取共享的异步 OpenAI 兼容客户端"""
+        key = (base_url, api_key)
+        client = self._async_openai_clients.get(key)
+        if client is None:
+            http_client = self.get_async_http_client()
+            with self._lock:
+                client = self._async_openai_clients.get(key)
+                if client is None:
+                    client = AsyncOpenAI(
+                        api_key=api_key,
+                        base_url=base_url,
+                        http_client=http_client,
+                        max_retries=self.config.get('openai_max_retries', 2)
+                    )
+                    self._async_openai_clients[key] = client
+        return client
+
+    def stats(self):
+        """获取各上游主机的连接池统计信息"""
+        with self._lock:
+            hosts = {
+                host: dict(stats, status_codes=dict(stats['status_codes']))
+                for host, stats in self._host_stats.items()
+            }
+            sessions = dict(self._sessions)
+
+        for host, stats in hosts.items():
+            calls = stats['requests']
+            stats['avg_latency_ms'] = round(stats.pop('total_latency') / calls * 1000, 2) if calls else 0
+            session = sessions.get(host)
+            if session is not None:
+                stats.update(_urllib3_pool_stats(session))
+
+        return {
+            "pool_maxsize": self.config.get('pool_maxsize'),
+            "hosts": hosts
+        }
+
+    def circuit_stats(self):
+        """获取各上游主机的熔断器状态"""
+        return self.breakers.stats()
+
+    def close(self):
+        """关闭所有同步连接池"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            http_client, self._http_client = self._http_client, None
+            self._openai_clients.clear()
+        for session in sessions:
+            session.close()
+        if http_client is not None:
+            http_client.close()
+
+    async def aclose(self):
+        """关闭异步连接池"""
+        with self._lock:
+            client, self._async_http_client = self._async_http_client, None
+            self._async_openai_clients.clear()
+        if client is not None:
+            await client.aclose()
+
+    def _get_session(self, host):
+        """获取（或创建）指定主机的 requests 会话"""
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=self.config.get('pool_connections', 10),
+                    pool_maxsize=self.config.get('pool_maxsize', 50),
+                    pool_block=self.config.get('pool_block', False)
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def _record(self, host, status_code, elapsed):
+        """记录一次上游调用（同时计入该主机的熔断器）"""
+        UPSTREAM_REQUESTS.inc(host, "error" if status_code is None else str(status_code))
+        UPSTREAM_LATENCY.observe(elapsed, host)
+        self.breakers.record(host, status_code, elapsed)
+        with self._lock:
+            stats = self._host_stats.get(host)
+            if stats is None:
+                stats = self._host_stats[host] = {
+                    "requests": 0,
+                    "errors": 0,
+                    "total_latency": 0.0,
+                    "status_codes": {}
+                }
+            stats["requests"] += 1
+            stats["total_latency"] += elapsed
+            if status_code is None:
+                stats["errors"] += 1
+            else:
+                code = str(status_code)
+                stats["status_codes"][code] = stats["status_codes"].get(code, 0) + 1
+
+    def _timeout(self, read_timeout):
+        """构造 requests 的 (连接超时, 读取超时)"""
+        if isinstance(read_timeout, tuple):
+            return read_timeout
+        return (
+            self.config.get('connect_timeout', 5),
+            read_timeout if read_timeout is not None else self.config.get('read_timeout', 60)
+        )
+
+    def _httpx_timeout(self):
+        """构造 httpx 超时配置"""
+        return httpx.Timeout(
+            self.config.get('read_timeout', 60),
+            connect=self.config.get('connect_timeout', 5)
+        )
+
+    def _httpx_limits(self):
+        """构造 httpx 连接池限制"""
+        return httpx.Limits(
+            max_connections=None,
+            max_keepalive_connections=self.config.get('pool_maxsize', 50),
+            keepalive_expiry=self.config.get('keepalive_expiry', 30)
+        )
+
+
+class _PooledHTTPTransport(httpx.HTTPTransport):
+    """记录统计信息的 httpx 同步传输"""
+
+    def __init__(self, owner, **kwargs):
+        super().__init__(**kwargs)
+        self._owner = owner
+
+    def handle_request(self, request):
+        host = request.url.host
+        trial = self._owner.breakers.check(host, HttpxCircuitOpenError)
+        with span(f"http {request.method}", host=host, path=request.url.path) as current:
+            start_time = time.monotonic()
+            try:
+                response = super().handle_request(request)
+            except httpx.TransportError:
+                self._owner._record(host, None, time.monotonic() - start_time)
+                raise
+            except BaseException:
+                # 请求被取消（客户端断开、对冲取消落后一路等），没有结果：交还试探名额
+                self._owner.breakers.abandon(host, trial)
+                raise
+            self._owner._record(host, response.status_code, time.monotonic() - start_time)
+            _record_status(current, response.status_code)
+            return response
+
+
+class _AsyncPooledHTTPTransport(httpx.AsyncHTTPTransport):
+    """记录统计信息的 httpx 异步传输"""
+
+    def __init__(self, owner, **kwargs):
+        super().__init__(**kwargs)
+        self._owner = owner
+
+    async def handle_async_request(self, request):
+        host = request.url.host
+        trial = self._owner.breakers.check(host, HttpxCircuitOpenError)
+        with span(f"http {request.method}", host=host, path=request.url.path) as current:
+            start_time = time.monotonic()
+            try:
+                response = await super().handle_async_request(request)
+            except httpx.TransportError:
+                self._owner._record(host, None, time.monotonic() - start_time)
+                raise
+            except BaseException:
+                # 请求被取消（客户端断开、对冲取消落后一路等），没有结果：交还试探名额
+                self._owner.breakers.abandon(host, trial)
+                raise
+            self._owner._record(host, response.status_code, time.monotonic() - start_time)
+            _record_status(current, response.status_code)
+            return response
+
+
+class UpstreamStream:
+    """
+    同步流式响应 - 包装客户端的数据块生成器，同时持有上游响应
+
+    迭代和 close 与生成器相同；abort 可以在其他线程中调用，直接关闭上游连接的套接字，
+    正在阻塞读取的线程立即返回，不必等到下一个数据块到达。
+    """
+
+    def __init__(self, chunks, response):
+        """
+        Args:
+            chunks: 数据块生成器（在 finally 中关闭上游响应）
+            response: 上游响应（requests.Response、httpx.Response 或 openai Stream）
+        """
+        self._chunks = chunks
+        self._response = response
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self._done = True
+            raise
+
+    def close(self):
+        """关闭生成器（只能在读取线程中调用）"""
+        self._done = True
+        self._chunks.close()
+
+    def abort(self):
+        """从其他线程中断流：关闭底层套接字的读写，读取线程随后在 finally 中释放连接"""
+        if self._done:
+            # 已读完的连接可能已回到连接池，不能再关闭
+            return
+        sock = _response_socket(self._response)
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # 连接已经关闭
+            pass
+
+
+def _record_status(current, status_code):
+    """记录上游响应状态码到 span（span 只覆盖到收到响应头为止），5xx 标记为出错"""
+    current.set_attribute("status_code", status_code)
+    if status_code >= 500:
+        current.record_error(f"HTTP {status_code}")
+
+
+def _response_socket(response):
+    """找到流式响应底层连接的套接字，找不到时返回 None"""
+    # openai Stream 包装的是 httpx.Response
+    response = getattr(response, "response", response)
+    if isinstance(response, httpx.Response):
+        network_stream = response.extensions.get("network_stream")
+        return network_stream.get_extra_info("socket") if network_stream is not None else None
+    raw = getattr(response, "raw", None)
+    connection = getattr(raw, "connection", None)
+    return getattr(connection, "sock", None)
+
+
+def _host_of(url):
+    """提取URL中的主机名"""
+    return urlsplit(url).hostname or url
+
+
+def _urllib3_pool_stats(session):
+    """汇总 requests 会话底层 urllib3 连接池的统计信息"""
+    connections_created = 0
+    idle_connections = 0
+    for adapter in session.adapters.values():
+        pools = getattr(adapter.poolmanager, 'pools', None)
+        if pools is None:
+            continue
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections_created += getattr(pool, 'num_connections', 0)
+            if getattr(pool, 'pool', None) is not None:
+                # 队列中的 None 是尚未建立连接的占位符
+                idle_connections += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+    return {
+        "connections_created": connections_created,
+        "idle_connections": idle_connections
+    }
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """获取进程内共享的HTTP传输层"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = HttpTransport()
+    return _transport
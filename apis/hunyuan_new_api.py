@@ -1,17 +1,25 @@
 import requests
+import httpx
 import json
 import os
+from config import HUNYUAN_CONFIG
+from apis.http_client import UpstreamStream, get_transport
+from apis.retry import acall_with_retry, call_with_retry
+from apis.tracing import traced
 
 class HunyuanAPI:
     def __init__(self):
         self.api_key = os.getenv('HUNYUAN_API_KEY')
         if not self.api_key:
             raise RuntimeError('Missing environment variable HUNYUAN_API_KEY')
-        self.base_url = "https://api.hunyuan.cloud.tencent.com/v1"
+        self.base_url = HUNYUAN_CONFIG['api_base']
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self.transport = get_transport()
+        # 异步HTTP客户端，供 ASGI 模式在事件循环上使用
+        self.async_client = self.transport.get_async_http_client()
     
     def get_model_info(self):
         """
@@ -23,12 +31,38 @@ class HunyuanAPI:
             "type": "chat"
         }
     
+    @traced("hunyuan.chat")
     def chat(self, messages, model="hunyuan-turbos-latest", stream=True, enable_enhancement=True, **kwargs):
         """
         调用腾讯混元API进行对话
         """
         url = f"{self.base_url}/chat/completions"
+        data = self._build_request_data(messages, model, stream, enable_enhancement, **kwargs)
         
+        def send():
+            response = self.transport.post(url, headers=self.headers, json=data, stream=stream,
+                                           timeout=HUNYUAN_CONFIG['timeout'])
+            if not response.ok:
+                response.close()
+            response.raise_for_status()
+            return response
+        
+        try:
+            # 同步调用在请求线程中重试，退避总时长受 sync_budget_seconds 限制
+            response = call_with_retry(send, name="hunyuan.chat")
+            
+            if stream:
+                return UpstreamStream(self._handle_stream_response(response), response)
+            else:
+                return response.json()
+                
+        except requests.exceptions.RequestException as e:
+            return {"error": f"API请求失败: {str(e)}"}
+    
+    def _build_request_data(self, messages, model, stream, enable_enhancement, **kwargs):
+        """
+        构建请求体
+        """
         data = {
             "model": model,
             "messages": messages,
@@ -44,17 +78,7 @@ class HunyuanAPI:
         if "max_tokens" in kwargs:
             data["max_tokens"] = kwargs["max_tokens"]
         
-        try:
-            response = requests.post(url, headers=self.headers, json=data, stream=stream)
-            response.raise_for_status()
-            
-            if stream:
-                return self._handle_stream_response(response)
-            else:
-                return response.json()
-                
-        except requests.exceptions.RequestException as e:
-            return {"error": f"API请求失败: {str(e)}"}
+        return data
     
     def _handle_stream_response(self, response):
         """
@@ -76,4 +100,59 @@ class HunyuanAPI:
                         except json.JSONDecodeError:
                             continue
         except Exception as e:
-            yield {"error": f"流式响应处理失败: {str(e)}"} 
\ No newline at end of file
+            yield {"error": f"流式响应处理失败: {str(e)}"}
+        finally:
+            # 被提前关闭时释放上游连接，模型不再继续生成
+            response.close()
+    
+    @traced("hunyuan.achat")
+    async def achat(self, messages, model="hunyuan-turbos-latest", stream=True, enable_enhancement=True, **kwargs):
+        """
+        调用腾讯混元API进行对话（异步版本）
+        """
+        url = f"{self.base_url}/chat/completions"
+        data = self._build_request_data(messages, model, stream, enable_enhancement, **kwargs)
+        
+        async def send():
+            request = self.async_client.build_request("POST", url, headers=self.headers, json=data,
+                                                      timeout=HUNYUAN_CONFIG['timeout'])
+            response = await self.async_client.send(request, stream=stream)
+            if response.is_error:
+                if stream:
+                    await response.aread()
+                    await response.aclose()
+                response.raise_for_status()
+            return response
+        
+        try:
+            response = await acall_with_retry(send, name="hunyuan.achat")
+            
+            if stream:
+                return self._ahandle_stream_response(response)
+            else:
+                return response.json()
+                
+        except httpx.HTTPError as e:
+            return {"error": f"API请求失败: {str(e)}"}
+    
+    async def _ahandle_stream_response(self, response):
+        """
+        处理流式响应（异步版本）
+        """
+        try:
+            async for line in response.aiter_lines():
+                if line.startswith('data: '):
+                    data = line[6:]  # 移除 'data: ' 前缀
+                    if data == '[DONE]':
+                        break
+                    try:
+                        json_data = json.loads(data)
+                        if "choices" in json_data:
+                            yield json_data
+                    except json.JSONDecodeError:
+                        continue
+        except Exception as e:
+            yield {"error": f"流式响应处理失败: {str(e)}"}
+        finally:
+            # 被提前关闭时释放上游连接
+            await response.aclose()
@@ -0,0 +1,161 @@
+"""
+结构化日志 - 分级、按类别采样，通过队列交给后台线程写出
+
+用法:
+    from apis.log import get_logger
+    logger = get_logger("chat")
+    logger.info("开始流式调用 %s 模型", model)
+    # 逐 token 的调试日志先判断级别，关闭调试日志时几乎没有开销
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("发送回答内容: %.30s", content)
+
+请求线程只把日志记录放入有界队列，写 stdout 由后台线程完成；队列满时丢弃并计数，
+不会阻塞请求。各类别的采样率在 LOGGING_CONFIG['sample_rates'] 中配置，只作用于 DEBUG 级别。
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from config import LOGGING_CONFIG
+
+ROOT_LOGGER_NAME = "my_ai"
+
+_setup_lock = threading.Lock()
+_listener = None
+_handler = None
+
+
+def get_logger(category):
+    """获取类别日志器，如 get_logger("chat") -> my_ai.chat"""
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{category}")
+
+
+class SamplingFilter(logging.Filter):
+    """按类别对 DEBUG 日志采样 - 采样率 0.01 表示每100条保留1条（计数采样，结果确定）"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self._intervals = {
+            f"{ROOT_LOGGER_NAME}.{category}": max(1, round(1 / rate))
+            for category, rate in rates.items() if rate > 0
+        }
+        self._dropped = {f"{ROOT_LOGGER_NAME}.{category}" for category, rate in rates.items() if rate <= 0}
+        self._counters = {name: itertools.count() for name in self._intervals}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if record.name in self._dropped:
+            return False
+        interval = self._intervals.get(record.name)
+        if interval is None:
+            return True
+        # itertools.count 的 next 在 GIL 下是原子操作
+        return next(self._counters[record.name]) % interval == 0
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志而不是阻塞或报错"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行 JSON，extra 中的 fields 字典合并到输出中"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "category": record.name[len(ROOT_LOGGER_NAME) + 1:] or record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """文本格式：时间 级别 [类别] 消息 key=value..."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(category)s] %(message)s")
+
+    def format(self, record):
+        record.category = record.name[len(ROOT_LOGGER_NAME) + 1:] or record.name
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+    def formatTime(self, record, datefmt=None):
+        return time.strftime("%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}"
+
+
+def setup_logging(config=None):
+    """
+    配置日志（重复调用无副作用）
+
+    Args:
+        config (dict): 日志配置，默认使用 LOGGING_CONFIG
+    """
+    global _listener, _handler
+    config = config or LOGGING_CONFIG
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if config.get('format') == 'json' else TextFormatter())
+
+        _handler = NonBlockingQueueHandler(queue.Queue(maxsize=config.get('queue_size', 10000)))
+        _handler.addFilter(SamplingFilter(config.get('sample_rates', {})))
+
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        root.setLevel(config.get('level', 'INFO').upper())
+        root.addHandler(_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def logging_stats():
+    """获取日志队列统计"""
+    if _handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "level": logging.getLevelName(logging.getLogger(ROOT_LOGGER_NAME).level),
+        "queued": _handler.queue.qsize(),
+        "dropped": _handler.dropped
+    }
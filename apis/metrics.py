@@ -0,0 +1,225 @@
+"""
+运行指标 - 计数器、仪表和直方图，以 Prometheus 文本格式导出
+
+用法:
+    from apis.metrics import counter, histogram
+    REQUESTS = counter("my_ai_http_requests_total", "HTTP请求数", ("route", "method", "status"))
+    REQUESTS.inc("/chat", "POST", "200")
+    LATENCY = histogram("my_ai_http_request_duration_seconds", "HTTP请求耗时", ("route",))
+    LATENCY.observe(0.12, "/chat")
+
+每个线程写入自己的分片（普通字典，不加锁），只有 render 抓取时才合并各分片，
+记录指标的开销与一次字典更新相当，不会在请求线程之间产生锁竞争。
+线程（包括 eventlet 等协程）退出后其分片在下一个新分片注册或下次抓取时并入汇总分片，
+每个请求一个线程的服务器下分片数量不会随请求数增长。
+"""
+import threading
+import weakref
+from bisect import bisect_left
+from collections import deque
+
+from config import METRICS_CONFIG
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsRegistry:
+    """指标注册表 - 管理指标定义和各线程的数据分片"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._metrics = {}
+        self._shards = {}  # 分片ID -> 分片字典
+        self._next_shard_id = 0
+        self._dead = deque()  # 所属线程已退出、等待合并的分片ID（由垃圾回收回调写入，不加锁）
+        self._retired = {}  # 已退出线程的合并数据
+
+    def register(self, metric):
+        """注册指标，同名指标只注册一次"""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def shard(self):
+        """当前线程的分片 {(指标名, 标签值): 数值或直方图计数列表}"""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            # 线程退出时其 threading.local 数据被释放，哨兵对象随之回收，回调把分片标记为待合并；
+            # 协程环境中 current_thread() 是永远存活的虚拟线程，不能用 is_alive 判断
+            sentinel = self._local.sentinel = _ShardSentinel()
+            with self._lock:
+                self._fold_dead()
+                shard_id = self._next_shard_id
+                self._next_shard_id += 1
+                self._shards[shard_id] = values
+            weakref.finalize(sentinel, self._dead.append, shard_id)
+            return values
+
+    def collect(self):
+        """合并所有分片（已退出线程的分片并入汇总后丢弃）"""
+        with self._lock:
+            self._fold_dead()
+            merged = {}
+            _merge(merged, self._retired)
+            for values in self._shards.values():
+                # dict 复制在 GIL 下是原子操作，不会与分片所属线程的写入冲突
+                _merge(merged, dict(values))
+            metrics = list(self._metrics.values())
+        return metrics, merged
+
+    def _fold_dead(self):
+        """把已退出线程的分片并入汇总数据（需持有锁）"""
+        while self._dead:
+            values = self._shards.pop(self._dead.popleft(), None)
+            if values is not None:
+                _merge(self._retired, values)
+
+    def render(self):
+        """以 Prometheus 文本格式输出所有指标"""
+        metrics, merged = self.collect()
+        series = {}
+        for (name, labels), value in merged.items():
+            series.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for metric in sorted(metrics, key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in sorted(series.get(metric.name, []), key=lambda item: item[0]):
+                lines.extend(metric.format(labels, value))
+        return "\n".join(lines) + "\n"
+
+
+class _ShardSentinel:
+    """随线程局部数据一起释放的哨兵对象，用于发现分片所属线程已退出"""
+    __slots__ = ("__weakref__",)
+
+
+class Counter:
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, *labels, amount=1):
+        """增加计数，标签值按定义顺序传入"""
+        values = self.registry.shard()
+        key = (self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def format(self, labels, value):
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"]
+
+
+class Gauge(Counter):
+    """可增减的仪表（如进行中的流数），各线程分片记录增量，合并后为当前值"""
+
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        """减少数值"""
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    """直方图 - 分片中按分桶记录非累积计数，输出时转换为累积计数"""
+
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=None):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets or METRICS_CONFIG['latency_buckets']))
+
+    def observe(self, value, *labels):
+        """记录一个观测值"""
+        values = self.registry.shard()
+        key = (self.name, labels)
+        counts = values.get(key)
+        if counts is None:
+            # 各分桶计数 + 超出最大分桶的计数 + 总和
+            counts = values[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def format(self, labels, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            bucket_labels = _format_labels(self.labelnames + ("le",), labels + (_format_value(bound),))
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        cumulative += counts[len(self.buckets)]
+        lines.append(f"{self.name}_bucket{_format_labels(self.labelnames + ('le',), labels + ('+Inf',))} {cumulative}")
+        base_labels = _format_labels(self.labelnames, labels)
+        lines.append(f"{self.name}_sum{base_labels} {_format_value(counts[-1])}")
+        lines.append(f"{self.name}_count{base_labels} {cumulative}")
+        return lines
+
+
+def _merge(target, values):
+    """把分片数据累加到 target"""
+    for key, value in values.items():
+        if isinstance(value, list):
+            existing = target.get(key)
+            if existing is None:
+                target[key] = list(value)
+            else:
+                for index, count in enumerate(value):
+                    existing[index] += count
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+def _format_labels(names, values):
+    """格式化标签，如 {route="/chat",method="POST"}"""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    """格式化数值，整数不带小数点"""
+    if isinstance(value, float) and not value.is_integer():
+        return repr(round(value, 6))
+    return str(int(value))
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, documentation, labelnames=()):
+    """在默认注册表中定义计数器"""
+    return REGISTRY.register(Counter(REGISTRY, name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    """在默认注册表中定义仪表"""
+    return REGISTRY.register(Gauge(REGISTRY, name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=None):
+    """在默认注册表中定义直方图"""
+    return REGISTRY.register(Histogram(REGISTRY, name, documentation, labelnames, buckets))
+
+
+def render_metrics():
+    """导出默认注册表中的所有指标"""
+    return REGISTRY.render()
@@ -1,16 +1,20 @@
-from openai import OpenAI
 import os
 import json
+from config import QWEN_CONFIG
+from apis.http_client import UpstreamStream, get_transport
+from apis.retry import acall_with_retry, call_with_retry
+from apis.tracing import traced
 
 class QwenNormalAPI:
     def __init__(self):
         self.api_key = os.getenv('DASHSCOPE_API_KEY')
         if not self.api_key:
             raise RuntimeError('Missing environment variable DASHSCOPE_API_KEY')
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
+        # 通过共享传输层获取客户端，普通模式与深度思考模式复用同一连接池
+        self.transport = get_transport()
+        self.client = self.transport.get_openai_client(self.api_key, QWEN_CONFIG['api_base'])
+        # 异步客户端，供 ASGI 模式在事件循环上使用
+        self.async_client = self.transport.get_async_openai_client(self.api_key, QWEN_CONFIG['api_base'])
     
     def get_model_info(self):
         """
@@ -22,21 +26,28 @@ class QwenNormalAPI:
             "type": "chat"
         }
     
+    @traced("qwen_normal.chat")
     def chat(self, messages, model="qwen-plus-2025-04-28", stream=True, **kwargs):
         """
         调用通义千问API进行普通对话（不开启思考模式）
         """
         try:
-            completion = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                stream=stream,
-                # 普通模式不开启思考
-                extra_body={"enable_thinking": False}
+            # 上游熔断中时立即失败，不等待重试
+            self.transport.check_circuit(QWEN_CONFIG['api_base'])
+            # 同步调用在请求线程中重试，退避总时长受 sync_budget_seconds 限制
+            completion = call_with_retry(
+                lambda: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=stream,
+                    # 普通模式不开启思考
+                    extra_body={"enable_thinking": False}
+                ),
+                name="qwen_normal.chat"
             )
             
             if stream:
-                return self._handle_stream_response(completion)
+                return UpstreamStream(self._handle_stream_response(completion), completion)
             else:
                 # 将OpenAI响应转换为字典格式
                 return {
@@ -75,4 +86,68 @@ class QwenNormalAPI:
                         "usage": chunk.usage
                     }
         except Exception as e:
-            yield {"error": f"流式响应处理失败: {str(e)}"} 
\ No newline at end of file
+            yield {"error": f"流式响应处理失败: {str(e)}"}
+        finally:
+            # 被提前关闭时释放上游连接，模型不再继续生成
+            completion.close()
+    
+    @traced("qwen_normal.achat")
+    async def achat(self, messages, model="qwen-plus-2025-04-28", stream=True, **kwargs):
+        """
+        调用通义千问API进行普通对话（异步版本）
+        """
+        try:
+            # 上游熔断中时立即失败，不等待重试
+            self.transport.check_circuit(QWEN_CONFIG['api_base'])
+            completion = await acall_with_retry(
+                lambda: self.async_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=stream,
+                    extra_body={"enable_thinking": False}
+                ),
+                name="qwen_normal.achat"
+            )
+            
+            if stream:
+                return self._ahandle_stream_response(completion)
+            else:
+                return {
+                    "choices": [{
+                        "message": {
+                            "content": completion.choices[0].message.content,
+                            "role": "assistant"
+                        },
+                        "finish_reason": completion.choices[0].finish_reason
+                    }],
+                    "usage": completion.usage.dict() if hasattr(completion.usage, 'dict') else completion.usage
+                }
+                
+        except Exception as e:
+            return {"error": f"API请求失败: {str(e)}"}
+    
+    async def _ahandle_stream_response(self, completion):
+        """
+        处理流式响应（异步版本）
+        """
+        try:
+            async for chunk in completion:
+                if chunk.choices and len(chunk.choices) > 0:
+                    delta = chunk.choices[0].delta
+                    if hasattr(delta, 'content') and delta.content:
+                        yield {
+                            "choices": [{
+                                "delta": {
+                                    "content": delta.content
+                                }
+                            }]
+                        }
+                elif hasattr(chunk, 'usage') and chunk.usage:
+                    yield {
+                        "usage": chunk.usage
+                    }
+        except Exception as e:
+            yield {"error": f"流式响应处理失败: {str(e)}"}
+        finally:
+            # 被提前关闭时释放上游连接
+            await completion.close()
@@ -1,16 +1,26 @@
-from openai import OpenAI
 import os
 import json
+import logging
+from config import QWEN_CONFIG
+from apis.http_client import UpstreamStream, get_transport
+from apis.retry import acall_with_retry, call_with_retry
+from apis.log import get_logger
+from apis.tracing import traced
+
+logger = get_logger("qwen")
+# 逐 token 的调试日志单独归类，按 LOGGING_CONFIG 采样
+stream_logger = get_logger("stream")
 
 class QwenThinkingAPI:
     def __init__(self):
         self.api_key = os.getenv('DASHSCOPE_API_KEY')
         if not self.api_key:
             raise RuntimeError('Missing environment variable DASHSCOPE_API_KEY')
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
+        # 通过共享传输层获取客户端，普通模式与深度思考模式复用同一连接池
+        self.transport = get_transport()
+        self.client = self.transport.get_openai_client(self.api_key, QWEN_CONFIG['api_base'])
+        # 异步客户端，供 ASGI 模式在事件循环上使用
+        self.async_client = self.transport.get_async_openai_client(self.api_key, QWEN_CONFIG['api_base'])
     
     def get_model_info(self):
         """
@@ -22,11 +32,14 @@ class QwenThinkingAPI:
             "type": "chat"
         }
     
+    @traced("qwen_thinking.chat")
     def chat(self, messages, model="qwen-plus-2025-04-28", stream=True, thinking_budget=None, **kwargs):
         """
         调用通义千问API进行深度思考对话
         """
         try:
+            # 上游熔断中时立即失败，不等待重试
+            self.transport.check_circuit(QWEN_CONFIG['api_base'])
             extra_body = {"enable_thinking": True}
             
             # 如果设置了思考预算，添加到请求中
@@ -34,20 +47,27 @@ class QwenThinkingAPI:
                 extra_body["thinking_budget"] = thinking_budget
             
             if stream:
-                completion = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    stream=True,
-                    extra_body=extra_body
+                # 同步调用在请求线程中重试，退避总时长受 sync_budget_seconds 限制
+                completion = call_with_retry(
+                    lambda: self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        stream=True,
+                        extra_body=extra_body
+                    ),
+                    name="qwen_thinking.chat"
                 )
-                return self._handle_stream_response(completion)
+                return UpstreamStream(self._handle_stream_response(completion), completion)
             else:
                 # 深度思考模式只支持流式调用，我们需要强制使用流式然后收集结果
-                stream_completion = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    stream=True,  # 强制流式
-                    extra_body=extra_body
+                stream_completion = call_with_retry(
+                    lambda: self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        stream=True,  # 强制流式
+                        extra_body=extra_body
+                    ),
+                    name="qwen_thinking.chat"
                 )
                 
                 # 收集所有流式数据
@@ -103,6 +123,8 @@ class QwenThinkingAPI:
             reasoning_content = ""
             answer_content = ""
             is_answering = False
+            # 每个流只判断一次级别，关闭调试日志时逐 token 路径没有额外开销
+            debug = stream_logger.isEnabledFor(logging.DEBUG)
             
             for chunk in completion:
                 if not chunk.choices:
@@ -119,7 +141,8 @@ class QwenThinkingAPI:
                 # 处理思考内容 - 实时输出每一小段思考过程
                 if hasattr(delta, "reasoning_content") and delta.reasoning_content is not None:
                     reasoning_content += delta.reasoning_content
-                    print(f"[DEBUG] 实时发送思考内容: {delta.reasoning_content[:50]}...")  # 调试日志
+                    if debug:
+                        stream_logger.debug("实时发送思考内容: %.50s", delta.reasoning_content)
                     
                     # 实时发送思考内容，不论是否在回答阶段
                     yield {
@@ -132,7 +155,7 @@ class QwenThinkingAPI:
                 if hasattr(delta, "content") and delta.content:
                     if not is_answering:
                         is_answering = True
-                        print(f"[DEBUG] 开始回答，思考内容总长度: {len(reasoning_content)}")  # 调试日志
+                        logger.debug("开始回答，思考内容总长度: %d", len(reasoning_content))
                         
                         # 发送思考阶段结束信号
                         yield {
@@ -141,7 +164,8 @@ class QwenThinkingAPI:
                         }
                     
                     answer_content += delta.content
-                    print(f"[DEBUG] 实时发送回答内容: {delta.content[:30]}...")  # 调试日志
+                    if debug:
+                        stream_logger.debug("实时发送回答内容: %.30s", delta.content)
                     
                     # 实时发送回答内容
                     yield {
@@ -151,7 +175,7 @@ class QwenThinkingAPI:
                     }
             
             # 发送完成信号
-            print(f"[DEBUG] 流式传输完成 - 思考: {len(reasoning_content)}字符, 回答: {len(answer_content)}字符")
+            logger.debug("流式传输完成 - 思考: %d字符, 回答: %d字符", len(reasoning_content), len(answer_content))
             yield {
                 "type": "done",
                 "summary": {
@@ -163,8 +187,139 @@ class QwenThinkingAPI:
             }
             
         except Exception as e:
-            print(f"[ERROR] 流式响应处理异常: {str(e)}")
+            logger.error("流式响应处理异常: %s", e)
             yield {
                 "type": "error",
                 "error": f"流式响应处理失败: {str(e)}"
-            } 
\ No newline at end of file
+            }
+        finally:
+            # 被提前关闭时释放上游连接，模型不再继续生成
+            completion.close()
+    
+    @traced("qwen_thinking.achat")
+    async def achat(self, messages, model="qwen-plus-2025-04-28", stream=True, thinking_budget=None, **kwargs):
+        """
+        调用通义千问API进行深度思考对话（异步版本）
+        """
+        try:
+            # 上游熔断中时立即失败，不等待重试
+            self.transport.check_circuit(QWEN_CONFIG['api_base'])
+            extra_body = {"enable_thinking": True}
+            
+            if thinking_budget:
+                extra_body["thinking_budget"] = thinking_budget
+            
+            # 深度思考模式只支持流式调用
+            completion = await acall_with_retry(
+                lambda: self.async_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    stream=True,
+                    extra_body=extra_body
+                ),
+                name="qwen_thinking.achat"
+            )
+            
+            if stream:
+                return self._ahandle_stream_response(completion)
+            
+            # 非流式请求：收集流式结果后统一返回
+            reasoning_content = ""
+            answer_content = ""
+            usage_info = None
+            
+            async for chunk in completion:
+                if not chunk.choices:
+                    if hasattr(chunk, 'usage') and chunk.usage:
+                        usage_info = chunk.usage
+                    continue
+                
+                delta = chunk.choices[0].delta
+                if hasattr(delta, "reasoning_content") and delta.reasoning_content is not None:
+                    reasoning_content += delta.reasoning_content
+                if hasattr(delta, "content") and delta.content:
+                    answer_content += delta.content
+            
+            result = {
+                "choices": [{
+                    "message": {
+                        "content": answer_content,
+                        "role": "assistant"
+                    },
+                    "finish_reason": "stop"
+                }]
+            }
+            
+            if reasoning_content:
+                result["choices"][0]["message"]["reasoning_content"] = reasoning_content
+            
+            if usage_info:
+                result["usage"] = usage_info.dict() if hasattr(usage_info, 'dict') else usage_info
+            
+            return result
+            
+        except Exception as e:
+            return {"error": f"API请求失败: {str(e)}"}
+    
+    async def _ahandle_stream_response(self, completion):
+        """
+        处理流式响应（异步版本），分别处理思考过程和回复内容
+        """
+        try:
+            reasoning_content = ""
+            answer_content = ""
+            is_answering = False
+            
+            async for chunk in completion:
+                if not chunk.choices:
+                    if hasattr(chunk, 'usage') and chunk.usage:
+                        yield {
+                            "type": "usage",
+                            "usage": chunk.usage
+                        }
+                    continue
+                
+                delta = chunk.choices[0].delta
+                
+                if hasattr(delta, "reasoning_content") and delta.reasoning_content is not None:
+                    reasoning_content += delta.reasoning_content
+                    yield {
+                        "type": "thinking",
+                        "content": delta.reasoning_content,
+                        "total_length": len(reasoning_content)
+                    }
+                
+                if hasattr(delta, "content") and delta.content:
+                    if not is_answering:
+                        is_answering = True
+                        yield {
+                            "type": "thinking_end",
+                            "thinking_summary": reasoning_content
+                        }
+                    
+                    answer_content += delta.content
+                    yield {
+                        "type": "content",
+                        "content": delta.content,
+                        "total_length": len(answer_content)
+                    }
+            
+            yield {
+                "type": "done",
+                "summary": {
+                    "thinking": reasoning_content if reasoning_content else None,
+                    "answer": answer_content if answer_content else None,
+                    "thinking_length": len(reasoning_content),
+                    "answer_length": len(answer_content)
+                }
+            }
+            
+        except Exception as e:
+            logger.error("异步流式响应处理异常: %s", e)
+            yield {
+                "type": "error",
+                "error": f"流式响应处理失败: {str(e)}"
+            }
+        finally:
+            # 被提前关闭时释放上游连接
+            await completion.close()
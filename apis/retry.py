@@ -0,0 +1,397 @@
+"""
+统一重试 - 抖动指数退避、遵守 Retry-After、单次请求的退避预算和全局重试速率上限
+
+重试的等待尽量不占用线程：
+    - 异步调用方使用 aretry_call / acall_with_retry，两次尝试之间在事件循环上等待
+    - 同步的尝试函数用 attempt_once 只执行一次，可重试的失败结果带 retryable 标记，
+      由事件循环上的 aretry_result 在线程池中重新执行，或由调用方（客户端）自行重试
+    - 自行安排下一次执行的调度器（如任务监视器）用 backoff_delay 计算等待时间
+    - 只能在请求线程中完成的同步对话请求用 retry_call / call_with_retry，
+      退避总时长受 sync_budget_seconds 限制（eventlet 部署下等待只让出协程）
+
+用法:
+    from apis.retry import RetryableError, attempt_once, retry_after_seconds
+
+    def attempt(index):
+        response = transport.get(url)
+        if response.status_code in RETRYABLE_STATUS:
+            raise RetryableError({"success": False, "error": "..."}, retry_after_seconds(response))
+        return {"success": True, ...}
+
+    result = attempt_once(attempt, name="cogvideo.query")           # 同步：只尝试一次
+    result = await aretry_result(lambda: attempt_once(attempt))     # 事件循环上：退避后重试
+
+抛出异常的异步调用（如 OpenAI SDK 请求）用 acall_with_retry 包装，
+网络错误和可重试状态码的异常自动重试。
+
+全局重试速率上限是一个令牌桶：每个首次请求存入 budget_ratio 个令牌，每次重试取出一个，
+另外每秒补充 budget_min_per_second 个，上游整体故障时重试量不会超过正常请求量的固定比例。
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+import httpx
+import openai
+import requests
+
+from config import RETRY_CONFIG
+from apis.circuit_breaker import CircuitOpenError
+from apis.log import get_logger
+from apis.metrics import counter
+from apis.tracing import span
+
+logger = get_logger("retry")
+
+RETRY_ATTEMPTS = counter(
+    "my_ai_retry_attempts_total",
+    "重试次数（outcome: retried 已重试，exhausted 次数或预算用尽，throttled 被全局速率上限拒绝，"
+    "deferred 同步调用失败后交给调用方重试）",
+    ("name", "outcome")
+)
+
+# 可以重试的上游状态码
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class RetryableError(Exception):
+    """本次尝试失败但可以重试"""
+
+    def __init__(self, result, retry_after=None):
+        """
+        Args:
+            result: 不再重试时返回给调用方的结果
+            retry_after (float): 上游要求的等待时间（秒），可选
+        """
+        super().__init__(result.get("error") if isinstance(result, dict) else str(result))
+        self.result = result
+        self.retry_after = retry_after
+
+
+class RetryBudget:
+    """全局重试速率上限（令牌桶），防止上游故障时重试放大流量"""
+
+    def __init__(self, config=None):
+        self.config = config or RETRY_CONFIG
+        self._lock = threading.Lock()
+        self._tokens = float(self.config['budget_max_tokens'])
+        self._updated = time.monotonic()
+        self._stats = {"requests": 0, "retries": 0, "throttled": 0}
+
+    def record_request(self):
+        """首次请求存入令牌"""
+        with self._lock:
+            self._stats["requests"] += 1
+            self._refill(self.config['budget_ratio'])
+
+    def try_acquire(self):
+        """
+        为一次重试取出令牌
+
+        Returns:
+            bool: 是否允许重试
+        """
+        with self._lock:
+            self._refill(0)
+            if self._tokens < 1:
+                self._stats["throttled"] += 1
+                return False
+            self._tokens -= 1
+            self._stats["retries"] += 1
+            return True
+
+    def stats(self):
+        """获取重试预算统计"""
+        with self._lock:
+            self._refill(0)
+            return dict(self._stats, tokens=round(self._tokens, 2))
+
+    def _refill(self, deposit):
+        now = time.monotonic()
+        earned = (now - self._updated) * self.config['budget_min_per_second']
+        self._updated = now
+        self._tokens = min(self._tokens + earned + deposit, self.config['budget_max_tokens'])
+
+
+_budget = RetryBudget()
+
+
+class RetryPolicy:
+    """单次请求的重试策略"""
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None, budget_seconds=None, config=None):
+        """
+        Args:
+            max_attempts (int): 最多尝试次数（含首次）
+            base_delay (float): 首次重试的退避上限（秒）
+            max_delay (float): 单次退避上限（秒）
+            budget_seconds (float): 一次请求所有退避的总时长上限（秒）
+            config (dict): 默认值，默认使用 RETRY_CONFIG
+        """
+        config = config or RETRY_CONFIG
+        self.max_attempts = max_attempts or config['max_attempts']
+        self.base_delay = base_delay if base_delay is not None else config['base_delay']
+        self.max_delay = max_delay if max_delay is not None else config['max_delay']
+        self.budget_seconds = budget_seconds if budget_seconds is not None else config['budget_seconds']
+        self.max_retry_after = config['max_retry_after']
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        第 attempt 次失败（从0开始）后的等待时间：完全抖动的指数退避，上游给出 Retry-After 时不早于它
+
+        Returns:
+            float: 等待秒数
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+DEFAULT_POLICY = RetryPolicy()
+# 同步重试在请求线程中等待，退避总时长更短
+SYNC_POLICY = RetryPolicy(budget_seconds=RETRY_CONFIG['sync_budget_seconds'])
+
+
+def attempt_once(attempt_fn, name="upstream"):
+    """
+    同步调用只尝试一次，不在线程中等待重试
+
+    Returns:
+        attempt_fn(0) 的返回值；可重试的失败返回 RetryableError 的 result，
+        dict 结果附带 retryable=True 和上游给出的 retry_after，供调用方安排重试
+    """
+    try:
+        return attempt_fn(0)
+    except RetryableError as e:
+        RETRY_ATTEMPTS.inc(name, "deferred")
+        result = _give_up(e)
+        if isinstance(result, dict):
+            result["retryable"] = True
+        return result
+
+
+def retry_call(attempt_fn, policy=None, name="upstream"):
+    """
+    同步重试 - 两次尝试之间在当前线程中等待，默认使用退避预算较短的 SYNC_POLICY
+
+    Returns:
+        attempt_fn 的返回值；重试次数、退避预算或全局速率上限用尽时返回最后一次 RetryableError 的 result
+    """
+    policy = policy or SYNC_POLICY
+    _budget.record_request()
+    waited = 0.0
+    attempt = 0
+    while True:
+        try:
+            return attempt_fn(attempt)
+        except RetryableError as e:
+            delay = _next_delay(policy, name, attempt, e, waited)
+            if delay is None:
+                return _give_up(e)
+            with span("retry.backoff", target=name, attempt=attempt + 1, delay_s=round(delay, 3)):
+                time.sleep(delay)
+            waited += delay
+            attempt += 1
+
+
+def call_with_retry(fn, policy=None, name="upstream"):
+    """
+    重试抛出异常的同步调用（如 OpenAI SDK、requests 请求），网络错误和可重试状态码的异常自动重试
+
+    Returns:
+        fn() 的结果
+
+    Raises:
+        不可重试的异常立即抛出；重试用尽时抛出最后一次的异常
+    """
+    def attempt(index):
+        try:
+            return fn()
+        except Exception as e:
+            if not is_retryable_exception(e):
+                raise
+            raise _retryable(e) from e
+
+    return _unwrap(retry_call(attempt, policy, name))
+
+
+async def aretry_call(attempt_fn, policy=None, name="upstream"):
+    """
+    异步重试 - 协程函数直接等待，普通函数放到线程池中执行；退避在事件循环上等待，不占用线程
+
+    Returns:
+        attempt_fn 的返回值；重试次数、退避预算或全局速率上限用尽时返回最后一次 RetryableError 的 result
+    """
+    policy = policy or DEFAULT_POLICY
+    _budget.record_request()
+    waited = 0.0
+    attempt = 0
+    while True:
+        try:
+            if asyncio.iscoroutinefunction(attempt_fn):
+                return await attempt_fn(attempt)
+            return await asyncio.to_thread(attempt_fn, attempt)
+        except RetryableError as e:
+            delay = _next_delay(policy, name, attempt, e, waited)
+            if delay is None:
+                return _give_up(e)
+            with span("retry.backoff", target=name, attempt=attempt + 1, delay_s=round(delay, 3)):
+                await asyncio.sleep(delay)
+            waited += delay
+            attempt += 1
+
+
+async def acall_with_retry(fn, policy=None, name="upstream"):
+    """
+    重试抛出异常的异步调用，fn 返回协程；退避在事件循环上等待
+
+    Returns:
+        fn() 的结果
+
+    Raises:
+        不可重试的异常立即抛出；重试用尽时抛出最后一次的异常
+    """
+    async def attempt(index):
+        try:
+            return await fn()
+        except Exception as e:
+            if not is_retryable_exception(e):
+                raise
+            raise _retryable(e) from e
+
+    return _unwrap(await aretry_call(attempt, policy, name))
+
+
+async def aretry_result(fn, policy=None, name="upstream"):
+    """
+    在事件循环上重试同步调用：fn() 在线程池中执行，返回 retryable 的失败结果（见 attempt_once）时
+    在事件循环上退避后重新执行，退避期间不占用线程
+
+    Returns:
+        fn() 的结果；不再重试时返回最后一次的失败结果
+    """
+    def attempt(index):
+        result = fn()
+        if isinstance(result, dict) and result.get("retryable"):
+            raise RetryableError(result, result.get("retry_after"))
+        return result
+
+    return await aretry_call(attempt, policy, name)
+
+
+def backoff_delay(attempt, retry_after=None, policy=None, name="upstream"):
+    """
+    供自行安排下一次执行的调度器使用：计算第 attempt 次失败后的等待时间并占用全局重试令牌
+
+    Returns:
+        float: 等待秒数；被全局速率上限拒绝时返回 None（调用方按正常间隔继续）
+    """
+    policy = policy or DEFAULT_POLICY
+    if not _budget.try_acquire():
+        RETRY_ATTEMPTS.inc(name, "throttled")
+        return None
+    RETRY_ATTEMPTS.inc(name, "retried")
+    return policy.backoff(attempt, retry_after)
+
+
+def _next_delay(policy, name, attempt, error, waited):
+    """决定是否重试，返回等待时间；不再重试时返回 None"""
+    if policy.max_attempts <= 1:
+        return None
+    if attempt + 1 >= policy.max_attempts:
+        RETRY_ATTEMPTS.inc(name, "exhausted")
+        return None
+    delay = policy.backoff(attempt, error.retry_after)
+    if waited + delay > policy.budget_seconds:
+        RETRY_ATTEMPTS.inc(name, "exhausted")
+        logger.info("%s 退避预算用尽（已等待 %.1f 秒），不再重试", name, waited)
+        return None
+    if not _budget.try_acquire():
+        RETRY_ATTEMPTS.inc(name, "throttled")
+        logger.warning("%s 重试被全局速率上限拒绝", name)
+        return None
+    RETRY_ATTEMPTS.inc(name, "retried")
+    logger.warning("%s 第 %d 次尝试失败，%.2f秒后重试: %s", name, attempt + 1, delay, error)
+    return delay
+
+
+def _give_up(error):
+    """不再重试：返回失败结果，上游给出的 Retry-After 一并返回，供调用方安排下一次请求"""
+    result = error.result
+    if isinstance(result, dict) and error.retry_after is not None:
+        result.setdefault("retry_after", round(error.retry_after, 3))
+    return result
+
+
+def _retryable(error):
+    """把可重试的异常包装成 RetryableError，重试用尽时由 _unwrap 重新抛出原异常"""
+    return RetryableError(_Raised(error), retry_after_of(error))
+
+
+class _Raised:
+    """acall_with_retry 用尽重试时的最后一次异常"""
+
+    def __init__(self, error):
+        self.error = error
+
+    def __str__(self):
+        return str(self.error)
+
+
+def _unwrap(result):
+    if isinstance(result, _Raised):
+        raise result.error
+    return result
+
+
+def retry_after_seconds(response):
+    """
+    解析响应的 Retry-After 头（秒数或 HTTP 日期），兼容 requests 和 httpx 的响应
+
+    Returns:
+        float: 等待秒数，没有或无法解析时返回 None
+    """
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        moment = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(moment.timestamp() - time.time(), 0.0)
+
+
+def is_retryable_exception(error):
+    """网络错误、超时和可重试状态码的 SDK/HTTP 异常可以重试；熔断错误不重试"""
+    if isinstance(error, CircuitOpenError) or isinstance(error.__cause__, CircuitOpenError):
+        return False
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    if isinstance(error, (requests.exceptions.HTTPError, httpx.HTTPStatusError)):
+        response = error.response
+        return response is not None and response.status_code in RETRYABLE_STATUS
+    return isinstance(error, (
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+        httpx.TransportError,
+        openai.APIConnectionError
+    ))
+
+
+def retry_after_of(error):
+    """从 SDK 异常中提取 Retry-After"""
+    return retry_after_seconds(getattr(error, "response", None))
+
+
+def retry_stats():
+    """获取全局重试预算统计"""
+    return _budget.stats()
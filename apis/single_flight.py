@@ -0,0 +1,70 @@
+import copy
+import threading
+
+
+class SingleFlight:
+    """合并并发的相同调用 - 同一 key 同一时刻只向上游发出一次请求，其余调用方等待并共享结果"""
+
+    def __init__(self):
+        """初始化"""
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {
+            "calls": 0,
+            "executions": 0,
+            "collapsed": 0
+        }
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        执行调用，相同 key 的并发调用只执行一次
+
+        Args:
+            key: 调用标识
+            fn (callable): 实际执行的函数
+            *args, **kwargs: 传给 fn 的参数
+
+        Returns:
+            fn 返回结果的副本（每个调用方各自一份，可以安全修改）
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {
+                    "event": threading.Event(),
+                    "result": None,
+                    "error": None
+                }
+                self._stats["executions"] += 1
+            else:
+                self._stats["collapsed"] += 1
+
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return copy.deepcopy(call["result"])
+
+        try:
+            call["result"] = fn(*args, **kwargs)
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["event"].set()
+
+        return copy.deepcopy(call["result"])
+
+    def stats(self):
+        """获取合并统计"""
+        with self._lock:
+            calls = self._stats["calls"]
+            return dict(
+                self._stats,
+                in_flight=len(self._calls),
+                collapse_rate=round(self._stats["collapsed"] / calls, 4) if calls else 0
+            )
@@ -0,0 +1,94 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from config import TASK_STATUS_CACHE_CONFIG
+
+# 进入这些状态的任务结果不会再变化，可以永久缓存
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class TaskStatusCache:
+    """任务状态缓存 - 终态结果常驻本地，进行中状态短时缓存"""
+
+    def __init__(self, config=None):
+        """初始化缓存"""
+        self.config = config or TASK_STATUS_CACHE_CONFIG
+        self._lock = threading.Lock()
+        self._pinned = OrderedDict()
+        self._transient = {}
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, task_id):
+        """
+        读取缓存的任务状态
+
+        Returns:
+            dict: 缓存结果的副本，未命中时返回 None
+        """
+        with self._lock:
+            result = self._pinned.get(task_id)
+            if result is not None:
+                self._pinned.move_to_end(task_id)
+                self._hits += 1
+                return copy.deepcopy(result)
+
+            entry = self._transient.get(task_id)
+            if entry is not None:
+                result, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._hits += 1
+                    return copy.deepcopy(result)
+                del self._transient[task_id]
+
+            self._misses += 1
+            return None
+
+    def put(self, task_id, result):
+        """
+        写入任务状态 - 终态永久保留（超出容量时淘汰最久未访问的），
+        进行中状态按TTL过期，查询失败的结果不缓存
+        """
+        status = result.get("status")
+        if status == "error":
+            return
+
+        result = copy.deepcopy(result)
+        with self._lock:
+            if status in TERMINAL_STATUSES:
+                self._transient.pop(task_id, None)
+                self._pinned[task_id] = result
+                self._pinned.move_to_end(task_id)
+                while len(self._pinned) > self.config.get('max_pinned', 10000):
+                    self._pinned.popitem(last=False)
+                return
+
+            ttl = self.config.get('running_ttl', 2)
+            if ttl <= 0:
+                return
+            if len(self._transient) >= self.config.get('max_transient', 10000):
+                self._prune_transient()
+            self._transient[task_id] = (result, time.monotonic() + ttl)
+
+    def stats(self):
+        """获取缓存命中统计"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0,
+                "pinned": len(self._pinned),
+                "transient": len(self._transient)
+            }
+
+    def _prune_transient(self):
+        """清理已过期的进行中状态，仍然过多时全部丢弃"""
+        now = time.monotonic()
+        for task_id, (_, expires_at) in list(self._transient.items()):
+            if expires_at <= now:
+                del self._transient[task_id]
+        if len(self._transient) >= self.config.get('max_transient', 10000):
+            self._transient.clear()
@@ -0,0 +1,497 @@
+"""
+请求链路追踪 - 记录路由、客户端方法、上游HTTP调用和SSE阶段的 span
+
+用法:
+    from apis.tracing import span, traced, current_span
+    with span("cogvideo.create_task", quality=quality):
+        ...
+    @traced("wanx.query_task_status")
+    def query_task_status(self, task_id): ...
+    current_span().add_event("first_byte")
+
+当前 span 保存在 contextvars 中，同一线程或同一异步任务内嵌套的调用自动成为子 span；
+生成器按需用 trace_iter / atrace_iter 包装，每次取值时恢复生成器所属的 span。
+
+尾部采样：一条链路的 span 先缓存在内存中，根 span 结束后再决定是否保留——
+出错或耗时超过 slow_threshold_ms 的链路全部保留，其余按 sample_rate 保留；
+保留的链路放入有界队列，由后台线程写入 JSON lines 文件或以 OTLP/HTTP JSON 格式发送到收集器。
+"""
+import asyncio
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import requests
+
+from config import TRACING_CONFIG
+from apis.log import get_logger
+
+logger = get_logger("tracing")
+
+_current_span = contextvars.ContextVar("my_ai_current_span", default=None)
+
+
+class Span:
+    """一个计时单元，结束时交给 Tracer 汇总到所属链路"""
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "start_time", "_started",
+                 "duration", "attributes", "events", "error")
+
+    recording = True
+
+    def __init__(self, tracer, name, trace_id, parent_id, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_time = time.time()
+        self._started = time.monotonic()
+        self.duration = None
+        self.attributes = attributes
+        self.events = []
+        self.error = None
+
+    def set_attribute(self, key, value):
+        """设置属性"""
+        self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        """记录一个时间点事件（如首字节、思考结束）"""
+        self.events.append((name, time.monotonic() - self._started, attributes))
+
+    def record_error(self, error):
+        """标记为出错"""
+        self.error = str(error) or type(error).__name__
+
+    def end(self):
+        """结束 span（重复调用无效）"""
+        if self.duration is None:
+            self.duration = time.monotonic() - self._started
+            self.tracer._on_end(self)
+
+    def to_dict(self):
+        """转换为导出格式"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start_time, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+            "events": [
+                dict(attributes, name=name, offset_ms=round(offset * 1000, 3))
+                for name, offset, attributes in self.events
+            ]
+        }
+
+
+class _NoopSpan:
+    """追踪关闭或没有当前 span 时使用，所有操作为空"""
+
+    recording = False
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """追踪器 - 按链路缓存已结束的 span，根 span 结束后做尾部采样并交给导出线程"""
+
+    def __init__(self, config=None):
+        self.config = config or TRACING_CONFIG
+        self.enabled = self.config.get('enabled', True)
+        self._lock = threading.Lock()
+        self._open = OrderedDict()  # 链路ID -> 已结束的 span 列表
+        self._decided = OrderedDict()  # 已采样的链路ID -> 是否保留（处理根 span 之后才结束的 span）
+        self._queue = queue.Queue(maxsize=self.config.get('queue_size', 1000))
+        self._worker = None
+        self._session = None
+        self._stats = {
+            "spans": 0,
+            "traces": 0,
+            "kept_traces": 0,
+            "kept_errors": 0,
+            "kept_slow": 0,
+            "evicted_traces": 0,
+            "dropped_exports": 0,
+            "exported_spans": 0,
+            "export_errors": 0
+        }
+
+    def start_span(self, name, attributes=None, parent=None):
+        """
+        开始一个 span（不设为当前 span）
+
+        Args:
+            name (str): span 名称
+            attributes (dict): 属性
+            parent (Span): 父 span，默认为当前 span；没有时开始一条新链路
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        if parent is None:
+            parent = _current_span.get()
+        if parent is not None and parent.recording:
+            return Span(self, name, parent.trace_id, parent.span_id, attributes or {})
+        return Span(self, name, f"{random.getrandbits(128):032x}", None, attributes or {})
+
+    def stats(self):
+        """获取追踪统计"""
+        with self._lock:
+            return dict(
+                self._stats,
+                enabled=self.enabled,
+                exporter=self.config.get('exporter'),
+                open_traces=len(self._open),
+                queued=self._queue.qsize()
+            )
+
+    def flush(self, timeout=5):
+        """等待导出队列写完（进程退出时调用）"""
+        if self._worker is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _on_end(self, span):
+        """span 结束：并入所属链路，根 span 结束时决定整条链路是否保留"""
+        record = span.to_dict()
+        with self._lock:
+            self._stats["spans"] += 1
+            decided = self._decided.get(span.trace_id)
+            if decided is not None:
+                # 根 span 已结束（如在后台继续执行的调用），跟随链路的采样结果
+                if decided:
+                    self._enqueue_locked([record])
+                return
+
+            spans = self._open.get(span.trace_id)
+            if spans is None:
+                spans = self._open[span.trace_id] = []
+                while len(self._open) > self.config.get('max_open_traces', 2000):
+                    self._open.popitem(last=False)
+                    self._stats["evicted_traces"] += 1
+            if len(spans) < self.config.get('max_spans_per_trace', 500):
+                spans.append(record)
+            if span.parent_id is not None:
+                return
+
+            del self._open[span.trace_id]
+            self._stats["traces"] += 1
+            keep = self._should_keep(span, spans)
+            self._decided[span.trace_id] = keep
+            while len(self._decided) > self.config.get('max_open_traces', 2000):
+                self._decided.popitem(last=False)
+            if keep:
+                self._stats["kept_traces"] += 1
+                self._enqueue_locked(spans)
+
+    def _should_keep(self, root, spans):
+        """尾部采样：出错或慢的链路全部保留，其余按比例保留（需持有锁）"""
+        if any(record["status"] == "error" for record in spans):
+            self._stats["kept_errors"] += 1
+            return True
+        if root.duration * 1000 >= self.config.get('slow_threshold_ms', 3000):
+            self._stats["kept_slow"] += 1
+            return True
+        # 按链路ID取样，结果与随机数生成器状态无关
+        return int(root.trace_id[:8], 16) / 0xFFFFFFFF < self.config.get('sample_rate', 0.05)
+
+    def _enqueue_locked(self, records):
+        """放入导出队列，队列满时丢弃（需持有锁）"""
+        try:
+            self._queue.put_nowait(records)
+        except queue.Full:
+            self._stats["dropped_exports"] += 1
+            return
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+            self._worker.start()
+
+    def _export_loop(self):
+        """后台导出线程：按批取出链路并写出"""
+        batch_size = self.config.get('batch_size', 50)
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for trace in batch for record in trace]
+            try:
+                if self.config.get('exporter') == 'otlp':
+                    self._export_otlp(records)
+                else:
+                    self._export_jsonl(records)
+                with self._lock:
+                    self._stats["exported_spans"] += len(records)
+            except Exception as e:
+                with self._lock:
+                    self._stats["export_errors"] += 1
+                logger.error("导出链路失败: %s", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _export_jsonl(self, records):
+        """每个 span 写一行 JSON"""
+        path = self.config.get('jsonl_path')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def _export_otlp(self, records):
+        """以 OTLP/HTTP JSON 格式发送到收集器（不经过共享传输层，避免导出请求本身产生 span）"""
+        if self._session is None:
+            self._session = requests.Session()
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": self.config.get('service_name', 'my_ai')})},
+                "scopeSpans": [{
+                    "scope": {"name": "my_ai.tracing"},
+                    "spans": [_otlp_span(record) for record in records]
+                }]
+            }]
+        }
+        response = self._session.post(self.config.get('otlp_endpoint'), json=payload, timeout=10)
+        response.raise_for_status()
+
+
+def _otlp_attributes(attributes):
+    """转换为 OTLP 属性列表"""
+    converted = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        converted.append({"key": key, "value": typed})
+    return converted
+
+
+def _otlp_span(record):
+    """把导出记录转换为 OTLP span"""
+    start_ns = int(record["start"] * 1e9)
+    span = {
+        "traceId": record["trace_id"],
+        "spanId": record["span_id"],
+        "name": record["name"],
+        "kind": 1,
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int(record["duration_ms"] * 1e6)),
+        "attributes": _otlp_attributes(record["attributes"]),
+        "events": [
+            {
+                "name": event["name"],
+                "timeUnixNano": str(start_ns + int(event["offset_ms"] * 1e6)),
+                "attributes": _otlp_attributes({k: v for k, v in event.items() if k not in ("name", "offset_ms")})
+            }
+            for event in record["events"]
+        ],
+        "status": {"code": 2, "message": record["error"]} if record["error"] else {"code": 1}
+    }
+    if record["parent_id"]:
+        span["parentSpanId"] = record["parent_id"]
+    return span
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """获取进程内共享的追踪器"""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer()
+                atexit.register(_tracer.flush)
+    return _tracer
+
+
+def current_span():
+    """当前 span，没有时返回空操作的 span"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def activate(span):
+    """
+    把 span 设为当前 span
+
+    Returns:
+        恢复用的令牌，传给 deactivate
+    """
+    return _current_span.set(span if span.recording else None)
+
+
+def deactivate(token):
+    """恢复 activate 之前的当前 span"""
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # 生成器在其他上下文中被关闭时令牌已失效
+        pass
+
+
+@contextmanager
+def span(name, **attributes):
+    """开始一个子 span 并设为当前 span，退出时结束；异常会标记为出错后继续抛出"""
+    current = get_tracer().start_span(name, attributes)
+    token = activate(current)
+    try:
+        yield current
+    except (GeneratorExit, asyncio.CancelledError):
+        current.set_attribute("cancelled", True)
+        raise
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        deactivate(token)
+        current.end()
+
+
+def _check_result(current, result):
+    """客户端方法以 {"success": False, "error": ...} 或 {"error": ...} 返回失败，同样标记为出错"""
+    if isinstance(result, dict) and (result.get("success") is False or "error" in result):
+        current.record_error(result.get("error") or "failed")
+
+
+def traced(name):
+    """
+    装饰器：每次调用记录一个 span（支持普通函数和协程函数）
+
+    返回表示失败的结果字典时 span 标记为出错。
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name) as current:
+                    result = await func(*args, **kwargs)
+                    _check_result(current, result)
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = func(*args, **kwargs)
+                _check_result(current, result)
+                return result
+        return wrapper
+    return decorator
+
+
+def run_in_span(iterable, current):
+    """
+    逐项取出可迭代对象，每次取值时以 current 为当前 span，迭代结束或被关闭时结束 current
+
+    生成器可能在另一个上下文中被继续迭代或关闭（如 WSGI 服务器发送流式响应），
+    每一步都单独设置和恢复当前 span，不会泄漏到调用方。
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            token = activate(current)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except Exception as e:
+                current.record_error(e)
+                raise
+            finally:
+                deactivate(token)
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            token = activate(current)
+            try:
+                close()
+            finally:
+                deactivate(token)
+        current.end()
+
+
+async def arun_in_span(iterable, current):
+    """run_in_span 的异步版本"""
+    iterator = iterable.__aiter__()
+    try:
+        while True:
+            token = activate(current)
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            except asyncio.CancelledError:
+                current.set_attribute("cancelled", True)
+                raise
+            except Exception as e:
+                current.record_error(e)
+                raise
+            finally:
+                deactivate(token)
+            yield item
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            token = activate(current)
+            try:
+                await aclose()
+            finally:
+                deactivate(token)
+        current.end()
+
+
+def trace_iter(iterable, name, **attributes):
+    """为生成器记录一个覆盖整个迭代过程的 span（在调用处开始，作为当前 span 的子 span）"""
+    return run_in_span(iterable, get_tracer().start_span(name, attributes))
+
+
+def atrace_iter(iterable, name, **attributes):
+    """trace_iter 的异步版本"""
+    return arun_in_span(iterable, get_tracer().start_span(name, attributes))
+
+
+def tracing_stats():
+    """获取追踪统计"""
+    return get_tracer().stats()
@@ -1,7 +1,20 @@
 import requests
 import json
 import time
+from datetime import datetime
 from config import WANX_CONFIG
+from apis.http_client import get_transport
+from apis.log import get_logger
+from apis.metrics import counter
+from apis.retry import RETRYABLE_STATUS, backoff_delay, retry_after_seconds
+from apis.status_cache import TaskStatusCache
+from apis.single_flight import SingleFlight
+from apis.tracing import traced
+
+logger = get_logger("wanx")
+TASK_POLLS = counter(
+    "my_ai_task_polls_total", "任务状态查询次数（source: cache 命中本地缓存，upstream 访问上游）", ("provider", "source")
+)
 
 class WanxImageAPI:
     """万象文生图API类 - 兼容原有接口"""
@@ -10,6 +23,13 @@ class WanxImageAPI:
         """初始化万象API"""
         from config import WANX_CONFIG
         self.config = WANX_CONFIG
+        self.transport = get_transport()
+        self.status_cache = TaskStatusCache()
+        self.single_flight = SingleFlight()
+        # 等待任务完成的函数（由应用注入，交给后台任务监视器轮询和退避重试）：
+        # task_waiter(task_id, params, started_at, timeout) -> 最终状态dict，超时返回 None；
+        # 未设置时在当前线程轮询（独立脚本使用）
+        self.task_waiter = None
     
     def get_model_info(self):
         """获取模型信息"""
@@ -33,16 +53,20 @@ class WanxImageAPI:
             "size_names": {size["value"]: size["label"] for size in sizes}
         }
     
+    @traced("wanx.generate_image")
     def generate_image(self, prompt, style="<auto>", size="1024*1024", n=1):
         """
         生成图片 - 兼容原有接口
         """
-        result = generate_image_with_wanx(
-            prompt=prompt,
-            style=style,
-            size=size,
-            n=n
-        )
+        if self.task_waiter is not None:
+            result = self._generate_with_waiter(prompt, style, size, n)
+        else:
+            result = generate_image_with_wanx(
+                prompt=prompt,
+                style=style,
+                size=size,
+                n=n
+            )
         
         if result["success"]:
             # 转换为兼容格式
@@ -58,6 +82,34 @@ class WanxImageAPI:
         
         return result
     
+    def _generate_with_waiter(self, prompt, style, size, n):
+        """创建任务后交给注入的 task_waiter 等待，当前线程不轮询上游、不睡眠重试"""
+        started_at = time.time()
+        created = self.create_image_task(prompt, style, size, n)
+        if not created.get("success"):
+            return created
+        
+        task_id = created["task_id"]
+        timeout = self.config.get('generate_deadline', 120)
+        result = self.task_waiter(task_id, {"prompt": prompt, "style": style, "size": size}, started_at, timeout)
+        if result is None:
+            return {
+                "success": False,
+                "error": f"任务执行超时，等待了 {timeout} 秒"
+            }
+        if result.get("status") != "completed":
+            return {
+                "success": False,
+                "error": result.get("error", "图片生成失败")
+            }
+        return {
+            "success": True,
+            "image_urls": result.get("image_urls", []),
+            "task_id": task_id,
+            "usage": result.get("usage", {})
+        }
+    
+    @traced("wanx.create_image_task")
     def create_image_task(self, prompt, style="<auto>", size="1024*1024", n=1):
         """
         创建图片生成任务（不等待结果）
@@ -84,23 +136,23 @@ class WanxImageAPI:
         }
         
         try:
-            print(f"🎨 创建万象文生图任务...")
-            print(f"📝 提示词: {prompt}")
-            print(f"🎭 风格: {style}")
-            print(f"📐 尺寸: {size}")
+            logger.debug("🎨 创建万象文生图任务...")
+            logger.debug("📝 提示词: %s", prompt)
+            logger.debug("🎭 风格: %s", style)
+            logger.debug("📐 尺寸: %s", size)
             
-            response = requests.post(create_url, headers=headers, json=data, timeout=30)
+            response = self.transport.post(create_url, headers=headers, json=data, timeout=30)
             
             if response.status_code != 200:
-                print(f"❌ 创建任务失败: HTTP {response.status_code}")
-                print(f"📄 响应内容: {response.text}")
+                logger.warning("❌ 创建任务失败: HTTP %s", response.status_code)
+                logger.debug("📄 响应内容: %s", response.text)
                 return {
                     "success": False,
                     "error": f"创建任务失败: HTTP {response.status_code}, {response.text}"
                 }
             
             result = response.json()
-            print(f"✅ 任务创建成功: {json.dumps(result, ensure_ascii=False, indent=2)}")
+            logger.info("✅ 任务创建成功: %s", result)
             
             if "output" not in result or "task_id" not in result["output"]:
                 return {
@@ -109,7 +161,7 @@ class WanxImageAPI:
                 }
             
             task_id = result["output"]["task_id"]
-            print(f"📋 任务ID: {task_id}")
+            logger.debug("📋 任务ID: %s", task_id)
             
             return {
                 "success": True,
@@ -138,9 +190,31 @@ class WanxImageAPI:
                 "error": f"未知错误: {str(e)}"
             }
     
+    @traced("wanx.query_task_status")
     def query_task_status(self, task_id):
         """
-        查询任务状态
+        查询任务状态 - 已结束任务直接返回本地缓存，不再访问上游
+        """
+        cached = self.status_cache.get(task_id)
+        if cached is not None:
+            TASK_POLLS.inc("wanx", "cache")
+            return cached
+        
+        # 同一任务的并发查询合并为一次上游请求
+        return self.single_flight.do(task_id, self._fetch_and_cache, task_id)
+    
+    def _fetch_and_cache(self, task_id):
+        """
+        查询上游并写入状态缓存
+        """
+        TASK_POLLS.inc("wanx", "upstream")
+        result = self._fetch_task_status(task_id)
+        self.status_cache.put(task_id, result)
+        return result
+    
+    def _fetch_task_status(self, task_id):
+        """
+        从上游查询任务状态
         """
         api_key = self.config['api_key']
         query_url = f"https://dashscope.aliyuncs.com/api/v1/tasks/{task_id}"
@@ -150,10 +224,10 @@ class WanxImageAPI:
         }
         
         try:
-            response = requests.get(query_url, headers=headers, timeout=30)
+            response = self.transport.get(query_url, headers=headers, timeout=30)
             
             if response.status_code != 200:
-                print(f"❌ 查询任务失败: HTTP {response.status_code}")
+                logger.warning("❌ 查询任务失败: HTTP %s", response.status_code)
                 return {
                     "success": False,
                     "error": f"查询任务失败: HTTP {response.status_code}",
@@ -163,11 +237,11 @@ class WanxImageAPI:
             result = response.json()
             task_status = result.get("output", {}).get("task_status", "UNKNOWN")
             
-            print(f"📊 任务状态: {task_status}")
+            logger.debug("📊 任务状态: %s", task_status)
             
             if task_status == "SUCCEEDED":
                 # 任务成功完成
-                print("✅ 任务执行成功！")
+                logger.info("✅ 任务执行成功！")
                 
                 results = result.get("output", {}).get("results", [])
                 if not results:
@@ -191,7 +265,7 @@ class WanxImageAPI:
                     }
                 
                 usage = result.get("usage", {})
-                print(f"📈 使用统计: {json.dumps(usage, ensure_ascii=False)}")
+                logger.debug("📈 使用统计: %s", usage)
                 
                 return {
                     "success": True,
@@ -200,6 +274,8 @@ class WanxImageAPI:
                     "image_url": image_urls[0] if image_urls else None,
                     "task_id": task_id,
                     "usage": usage,
+                    # 上游记录的提交到结束耗时，任务监视器据此记录完成耗时，不受轮询间隔影响
+                    "upstream_duration": upstream_task_duration(result.get("output", {})),
                     "progress": {
                         "percentage": 100,
                         "message": "图像生成完成！",
@@ -209,7 +285,7 @@ class WanxImageAPI:
             
             elif task_status == "FAILED":
                 # 任务失败
-                print("❌ 任务执行失败")
+                logger.warning("❌ 任务执行失败")
                 error_msg = result.get("output", {}).get("message", "任务执行失败")
                 return {
                     "success": False,
@@ -262,26 +338,25 @@ class WanxImageAPI:
             }
     
     def _calculate_image_progress(self, task_status):
-        """计算图像生成进度"""
+        """
+        根据上游状态给出阶段说明
+        
+        完成百分比和剩余时间与任务已运行时长有关，由应用层根据历史耗时估算后补充。
+        """
         if task_status == "PENDING":
             return {
-                "percentage": 25,
-                "message": "任务已排队，等待处理...",
-                "estimated_time": "预计还需40-70秒"
+                "message": "任务已排队，等待处理..."
             }
         elif task_status == "RUNNING":
             return {
-                "percentage": 65,
-                "message": "AI正在创作图像中...",
-                "estimated_time": "预计还需20-40秒"
+                "message": "AI正在创作图像中..."
             }
         else:
             return {
-                "percentage": 50,
-                "message": "处理中...",
-                "estimated_time": "请稍候..."
+                "message": "处理中..."
             }
     
+    @traced("wanx.chat")
     def chat(self, messages, **kwargs):
         """
         为了兼容统一接口，提供chat方法
@@ -331,6 +406,7 @@ class WanxImageAPI:
                 "error": error_msg
             }
 
+@traced("wanx.generate_image_with_wanx")
 def generate_image_with_wanx(prompt, style="<auto>", size="1024*1024", n=1, negative_prompt=None):
     """
     使用通义万相wanx-v1模型生成图片（官方API v1版本）
@@ -381,23 +457,23 @@ def generate_image_with_wanx(prompt, style="<auto>", size="1024*1024", n=1, nega
     
     try:
         # 发送创建任务请求
-        print(f"🎨 创建万象文生图任务...")
-        print(f"📝 提示词: {prompt}")
-        print(f"🎭 风格: {style}")
-        print(f"📐 尺寸: {size}")
+        logger.debug("🎨 创建万象文生图任务...")
+        logger.debug("📝 提示词: %s", prompt)
+        logger.debug("🎭 风格: %s", style)
+        logger.debug("📐 尺寸: %s", size)
         
-        response = requests.post(create_url, headers=headers, json=data, timeout=30)
+        response = get_transport().post(create_url, headers=headers, json=data, timeout=30)
         
         if response.status_code != 200:
-            print(f"❌ 创建任务失败: HTTP {response.status_code}")
-            print(f"📄 响应内容: {response.text}")
+            logger.warning("❌ 创建任务失败: HTTP %s", response.status_code)
+            logger.debug("📄 响应内容: %s", response.text)
             return {
                 "success": False,
                 "error": f"创建任务失败: HTTP {response.status_code}, {response.text}"
             }
         
         result = response.json()
-        print(f"✅ 任务创建成功: {json.dumps(result, ensure_ascii=False, indent=2)}")
+        logger.info("✅ 任务创建成功: %s", result)
         
         if "output" not in result or "task_id" not in result["output"]:
             return {
@@ -406,7 +482,7 @@ def generate_image_with_wanx(prompt, style="<auto>", size="1024*1024", n=1, nega
             }
         
         task_id = result["output"]["task_id"]
-        print(f"📋 任务ID: {task_id}")
+        logger.debug("📋 任务ID: %s", task_id)
         
         # 步骤2：轮询任务结果
         return poll_task_result(task_id)
@@ -432,14 +508,15 @@ def generate_image_with_wanx(prompt, style="<auto>", size="1024*1024", n=1, nega
             "error": f"未知错误: {str(e)}"
         }
 
-def poll_task_result(task_id, max_wait_time=120, poll_interval=3):
+@traced("wanx.poll_task_result")
+def poll_task_result(task_id, max_wait_time=120, poll_interval=None):
     """
-    轮询任务结果
+    轮询任务结果 - 在当前线程中等待，供独立脚本使用；应用中由任务监视器轮询（见 WanxImageAPI.task_waiter）
     
     Args:
         task_id (str): 任务ID
         max_wait_time (int): 最大等待时间（秒），默认120秒
-        poll_interval (int): 轮询间隔（秒），默认3秒
+        poll_interval (int): 固定轮询间隔（秒），默认使用 WANX_CONFIG['poll_interval']
     
     Returns:
         dict: 包含成功状态和图片URL或错误信息
@@ -452,15 +529,39 @@ def poll_task_result(task_id, max_wait_time=120, poll_interval=3):
     }
     
     start_time = time.time()
+    if poll_interval is None:
+        poll_interval = WANX_CONFIG['poll_interval']
+    
+    errors = 0  # 连续查询失败次数
+
+    def wait_before_next_poll(retry_after=None, failed=False):
+        nonlocal errors
+        elapsed = time.time() - start_time
+        delay = None
+        if failed:
+            # 查询失败按统一的重试退避等待，被全局重试速率上限拒绝时按正常间隔
+            errors += 1
+            delay = backoff_delay(errors - 1, retry_after, name="wanx.poll_task_result")
+        else:
+            errors = 0
+        if delay is None:
+            delay = poll_interval
+        # 不超过剩余的等待时间
+        time.sleep(max(min(delay, max_wait_time - elapsed), 0))
     
-    print(f"⏳ 开始轮询任务结果，最大等待时间: {max_wait_time}秒")
+    logger.debug("⏳ 开始轮询任务结果，最大等待时间: %s秒", max_wait_time)
     
     while time.time() - start_time < max_wait_time:
         try:
-            response = requests.get(query_url, headers=headers, timeout=30)
+            TASK_POLLS.inc("wanx", "upstream")
+            response = get_transport().get(query_url, headers=headers, timeout=30)
             
+            if response.status_code in RETRYABLE_STATUS:
+                logger.warning("❌ 查询任务失败: HTTP %s，稍后重试", response.status_code)
+                wait_before_next_poll(retry_after_seconds(response), failed=True)
+                continue
             if response.status_code != 200:
-                print(f"❌ 查询任务失败: HTTP {response.status_code}")
+                logger.warning("❌ 查询任务失败: HTTP %s", response.status_code)
                 return {
                     "success": False,
                     "error": f"查询任务失败: HTTP {response.status_code}"
@@ -469,11 +570,11 @@ def poll_task_result(task_id, max_wait_time=120, poll_interval=3):
             result = response.json()
             task_status = result.get("output", {}).get("task_status", "UNKNOWN")
             
-            print(f"📊 任务状态: {task_status}")
+            logger.debug("📊 任务状态: %s", task_status)
             
             if task_status == "SUCCEEDED":
                 # 任务成功完成
-                print("✅ 任务执行成功！")
+                logger.info("✅ 任务执行成功！")
                 
                 results = result.get("output", {}).get("results", [])
                 if not results:
@@ -495,7 +596,7 @@ def poll_task_result(task_id, max_wait_time=120, poll_interval=3):
                     }
                 
                 usage = result.get("usage", {})
-                print(f"📈 使用统计: {json.dumps(usage, ensure_ascii=False)}")
+                logger.debug("📈 使用统计: %s", usage)
                 
                 return {
                     "success": True,
@@ -506,7 +607,7 @@ def poll_task_result(task_id, max_wait_time=120, poll_interval=3):
             
             elif task_status == "FAILED":
                 # 任务失败
-                print("❌ 任务执行失败")
+                logger.warning("❌ 任务执行失败")
                 error_msg = result.get("output", {}).get("message", "任务执行失败")
                 return {
                     "success": False,
@@ -516,8 +617,8 @@ def poll_task_result(task_id, max_wait_time=120, poll_interval=3):
             elif task_status in ["PENDING", "RUNNING"]:
                 # 任务进行中，继续等待
                 elapsed = int(time.time() - start_time)
-                print(f"⏱️  任务进行中... 已等待 {elapsed} 秒")
-                time.sleep(poll_interval)
+                logger.debug("⏱️  任务进行中... 已等待 %s 秒", elapsed)
+                wait_before_next_poll()
                 continue
             
             else:
@@ -528,16 +629,17 @@ def poll_task_result(task_id, max_wait_time=120, poll_interval=3):
                 }
                 
         except requests.exceptions.RequestException as e:
-            print(f"❌ 查询请求失败: {str(e)}")
-            time.sleep(poll_interval)
+            logger.warning("❌ 查询请求失败: %s", e)
+            # 熔断中时至少等到熔断器允许试探
+            wait_before_next_poll(getattr(e, "retry_after", None), failed=True)
             continue
         except json.JSONDecodeError as e:
-            print(f"❌ 响应解析失败: {str(e)}")
-            time.sleep(poll_interval)
+            logger.warning("❌ 响应解析失败: %s", e)
+            wait_before_next_poll(failed=True)
             continue
         except Exception as e:
-            print(f"❌ 查询出错: {str(e)}")
-            time.sleep(poll_interval)
+            logger.warning("❌ 查询出错: %s", e)
+            wait_before_next_poll(failed=True)
             continue
     
     # 超时
@@ -547,6 +649,21 @@ def poll_task_result(task_id, max_wait_time=120, poll_interval=3):
         "error": f"任务执行超时，等待了 {elapsed} 秒"
     }
 
+def upstream_task_duration(output):
+    """
+    上游记录的任务耗时：submit_time 到 end_time（两者同一时区，相减即可）
+
+    Returns:
+        float: 秒数，字段缺失或无法解析时返回 None
+    """
+    try:
+        submitted = datetime.fromisoformat(output["submit_time"])
+        ended = datetime.fromisoformat(output["end_time"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    duration = (ended - submitted).total_seconds()
+    return duration if duration >= 0 else None
+
 def get_available_styles():
     """
     获取支持的图片风格列表
@@ -1,15 +1,128 @@
-from flask import Flask, render_template, request, jsonify, Response
+from flask import Flask, render_template, request, jsonify, Response, send_file, redirect, g
 from flask_cors import CORS
+import asyncio
 import json
+import queue
 import time
 from apis.qwen_normal_api import QwenNormalAPI
 from apis.qwen_thinking_api import QwenThinkingAPI
 from apis.hunyuan_new_api import HunyuanAPI
 from apis.wanx_image_api import WanxImageAPI
 from apis.cogvideo_api import CogVideoAPI
+from apis.http_client import get_transport
+from apis.log import get_logger, logging_stats, setup_logging
+from apis.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, counter, gauge, histogram, render_metrics
+from apis.retry import aretry_result, retry_stats
+from apis.single_flight import SingleFlight
+from apis.tracing import activate, current_span, deactivate, get_tracer, run_in_span, trace_iter, tracing_stats
+from services.artifact_store import ArtifactStore
+from services.context_window import ContextWindow, estimate_tokens
+from services.conversation_store import ConversationStore
+from services.conversation_summarizer import ConversationSummarizer, summary_message
+from services.hedged_chat import HedgedChat
+from services.image_variants import ImageVariants
+from services.latency_stats import TaskDurationStats
+from services.model_router import ModelRouter
+from services.poll_scheduler import PollScheduler
+from services.progress_estimator import ProgressEstimator
+from services.response_cache import ResponseCache
+from services.result_store import ResultStore
+from services.similarity_cache import SimilarityCache
+from services.sse_coalescer import AsyncChunkReader, CoalescingStats, SSECoalescer, MERGEABLE_TYPES, READ_END, READ_TIMEOUT
+from services.task_watcher import TaskWatcher
+from services.video_cache import FileRange, VideoCache, plan_video_response
+from config import (
+    ARTIFACT_STORE_CONFIG, CONVERSATION_SUMMARY_CONFIG, HEDGED_CHAT_CONFIG, HUNYUAN_CONFIG, METRICS_CONFIG,
+    MODEL_ROUTER_CONFIG, PROGRESS_ESTIMATOR_CONFIG, QWEN_CONFIG, RESPONSE_CACHE_CONFIG, SIMILARITY_CACHE_CONFIG, SSE_COALESCE_CONFIG,
+    TASK_WATCHER_CONFIG, VIDEO_CACHE_CONFIG, WANX_CONFIG
+)
+
+setup_logging()
+logger = get_logger("app")
+chat_logger = get_logger("chat")
+# 逐 token 的调试日志单独归类，按 LOGGING_CONFIG 采样
+stream_logger = get_logger("stream")
+
+# 运行指标（/metrics）
+HTTP_REQUESTS = counter("my_ai_http_requests_total", "HTTP请求数", ("route", "method", "status"))
+HTTP_LATENCY = histogram(
+    "my_ai_http_request_duration_seconds", "HTTP请求耗时（秒，流式响应计到发送结束）", ("route", "method")
+)
+SSE_STREAMS = gauge("my_ai_sse_streams_in_flight", "进行中的SSE流", ("stream",))
+CHAT_TTFT = histogram(
+    "my_ai_chat_time_to_first_token_seconds", "对话首字延迟（秒，从调用模型到第一个思考或回答增量）", ("model",),
+    METRICS_CONFIG['ttft_buckets']
+)
+CHAT_THROUGHPUT = histogram(
+    "my_ai_chat_tokens_per_second", "对话生成速度（估算 tokens/秒，从第一个增量到回答结束）", ("model",),
+    METRICS_CONFIG['throughput_buckets']
+)
+CHAT_OUTPUT_TOKENS = counter("my_ai_chat_output_tokens_total", "对话生成的 token 数（估算，含思考过程）", ("model",))
 
 app = Flask(__name__)
-CORS(app)  # 启用CORS支持
+# 前端需要读取的对话响应头
+CHAT_EXPOSED_HEADERS = ['X-Session-Id', 'X-Context-Tokens-Saved', 'X-SSE-Coalesce-Ms', 'X-Routed-Model']
+CORS(app, expose_headers=CHAT_EXPOSED_HEADERS)  # 启用CORS支持，允许前端读取对话响应头
+
+def observe_request(method, route, status, elapsed):
+    """记录一次HTTP请求的指标（ASGI 入口直接处理的请求也调用此函数）"""
+    HTTP_REQUESTS.inc(route, method, str(status))
+    HTTP_LATENCY.observe(elapsed, route, method)
+
+@app.before_request
+def start_request_timer():
+    """记录请求开始时间"""
+    g.request_started = time.monotonic()
+
+@app.before_request
+def start_request_span():
+    """开始路由 span，视图中的客户端方法和上游请求都成为它的子 span"""
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.trace_span = get_tracer().start_span(f"{request.method} {route}", {"http.route": route})
+    g.trace_token = activate(g.trace_span)
+
+def is_open_stream(response):
+    """是否为长度未知的流式响应（SSE），这类响应在发送结束后才记录指标和结束 span"""
+    return response.is_streamed and response.content_length is None and not response.direct_passthrough
+
+def observe_streamed_response(iterable, method, route, status, started):
+    """流式响应发送结束（或客户端断开）后记录指标"""
+    try:
+        yield from iterable
+    finally:
+        observe_request(method, route, status, time.monotonic() - started)
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由规则记录请求数和耗时，流式响应在发送结束后记录"""
+    # 使用路由规则而不是实际路径，避免任务ID等参数使指标数量无限增长
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    started = g.get('request_started', time.monotonic())
+    # 只有长度未知的流式响应（SSE）记录到发送结束，其余响应记录到生成响应为止；
+    # 不用 call_on_close，WsgiToAsgi 不会调用响应的 close
+    if is_open_stream(response):
+        response.response = observe_streamed_response(
+            response.response, request.method, route, response.status_code, started
+        )
+    else:
+        observe_request(request.method, route, response.status_code, time.monotonic() - started)
+    return response
+
+@app.after_request
+def end_request_span(response):
+    """结束路由 span，SSE 响应的路由 span 持续到流发送结束"""
+    route_span = g.pop('trace_span', None)
+    if route_span is None:
+        return response
+    deactivate(g.pop('trace_token'))
+    route_span.set_attribute("http.status_code", response.status_code)
+    if response.status_code >= 500:
+        route_span.record_error(f"HTTP {response.status_code}")
+    if is_open_stream(response):
+        response.response = run_in_span(response.response, route_span)
+    else:
+        route_span.end()
+    return response
 
 # 初始化API客户端
 api_clients = {
@@ -19,6 +132,50 @@ api_clients = {
     'wanx': WanxImageAPI(),
     'cogvideo': CogVideoAPI()
 }
+# 最快响应：主模型首字较慢时对冲请求备用模型，先出字的一路胜出
+api_clients['fastest'] = HedgedChat(
+    api_clients[HEDGED_CHAT_CONFIG['primary']],
+    api_clients[HEDGED_CHAT_CONFIG['hedge']]
+)
+# 对话模型的上游地址，用于查询熔断状态
+CHAT_API_BASES = {
+    'qwen_normal': QWEN_CONFIG['api_base'],
+    'qwen_thinking': QWEN_CONFIG['api_base'],
+    'hunyuan': HUNYUAN_CONFIG['api_base']
+}
+
+def chat_upstream_available(model):
+    """对话模型的上游当前是否可用（熔断器未打开）"""
+    api_base = CHAT_API_BASES.get(model)
+    return api_base is None or get_transport().is_available(api_base)
+
+# 自动路由：model 为 "auto" 时按各模型近期的延迟和错误率选择，跳过上游熔断中的模型
+model_router = ModelRouter(
+    [name for name in MODEL_ROUTER_CONFIG['candidates'] if name in api_clients],
+    is_available=chat_upstream_available
+)
+
+# 对话响应缓存：相同的消息、模型和采样参数直接返回缓存的回答
+response_cache = ResponseCache()
+# 近似提示词缓存：单轮提问与已缓存的提问足够相似时复用其回答
+similarity_cache = SimilarityCache()
+# 服务端会话：客户端只发送会话ID和新消息，历史由服务端保存
+conversation_store = ConversationStore()
+# SSE 帧合并统计（合并窗口由每个请求协商）
+sse_coalesce_stats = CoalescingStats()
+# 上下文窗口：按模型预算裁剪转发的历史，长对话的首字延迟不再随轮数增长
+context_window = ContextWindow()
+
+def complete_summary(messages):
+    """用通义千问普通模式生成会话摘要（非流式），失败时返回 None"""
+    result = api_clients['qwen_normal'].chat(messages, model=CONVERSATION_SUMMARY_CONFIG['model'], stream=False)
+    if "error" in result:
+        chat_logger.error("会话摘要请求失败: %s", result['error'])
+        return None
+    return result["choices"][0]["message"]["content"]
+
+# 会话滚动摘要：回答结束后在后台把较早的对话压缩成摘要，不占用下一次请求的时间
+conversation_summarizer = ConversationSummarizer(conversation_store, complete_summary)
 
 @app.route('/')
 def index():
@@ -59,26 +216,32 @@ def get_models():
             'description': '腾讯混元大模型，支持功能增强',
             'features': ['chat', 'stream', 'enhancement']
         },
+        'fastest': {
+            'name': '最快响应',
+            'description': '首字较慢时同时请求备用模型，采用先输出的回答',
+            'features': ['chat', 'stream', 'hedged']
+        },
+        'auto': {
+            'name': '自动选择',
+            'description': '按各模型近期的首字延迟、生成速度和错误率选择最能满足延迟目标的模型',
+            'features': ['chat', 'stream', 'routed'],
+            'candidates': model_router.candidates
+        },
         'default': 'qwen_normal'
     })
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    """处理对话请求"""
-    data = request.json
-    message = data.get('message', '')
-    history = data.get('history', [])
-    model = data.get('model', 'qwen_normal')  # 默认使用通义千问普通模式
-    stream = data.get('stream', True)  # 是否使用流式响应
-    
-    if not message:
-        return jsonify({'error': '消息不能为空'}), 400
-    
-    api_client = api_clients.get(model)
-    if not api_client:
-        return jsonify({'error': f'不支持的模型: {model}'}), 400
-    
-    # 构建messages格式
+SSE_HEADERS = {
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    'Connection': 'keep-alive'
+}
+
+def format_sse(event):
+    """将事件序列化为SSE数据帧"""
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def build_chat_messages(message, history):
+    """根据历史记录和当前消息构建messages格式"""
     messages = []
     for h in history:
         if h.get('user'):
@@ -86,21 +249,248 @@ def chat():
         if h.get('assistant'):
             messages.append({"role": "assistant", "content": h['assistant']})
     messages.append({"role": "user", "content": message})
+    return messages
+
+# 会话不存在时的错误信息，响应 410，客户端据此带上 history 重新发送
+SESSION_EXPIRED_ERROR = '会话已过期或不存在，请带上完整历史（history）重新发送'
+
+def chat_error_response(error):
+    """
+    对话请求校验失败的响应
+    
+    Returns:
+        tuple: (响应数据, 状态码)
+    """
+    if error == SESSION_EXPIRED_ERROR:
+        return {'error': error, 'session_expired': True}, 410
+    return {'error': error}, 400
+
+def parse_chat_request(data, headers=None):
+    """
+    解析并校验对话请求（Flask 和 ASGI 入口共用）
+    
+    Args:
+        data (dict): 请求体
+        headers: 请求头（支持 get 的映射），用于协商 SSE 帧合并窗口
+    
+    Returns:
+        tuple: (请求参数dict, 错误信息) - 校验失败时请求参数为None
+    """
+    data = data or {}
+    message = data.get('message', '')
+    session_id = data.get('session_id')
+    model = data.get('model', 'qwen_normal')  # 默认使用通义千问普通模式
+    stream = data.get('stream', True)  # 是否使用流式响应
+    use_cache = data.get('cache', True) is not False  # 传 false 跳过响应缓存
+    
+    if not message:
+        return None, '消息不能为空'
+    
+    auto_route = model == 'auto' and bool(model_router.candidates)
+    if not auto_route and not api_clients.get(model):
+        return None, f'不支持的模型: {model}'
+    
+    coalesce_ms = data.get('coalesce_ms', headers.get('X-SSE-Coalesce-Ms') if headers else None)
+    if coalesce_ms is None:
+        coalesce_ms = SSE_COALESCE_CONFIG['default_window_ms']
+    try:
+        coalesce_ms = min(max(int(coalesce_ms), 0), SSE_COALESCE_CONFIG['max_window_ms'])
+    except (TypeError, ValueError):
+        return None, 'coalesce_ms 必须是整数（毫秒）'
+    
+    if session_id is not None:
+        if not ConversationStore.is_valid_session_id(session_id):
+            return None, '会话ID格式不正确'
+        snapshot = conversation_store.snapshot(session_id)
+        if snapshot is None:
+            if 'history' not in data:
+                # 会话已过期或不存在：不在没有上下文的情况下回答，客户端收到后带上完整历史重新发送
+                return None, SESSION_EXPIRED_ERROR
+            conversation_store.restore(session_id, data['history'])
+            snapshot = conversation_store.snapshot(session_id) or (None, [])
+        summary, messages = snapshot
+        if summary:
+            messages.insert(0, summary_message(summary))
+        messages.append({"role": "user", "content": message})
+    elif 'history' in data:
+        # 兼容自行发送完整历史的旧客户端，不使用服务端会话
+        messages = build_chat_messages(message, data['history'])
+    else:
+        session_id = ConversationStore.new_session_id()
+        messages = [{"role": "user", "content": message}]
+    
+    # 请求通过全部校验后再路由，被拒绝的请求不记录路由决策、不占用探测名额
+    route = None
+    if auto_route:
+        model, route = model_router.choose()
+        current_span().set_attribute("routed_model", model)
+    
+    messages, context = context_window.fit(model, messages)
+    if context['saved_tokens']:
+        chat_logger.debug("%s 上下文裁剪: %d -> %d tokens，丢弃 %d 条，截断 %d 条", model, context['original_tokens'],
+                          context['tokens'], context['dropped_messages'], context['truncated_messages'])
+    
+    return {
+        'messages': messages,
+        'message': message,
+        'session_id': session_id,
+        'context': context,
+        'model': model,
+        'stream': stream,
+        'cache': use_cache,
+        'coalesce_ms': coalesce_ms,
+        'route': route
+    }, None
+
+def chat_response_headers(chat_request):
+    """对话响应头：会话ID（客户端后续请求带上即可）、上下文裁剪节省的 token 数、实际使用的帧合并窗口和自动路由选中的模型"""
+    headers = {
+        'X-Context-Tokens-Saved': str(chat_request['context']['saved_tokens']),
+        'X-SSE-Coalesce-Ms': str(chat_request['coalesce_ms'])
+    }
+    if chat_request['session_id']:
+        headers['X-Session-Id'] = chat_request['session_id']
+    if chat_request['route']:
+        headers['X-Routed-Model'] = chat_request['model']
+    return headers
+
+def record_chat_turn(chat_request, answer):
+    """会话模式下把本轮问答追加到服务端历史"""
+    if chat_request['session_id'] and answer:
+        conversation_store.append_turn(chat_request['session_id'], chat_request['message'], answer)
+        conversation_summarizer.schedule(chat_request['session_id'])
+
+def stream_answer_text(events):
+    """从流式事件中拼出回答正文"""
+    return ''.join(event.get('content', '') for event in events if event.get('type') == 'content')
+
+def chat_sampling_params(model):
+    """影响模型输出的参数，作为响应缓存键的一部分（配置变更后旧缓存自然失效）"""
+    if model == 'hunyuan':
+        return {
+            'model': HUNYUAN_CONFIG['model'],
+            'temperature': HUNYUAN_CONFIG['temperature'],
+            'max_tokens': HUNYUAN_CONFIG['max_tokens'],
+            'enable_enhancement': HUNYUAN_CONFIG['enable_enhancement']
+        }
+    return {
+        'model': QWEN_CONFIG['model'],
+        'temperature': QWEN_CONFIG['temperature'],
+        'top_p': QWEN_CONFIG['top_p'],
+        'max_tokens': QWEN_CONFIG['max_tokens']
+    }
+
+def chat_cache_key(chat_request, kind):
+    """
+    计算对话请求的缓存键
+    
+    Args:
+        chat_request (dict): parse_chat_request 的结果
+        kind (str): "stream" 或 "json"，两种响应形式分别缓存
+    
+    Returns:
+        str: 缓存键，缓存未启用或请求要求跳过时返回 None
+    """
+    if not RESPONSE_CACHE_CONFIG['enabled']:
+        return None
+    if not chat_request['cache']:
+        response_cache.record_bypass()
+        return None
+    model = chat_request['model']
+    return ResponseCache.make_key(kind, model, chat_request['messages'], chat_sampling_params(model))
+
+def single_turn_prompt(messages):
+    """单轮对话返回提问内容，多轮对话返回 None"""
+    if len(messages) == 1 and messages[0].get('role') == 'user':
+        return messages[0].get('content')
+    return None
+
+def find_cached_response(cache_key, messages, model, kind):
+    """
+    查找缓存的回答 - 先精确匹配，单轮提问再尝试近似匹配
+    
+    Returns:
+        缓存的响应（事件列表或响应字典），未命中时返回 None
+    """
+    cached = response_cache.get(cache_key)
+    if cached is not None or not SIMILARITY_CACHE_CONFIG['enabled']:
+        return cached
+    
+    prompt = single_turn_prompt(messages)
+    if prompt is None:
+        return None
+    similar_prompt = similarity_cache.lookup(model, kind, prompt)
+    if similar_prompt is None:
+        return None
+    similar_key = ResponseCache.make_key(
+        kind, model, [{'role': 'user', 'content': similar_prompt}], chat_sampling_params(model)
+    )
+    # 精确查找已记过一次未命中，这里只查看不计数
+    cached = response_cache.get(similar_key, record=False)
+    if cached is None:
+        # 回答已过期或被淘汰，索引条目随之删除，后续请求不再命中它
+        similarity_cache.discard(model, kind, similar_prompt)
+    else:
+        response_cache.record_similar_hit()
+    return cached
+
+def store_chat_response(cache_key, messages, model, kind, value):
+    """写入响应缓存，单轮提问同时加入对应响应类型的近似匹配索引"""
+    response_cache.put(cache_key, value)
+    if SIMILARITY_CACHE_CONFIG['enabled']:
+        prompt = single_turn_prompt(messages)
+        if prompt is not None:
+            similarity_cache.add(model, kind, prompt)
+
+def is_cacheable_stream(events):
+    """流式响应完整结束且没有错误时才缓存"""
+    return bool(events) and all(event.get('type') != 'error' for event in events)
+
+def complete_chat_stream(events, cache_key, messages, model, on_answer=None):
+    """流式响应结束后写入缓存并回调回答正文，出错的响应两者都跳过"""
+    if not is_cacheable_stream(events):
+        return
+    if cache_key:
+        store_chat_response(cache_key, messages, model, 'stream', events)
+    if on_answer:
+        on_answer(stream_answer_text(events))
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    """处理对话请求"""
+    chat_request, error = parse_chat_request(request.json, request.headers)
+    if error:
+        payload, status_code = chat_error_response(error)
+        return jsonify(payload), status_code
+    
+    messages = chat_request['messages']
+    model = chat_request['model']
+    api_client = api_clients[model]
     
     # 如果是流式响应
-    if stream:
+    if chat_request['stream']:
         return Response(
-            chat_stream_internal(messages, model),
+            trace_iter(
+                chat_stream_internal(
+                    messages, model, chat_cache_key(chat_request, 'stream'),
+                    on_answer=lambda answer: record_chat_turn(chat_request, answer),
+                    coalesce_ms=chat_request['coalesce_ms']
+                ),
+                "chat.stream", model=model
+            ),
             mimetype='text/event-stream',
-            headers={
-                'Content-Type': 'text/event-stream',
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive'
-            }
+            headers=dict(SSE_HEADERS, **chat_response_headers(chat_request))
         )
     
     # 非流式响应
     try:
+        cache_key = chat_cache_key(chat_request, 'json')
+        if cache_key:
+            cached = find_cached_response(cache_key, messages, model, 'json')
+            if cached is not None:
+                record_chat_turn(chat_request, cached.get('response'))
+                return jsonify(cached), 200, chat_response_headers(chat_request)
+        
         result = api_client.chat(messages, stream=False)
         
         if "error" in result:
@@ -124,7 +514,10 @@ def chat():
             if "image_url" in result:
                 response_data['image_url'] = result['image_url']
             
-            return jsonify(response_data)
+            if cache_key:
+                store_chat_response(cache_key, messages, model, 'json', response_data)
+            record_chat_turn(chat_request, response_content)
+            return jsonify(response_data), 200, chat_response_headers(chat_request)
         else:
             return jsonify({
                 'error': '未知的响应格式',
@@ -139,179 +532,423 @@ def chat():
             'model': model
         }), 500
 
-def chat_stream_internal(messages, model):
-    """内部流式响应处理函数"""
+@app.route('/chat/sessions/<session_id>', methods=['DELETE'])
+def delete_chat_session(session_id):
+    """删除服务端会话（前端清空聊天时调用）"""
+    if not ConversationStore.is_valid_session_id(session_id):
+        return jsonify({'error': '会话ID格式不正确', 'status': 'error'}), 400
+    conversation_store.clear(session_id)
+    return jsonify({'status': 'success', 'session_id': session_id})
+
+def convert_stream_chunk(chunk, model):
+    """
+    将模型返回的流式数据块转换为前端事件（同步与异步流共用）
+    
+    Returns:
+        tuple: (事件列表, 是否结束)
+    """
+    if "error" in chunk or chunk.get("type") == "error":
+        error_data = {
+            "type": "error",
+            "error": chunk.get("error", "未知错误"),
+            "model": model
+        }
+        return [error_data], True
+    
+    # 处理新的统一数据格式
+    if "type" in chunk:
+        chunk_type = chunk["type"]
+        
+        # 思考内容 - 实时传输
+        if chunk_type == "thinking":
+            stream_logger.debug("发送思考内容: %.30s", chunk['content'])
+            return [{
+                "type": "thinking",
+                "content": chunk["content"],
+                "model": model,
+                "total_length": chunk.get("total_length", 0)
+            }], False
+        
+        # 思考阶段结束
+        if chunk_type == "thinking_end":
+            chat_logger.debug("思考阶段结束，思考内容长度: %d", len(chunk.get('thinking_summary', '')))
+            return [{
+                "type": "thinking_end",
+                "model": model,
+                "thinking_summary": chunk.get("thinking_summary", "")
+            }], False
+        
+        # 回答内容 - 实时传输
+        if chunk_type == "content":
+            stream_logger.debug("发送回答内容: %.30s", chunk['content'])
+            return [{
+                "type": "content",
+                "content": chunk["content"],
+                "model": model,
+                "total_length": chunk.get("total_length", 0)
+            }], False
+        
+        # 使用情况统计
+        if chunk_type == "usage":
+            return [{
+                "type": "usage",
+                "usage": chunk["usage"],
+                "model": model
+            }], False
+        
+        # 完成信号
+        if chunk_type == "done":
+            chat_logger.debug("流式传输完成: %s", chunk.get('summary', {}))
+            return [{
+                "type": "done",
+                "model": model,
+                "summary": chunk.get("summary", {})
+            }], True
+        
+        return [], False
+    
+    # 兼容旧格式（choices结构）
+    if "choices" in chunk:
+        delta = chunk["choices"][0].get("delta", {})
+        events = []
+        
+        # 检查是否有思考内容（旧格式兼容）
+        if "reasoning_content" in delta:
+            events.append({
+                "type": "thinking",
+                "content": delta["reasoning_content"],
+                "model": model
+            })
+        
+        # 检查是否有回答内容（旧格式兼容）
+        if "content" in delta:
+            events.append({
+                "type": "content",
+                "content": delta["content"],
+                "model": model
+            })
+        return events, False
+    
+    # 处理使用统计（旧格式兼容）
+    if "usage" in chunk:
+        return [{
+            "type": "usage",
+            "usage": chunk["usage"],
+            "model": model
+        }], False
+    
+    return [], False
+
+# 在对话流 span 上记录为时间点事件的流式事件类型（首字节另行记录）
+TRACED_STREAM_EVENTS = ("thinking_end", "done", "error")
+
+def trace_stream_events(stream_span, events):
+    """把流式阶段（思考结束、完成、出错）记录到对话流 span"""
+    for event in events:
+        if event["type"] in TRACED_STREAM_EVENTS:
+            stream_span.add_event(event["type"])
+
+def record_chat_generation(model, events, started, first_token_at):
+    """流式回答结束后记录生成的 token 数和生成速度，并更新自动路由的模型估计"""
+    if any(event.get("type") == "error" for event in events):
+        model_router.observe(model, error=True)
+        return
+    if first_token_at is None:
+        return
+    text = "".join(event.get("content", "") for event in events if event.get("type") in MERGEABLE_TYPES)
+    # 回答正文不会再次出现，直接调用未缓存的估算函数，不占用历史消息的缓存
+    tokens = estimate_tokens.__wrapped__(text)
+    CHAT_OUTPUT_TOKENS.inc(model, amount=tokens)
+    elapsed = time.monotonic() - first_token_at
+    tokens_per_sec = tokens / elapsed if tokens and elapsed > 0 else None
+    if tokens_per_sec:
+        CHAT_THROUGHPUT.observe(tokens_per_sec, model)
+    model_router.observe(model, ttft=first_token_at - started, tokens_per_sec=tokens_per_sec)
+
+def chat_stream_internal(messages, model, cache_key=None, on_answer=None, coalesce_ms=0):
+    """
+    内部流式响应处理函数
+    
+    Args:
+        messages (list): 对话消息
+        model (str): 模型标识
+        cache_key (str): 响应缓存键，可选；命中时按原顺序回放缓存的事件
+        on_answer: 回答完整结束后的回调，参数为回答正文，可选
+        coalesce_ms (int): SSE 帧合并窗口（毫秒），为0时每个增量单独成帧；
+            同步流只在新增量到达时检查窗口是否到期
+    """
     api_client = api_clients.get(model)
     if not api_client:
-        yield f"data: {json.dumps({'type': 'error', 'error': f'不支持的模型: {model}'}, ensure_ascii=False)}\n\n"
+        yield format_sse({'type': 'error', 'error': f'不支持的模型: {model}'})
         return
     
+    coalescer = SSECoalescer(coalesce_ms, SSE_COALESCE_CONFIG['max_bytes'])
+    stream_span = current_span()
+    stream_span.set_attribute("coalesce_ms", coalesce_ms)
+    SSE_STREAMS.inc('chat')
     try:
-        print(f"[DEBUG] 开始流式调用 {model} 模型")
-        
-        # 调用对应的API进行流式响应
-        for chunk in api_client.chat(messages, stream=True):
-            if "error" in chunk or chunk.get("type") == "error":
-                error_data = {
-                    "type": "error",
-                    "error": chunk.get("error", "未知错误"),
-                    "model": model
-                }
-                yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
-                break
+        if cache_key:
+            cached = find_cached_response(cache_key, messages, model, 'stream')
+            stream_span.set_attribute("cache_hit", cached is not None)
+            if cached is not None:
+                chat_logger.info("%s 模型命中响应缓存", model)
+                if on_answer:
+                    on_answer(stream_answer_text(cached))
+                for event in coalescer.push(cached) + coalescer.flush():
+                    yield format_sse(event)
+                return
+        
+        recorded = []
+        completed = False
+        first_token_at = None
+        try:
+            chat_logger.debug("开始流式调用 %s 模型", model)
+            
+            # 调用对应的API进行流式响应
+            started = time.monotonic()
+            stream = api_client.chat(messages, stream=True)
+            if isinstance(stream, dict):
+                # 请求阶段失败时客户端直接返回错误字典
+                stream = [stream]
             
-            # 处理新的统一数据格式
-            if "type" in chunk:
-                chunk_type = chunk["type"]
-                
-                # 思考内容 - 实时传输
-                if chunk_type == "thinking":
-                    thinking_chunk = {
-                        "type": "thinking",
-                        "content": chunk["content"],
-                        "model": model,
-                        "total_length": chunk.get("total_length", 0)
-                    }
-                    print(f"[DEBUG] 发送思考内容: {chunk['content'][:30]}...")
-                    yield f"data: {json.dumps(thinking_chunk, ensure_ascii=False)}\n\n"
-                
-                # 思考阶段结束
-                elif chunk_type == "thinking_end":
-                    thinking_end_chunk = {
-                        "type": "thinking_end",
-                        "model": model,
-                        "thinking_summary": chunk.get("thinking_summary", "")
-                    }
-                    print(f"[DEBUG] 思考阶段结束，思考内容长度: {len(chunk.get('thinking_summary', ''))}")
-                    yield f"data: {json.dumps(thinking_end_chunk, ensure_ascii=False)}\n\n"
-                
-                # 回答内容 - 实时传输
-                elif chunk_type == "content":
-                    content_chunk = {
-                        "type": "content",
-                        "content": chunk["content"],
-                        "model": model,
-                        "total_length": chunk.get("total_length", 0)
-                    }
-                    print(f"[DEBUG] 发送回答内容: {chunk['content'][:30]}...")
-                    yield f"data: {json.dumps(content_chunk, ensure_ascii=False)}\n\n"
-                
-                # 使用情况统计
-                elif chunk_type == "usage":
-                    usage_chunk = {
-                        "type": "usage",
-                        "usage": chunk["usage"],
-                        "model": model
-                    }
-                    yield f"data: {json.dumps(usage_chunk, ensure_ascii=False)}\n\n"
-                
-                # 完成信号
-                elif chunk_type == "done":
-                    done_chunk = {
-                        "type": "done",
-                        "model": model,
-                        "summary": chunk.get("summary", {})
-                    }
-                    print(f"[DEBUG] 流式传输完成: {chunk.get('summary', {})}")
-                    yield f"data: {json.dumps(done_chunk, ensure_ascii=False)}\n\n"
+            for chunk in stream:
+                events, finished = convert_stream_chunk(chunk, model)
+                if first_token_at is None and any(event["type"] in MERGEABLE_TYPES for event in events):
+                    first_token_at = time.monotonic()
+                    CHAT_TTFT.observe(first_token_at - started, model)
+                    stream_span.add_event("first_byte")
+                trace_stream_events(stream_span, events)
+                recorded.extend(events)
+                if finished:
+                    # 在发出完成信号前保存，客户端收到后立即发送下一条消息也能读到本轮历史
+                    completed = True
+                    complete_chat_stream(recorded, cache_key, messages, model, on_answer)
+                for event in coalescer.push(events):
+                    yield format_sse(event)
+                if finished:
                     break
             
-            # 兼容旧格式（choices结构）
-            elif "choices" in chunk:
-                delta = chunk["choices"][0].get("delta", {})
-                
-                # 检查是否有思考内容（旧格式兼容）
-                if "reasoning_content" in delta:
-                    thinking_chunk = {
-                        "type": "thinking",
-                        "content": delta["reasoning_content"],
-                        "model": model
-                    }
-                    yield f"data: {json.dumps(thinking_chunk, ensure_ascii=False)}\n\n"
-                
-                # 检查是否有回答内容（旧格式兼容）
-                if "content" in delta:
-                    content_chunk = {
-                        "type": "content",
-                        "content": delta["content"],
-                        "model": model
-                    }
-                    yield f"data: {json.dumps(content_chunk, ensure_ascii=False)}\n\n"
+            for event in coalescer.flush():
+                yield format_sse(event)
+            chat_logger.debug("%s 模型流式响应处理完成", model)
+            if not completed:
+                complete_chat_stream(recorded, cache_key, messages, model, on_answer)
+            record_chat_generation(model, recorded, started, first_token_at)
+            
+        except Exception as e:
+            error_msg = f'处理请求时发生异常: {str(e)}'
+            chat_logger.error("%s 模型异常: %s", model, error_msg)
+            stream_span.record_error(e)
+            model_router.observe(model, error=True)
             
-            # 处理使用统计（旧格式兼容）
-            elif "usage" in chunk:
-                usage_chunk = {
-                    "type": "usage",
-                    "usage": chunk["usage"],
-                    "model": model
-                }
-                yield f"data: {json.dumps(usage_chunk, ensure_ascii=False)}\n\n"
+            error_chunk = {
+                "type": "error",
+                "error": error_msg,
+                "model": model
+            }
+            for event in coalescer.push([error_chunk]):
+                yield format_sse(event)
+    finally:
+        SSE_STREAMS.dec('chat')
+        sse_coalesce_stats.record(coalescer)
+
+async def achat_stream_internal(messages, model, cache_key=None, on_answer=None, coalesce_ms=0):
+    """内部流式响应处理函数（异步版本，供 ASGI 模式在事件循环上使用；上游停顿时合并缓冲按窗口准时发送）"""
+    api_client = api_clients.get(model)
+    if not api_client or not hasattr(api_client, 'achat'):
+        yield format_sse({'type': 'error', 'error': f'不支持的模型: {model}'})
+        return
+    
+    coalescer = SSECoalescer(coalesce_ms, SSE_COALESCE_CONFIG['max_bytes'])
+    recorded = []
+    completed = False
+    first_token_at = None
+    stream = None
+    reader = None
+    stream_span = current_span()
+    stream_span.set_attribute("coalesce_ms", coalesce_ms)
+    SSE_STREAMS.inc('chat')
+    try:
+        if cache_key:
+            # 磁盘层读取和相似度计算是阻塞调用，放到线程池中执行
+            cached = await asyncio.to_thread(find_cached_response, cache_key, messages, model, 'stream')
+            stream_span.set_attribute("cache_hit", cached is not None)
+            if cached is not None:
+                chat_logger.info("%s 模型命中响应缓存", model)
+                if on_answer:
+                    await asyncio.to_thread(on_answer, stream_answer_text(cached))
+                for event in coalescer.push(cached) + coalescer.flush():
+                    yield format_sse(event)
+                return
         
-        print(f"[DEBUG] {model} 模型流式响应处理完成")
+        chat_logger.debug("开始异步流式调用 %s 模型", model)
+        
+        started = time.monotonic()
+        stream = await api_client.achat(messages, stream=True)
+        if isinstance(stream, dict):
+            model_router.observe(model, error=True)
+            for event in convert_stream_chunk(stream, model)[0]:
+                yield format_sse(event)
+            return
+        
+        reader = AsyncChunkReader(stream)
+        while True:
+            chunk = await reader.read(coalescer.time_until_flush())
+            if chunk is READ_TIMEOUT:
+                # 合并窗口到期但上游还没有新增量，先发送已缓冲的内容
+                for event in coalescer.flush():
+                    yield format_sse(event)
+                continue
+            if chunk is READ_END:
+                break
+            
+            events, finished = convert_stream_chunk(chunk, model)
+            if first_token_at is None and any(event["type"] in MERGEABLE_TYPES for event in events):
+                first_token_at = time.monotonic()
+                CHAT_TTFT.observe(first_token_at - started, model)
+                stream_span.add_event("first_byte")
+            trace_stream_events(stream_span, events)
+            recorded.extend(events)
+            if finished:
+                completed = True
+                await asyncio.to_thread(complete_chat_stream, recorded, cache_key, messages, model, on_answer)
+            for event in coalescer.push(events):
+                yield format_sse(event)
+            if finished:
+                break
+        
+        for event in coalescer.flush():
+            yield format_sse(event)
+        chat_logger.debug("%s 模型异步流式响应处理完成", model)
+        if not completed:
+            await asyncio.to_thread(complete_chat_stream, recorded, cache_key, messages, model, on_answer)
+        record_chat_generation(model, recorded, started, first_token_at)
         
     except Exception as e:
         error_msg = f'处理请求时发生异常: {str(e)}'
-        print(f"[ERROR] {model} 模型异常: {error_msg}")
+        chat_logger.error("%s 模型异常: %s", model, error_msg)
+        stream_span.record_error(e)
+        model_router.observe(model, error=True)
         
-        error_chunk = {
+        for event in coalescer.push([{
             "type": "error",
             "error": error_msg,
             "model": model
-        }
-        yield f"data: {json.dumps(error_chunk, ensure_ascii=False)}\n\n"
+        }]):
+            yield format_sse(event)
+    finally:
+        SSE_STREAMS.dec('chat')
+        sse_coalesce_stats.record(coalescer)
+        # 提前结束（完成信号或客户端断开）时关闭上游连接
+        if reader is not None:
+            await reader.close()
+        if stream is not None and hasattr(stream, 'aclose'):
+            await stream.aclose()
+
+def parse_generate_image_request(data):
+    """
+    解析并校验同步生图请求（Flask 和 ASGI 入口共用）
+    
+    Returns:
+        tuple: (提示词, 尺寸, 错误信息)
+    """
+    data = data or {}
+    prompt = data.get('prompt', '').strip()
+    size = data.get('size', '1024*1024')
+    
+    if not prompt:
+        return prompt, size, '请提供图像描述'
+    
+    # 验证尺寸格式
+    if '*' in size:
+        try:
+            width, height = map(int, size.split('*'))
+            # 验证尺寸是否合理
+            if width < 256 or height < 256 or width > 2048 or height > 2048:
+                return prompt, size, '尺寸必须在256x256到2048x2048之间'
+        except ValueError:
+            return prompt, size, '无效的尺寸格式，请使用"宽*高"格式'
+    
+    return prompt, size, None
+
+def start_image_generation(prompt, size):
+    """
+    创建生图任务并交给任务监视器跟踪
+    
+    Returns:
+        tuple: (任务ID, 错误响应) - 失败时任务ID为None，错误响应为 (数据, 状态码)
+    """
+    wanx_api = api_clients.get('wanx')
+    if not wanx_api:
+        return None, ({
+            'success': False,
+            'error': '图像生成服务暂不可用'
+        }, 500)
+    
+    started_at = time.time()
+    created = wanx_api.create_image_task(prompt, size=size)
+    if not created.get('success'):
+        return None, ({
+            'success': False,
+            'error': created.get('error', '图像生成失败')
+        }, 500)
+    
+    task_id = created['task_id']
+    task_watcher.track('image', task_id, {'prompt': prompt, 'style': '<auto>', 'size': size}, started_at=started_at)
+    return task_id, None
+
+def build_generate_image_response(task_id, prompt, size, result, deadline):
+    """
+    根据任务最终状态构造同步生图响应
+    
+    Returns:
+        tuple: (响应数据, 状态码)
+    """
+    if result is None:
+        return {
+            'success': False,
+            'error': f'任务执行超时，等待了 {deadline} 秒',
+            'task_id': task_id
+        }, 504
+    
+    if result.get('success') and result.get('status') == 'completed':
+        return {
+            'success': True,
+            'image_url': result.get('image_url'),
+            'local_image_url': artifact_url(task_id),
+            'image_variants': image_variant_urls(task_id),
+            'prompt': prompt,
+            'size': size
+        }, 200
+    
+    return {
+        'success': False,
+        'error': result.get('error', '图像生成失败')
+    }, 500
 
 @app.route('/generate-image', methods=['POST'])
 def generate_image():
-    """生成图像API - 支持动态尺寸"""
+    """生成图像API - 支持动态尺寸（等待后台任务完成事件，不在请求线程中轮询）"""
     try:
-        data = request.get_json()
-        prompt = data.get('prompt', '').strip()
-        size = data.get('size', '1024*1024')
-        
-        if not prompt:
+        prompt, size, error = parse_generate_image_request(request.get_json())
+        if error:
             return jsonify({
                 'success': False,
-                'error': '请提供图像描述'
+                'error': error
             }), 400
         
-        # 验证尺寸格式
-        if '*' in size:
-            try:
-                width, height = map(int, size.split('*'))
-                # 验证尺寸是否合理
-                if width < 256 or height < 256 or width > 2048 or height > 2048:
-                    return jsonify({
-                        'success': False,
-                        'error': '尺寸必须在256x256到2048x2048之间'
-                    }), 400
-            except ValueError:
-                return jsonify({
-                    'success': False,
-                    'error': '无效的尺寸格式，请使用"宽*高"格式'
-                }), 400
-        
-        # 调用万象API生成图像
-        wanx_api = api_clients.get('wanx')
-        if not wanx_api:
-            return jsonify({
-                'success': False,
-                'error': '图像生成服务暂不可用'
-            }), 500
-        
-        result = wanx_api.generate_image(prompt, size=size)
+        task_id, error_response = start_image_generation(prompt, size)
+        if error_response:
+            payload, status_code = error_response
+            return jsonify(payload), status_code
         
-        if result.get('success'):
-            return jsonify({
-                'success': True,
-                'image_url': result.get('image_url'),
-                'prompt': prompt,
-                'size': size
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': result.get('error', '图像生成失败')
-            }), 500
+        deadline = WANX_CONFIG['generate_deadline']
+        result = task_watcher.wait('image', task_id, deadline)
+        if result and result.get('status') == 'completed':
+            # 本地副本在完成事件后才开始下载，短暂等待以便响应直接带上本地地址
+            artifact_store.wait(task_id, ARTIFACT_STORE_CONFIG['response_wait'])
+        payload, status_code = build_generate_image_response(task_id, prompt, size, result, deadline)
+        return jsonify(payload), status_code
             
     except Exception as e:
         return jsonify({
@@ -319,23 +956,113 @@ def generate_image():
             'error': f'处理请求时发生异常: {str(e)}'
         }), 500
 
+async def agenerate_image(data):
+    """
+    同步生图的异步实现 - 在事件循环上等待任务完成事件
+    
+    Returns:
+        tuple: (响应数据, 状态码)
+    """
+    try:
+        prompt, size, error = parse_generate_image_request(data)
+        if error:
+            return {'success': False, 'error': error}, 400
+        
+        # 创建任务是一次短的阻塞HTTP调用，放到线程池中执行
+        task_id, error_response = await asyncio.to_thread(start_image_generation, prompt, size)
+        if error_response:
+            return error_response
+        
+        deadline = WANX_CONFIG['generate_deadline']
+        result = await task_watcher.async_wait('image', task_id, deadline)
+        if result and result.get('status') == 'completed':
+            await artifact_store.async_wait(task_id, ARTIFACT_STORE_CONFIG['response_wait'])
+        return build_generate_image_response(task_id, prompt, size, result, deadline)
+        
+    except Exception as e:
+        return {
+            'success': False,
+            'error': f'处理请求时发生异常: {str(e)}'
+        }, 500
+
+def find_reusable_task(kind, params, dedupe):
+    """
+    查找参数完全相同的已完成或进行中的任务
+    
+    Args:
+        kind (str): 任务类型
+        params (dict): 影响生成结果的全部参数
+        dedupe (bool): 请求是否允许复用
+    
+    Returns:
+        tuple: (内容键, 可复用条目) - 不允许复用时内容键为None，未找到时条目为None
+    """
+    if not dedupe:
+        result_store.record_bypass()
+        return None, None
+    
+    content_key = ResultStore.make_key(kind, params)
+    entry = result_store.lookup(content_key)
+    if entry is not None and entry['status'] == 'completed':
+        # 已完成的结果交给监视器，进度查询和事件推送直接返回终态
+        task_watcher.track(kind, entry['task_id'], result=entry['result'])
+    return content_key, entry
+
+def create_generation_task(content_key, create):
+    """
+    创建生成任务 - 相同内容键的并发请求只向上游提交一次
+    
+    Args:
+        content_key (str): 内容键，为None时不合并
+        create (callable): 实际创建任务的函数
+    
+    Returns:
+        dict: 创建结果
+    """
+    if content_key is None:
+        return create()
+    return generation_flight.do(content_key, create)
+
 @app.route('/text-to-image', methods=['POST'])
 def text_to_image():
-    """处理文生图请求 - 创建任务并返回任务ID"""
+    """处理文生图请求 - 创建任务并返回任务ID（相同参数的请求复用已有任务）"""
     data = request.json
     prompt = data.get('prompt', '')
     style = data.get('style', '<auto>')
     size = data.get('size', '1024*1024')
+    dedupe = data.get('dedupe', True) is not False  # 传 false 强制重新生成
     
     if not prompt:
         return jsonify({'error': '提示词不能为空'}), 400
     
     try:
+        params = {'prompt': prompt, 'style': style, 'size': size}
+        content_key, reused = find_reusable_task('image', params, dedupe)
+        if reused:
+            response_data = {
+                'task_id': reused['task_id'],
+                'status': reused['status'],
+                'prompt': prompt,
+                'style': style,
+                'size': size,
+                'deduplicated': True,
+                'message': '相同参数的任务已存在，复用其结果'
+            }
+            if reused['status'] == 'completed':
+                response_data['image_url'] = reused['result'].get('image_url')
+                response_data['local_image_url'] = artifact_url(reused['task_id'])
+                response_data['image_variants'] = image_variant_urls(reused['task_id'])
+            return jsonify(response_data)
+        
         wanx_api = api_clients['wanx']
         # 只创建任务，不等待结果
-        result = wanx_api.create_image_task(prompt, style, size)
+        started_at = time.time()
+        result = create_generation_task(content_key, lambda: wanx_api.create_image_task(prompt, style, size))
         
         if result['success']:
+            task_watcher.track('image', result['task_id'], params, started_at=started_at)
+            if content_key:
+                result_store.attach(content_key, 'image', result['task_id'])
             return jsonify({
                 'task_id': result['task_id'],
                 'status': 'pending',
@@ -388,133 +1115,228 @@ def get_image_styles():
             'default_size': '1024*1024'
         })
 
+def parse_create_video_request(data):
+    """
+    解析并校验创建视频请求（Flask 和 ASGI 入口共用）
+    
+    Returns:
+        tuple: (请求参数dict, 错误响应) - 校验失败时请求参数为None，错误响应为 (数据, 状态码)
+    """
+    if not data:
+        return None, ({
+            'error': '请求数据为空',
+            'status': 'error'
+        }, 400)
+    
+    prompt = data.get('prompt', '').strip()
+    image_url = data.get('image_url', '').strip()
+    quality = data.get('quality', 'speed')
+    size = data.get('size', '1920x1080')
+    duration = data.get('duration', 5)
+    fps = data.get('fps', 30)
+    with_audio = data.get('with_audio', False)
+    dedupe = data.get('dedupe', True) is not False  # 传 false 强制重新生成
+    
+    logger.info("🎬 接收到视频生成请求", extra={'fields': {
+        'prompt': prompt, 'image_url': image_url, 'quality': quality, 'size': size,
+        'duration': duration, 'fps': fps, 'with_audio': with_audio
+    }})
+    
+    # 参数验证
+    if not prompt and not image_url:
+        return None, ({
+            'error': '请提供视频描述文本或基础图片',
+            'status': 'error'
+        }, 400)
+    
+    if prompt and len(prompt) > 1500:
+        return None, ({
+            'error': f'视频描述过长（{len(prompt)}字符），最多支持1500字符',
+            'status': 'error'
+        }, 400)
+    
+    # 验证质量、尺寸等参数
+    supported_options = api_clients['cogvideo'].get_supported_options()
+    
+    if quality not in supported_options["qualities"]:
+        return None, ({
+            'error': f'不支持的质量模式: {quality}，支持的模式: {supported_options["qualities"]}',
+            'status': 'error'
+        }, 400)
+    
+    if size not in supported_options["sizes"]:
+        return None, ({
+            'error': f'不支持的分辨率: {size}，支持的分辨率: {supported_options["sizes"]}',
+            'status': 'error'
+        }, 400)
+    
+    if fps not in supported_options["fps_options"]:
+        return None, ({
+            'error': f'不支持的帧率: {fps}，支持的帧率: {supported_options["fps_options"]}',
+            'status': 'error'
+        }, 400)
+    
+    if duration not in supported_options["durations"]:
+        return None, ({
+            'error': f'不支持的时长: {duration}，支持的时长: {supported_options["durations"]}',
+            'status': 'error'
+        }, 400)
+    
+    return {
+        'prompt': prompt,
+        'image_url': image_url,
+        'quality': quality,
+        'size': size,
+        'fps': fps,
+        'duration': duration,
+        'with_audio': with_audio,
+        'dedupe': dedupe
+    }, None
+
+def find_reusable_video(video_request):
+    """
+    查找参数相同的视频任务
+    
+    Returns:
+        tuple: (内容键, 复用响应) - 没有可复用的任务时复用响应为None
+    """
+    params = {key: value for key, value in video_request.items() if key != 'dedupe'}
+    content_key, reused = find_reusable_task('video', params, video_request['dedupe'])
+    if not reused:
+        return content_key, None
+    
+    logger.info("♻️ 复用相同参数的视频任务: %s", reused['task_id'])
+    response_data = dict(
+        params,
+        task_id=reused['task_id'],
+        status='completed' if reused['status'] == 'completed' else 'processing',
+        deduplicated=True,
+        message='相同参数的视频任务已存在，复用其结果'
+    )
+    if reused['status'] == 'completed':
+        response_data['video_url'] = reused['result'].get('video_url')
+        response_data['local_video_url'] = f"/videos/{reused['task_id']}"
+        response_data['cover_image_url'] = reused['result'].get('cover_image_url')
+    return content_key, response_data
+
+def create_video_once(video_request, content_key):
+    """向上游创建视频任务（只尝试一次，相同内容键的并发请求只提交一次）"""
+    cogvideo_api = api_clients['cogvideo']
+    return create_generation_task(content_key, lambda: cogvideo_api.create_video_task(
+        prompt=video_request['prompt'],
+        image_url=video_request['image_url'],
+        quality=video_request['quality'],
+        size=video_request['size'],
+        fps=video_request['fps'],
+        duration=video_request['duration'],
+        with_audio=video_request['with_audio']
+    ))
+
+def build_create_video_response(video_request, content_key, result, started_at):
+    """
+    根据创建结果开始跟踪任务并构造响应
+    
+    Returns:
+        tuple: (响应数据, 状态码)
+    """
+    logger.debug("🔄 API 调用结果: %s", result)
+    params = {key: value for key, value in video_request.items() if key != 'dedupe'}
+    
+    if result['success']:
+        logger.info("✅ 任务创建成功: %s", result['task_id'])
+        task_watcher.track('video', result['task_id'], {
+            'quality': params['quality'],
+            'size': params['size'],
+            'fps': params['fps'],
+            'duration': params['duration'],
+            'with_audio': params['with_audio']
+        }, started_at=started_at)
+        if content_key:
+            result_store.attach(content_key, 'video', result['task_id'])
+        
+        return dict(
+            params,
+            task_id=result['task_id'],
+            status=result.get('status', 'processing'),
+            model=result.get('model', 'cogvideox-3'),
+            request_id=result.get('request_id'),
+            task_status=result.get('task_status', 'PROCESSING'),
+            message='视频生成任务创建成功，请使用task_id查询结果',
+            estimated_time=estimate_task_progress('video', result['task_id'])['estimated_time'].replace('预计还需', '预计生成时间: ')
+        ), 200
+    
+    error_msg = result.get('error', '视频生成任务创建失败')
+    status_code = result.get('status_code', 500)
+    logger.warning("❌ 任务创建失败: %s", error_msg)
+    
+    payload = {
+        'error': error_msg,
+        'status': 'error',
+        'error_code': result.get('error_code', 'unknown'),
+        'status_code': status_code
+    }
+    if result.get('retryable'):
+        # 上游暂时不可用：客户端可按 retry_after 重新提交
+        payload['retryable'] = True
+        payload['retry_after'] = result.get('retry_after')
+    return payload, status_code
+
+def video_creation_error(e):
+    """创建视频时发生异常的响应"""
+    error_msg = f'处理视频生成请求时发生异常: {str(e)}'
+    logger.exception("❌ %s", error_msg)
+    return {
+        'error': error_msg,
+        'status': 'error'
+    }, 500
+
 @app.route('/create-video', methods=['POST'])
 def create_video():
-    """创建视频生成任务"""
+    """创建视频生成任务（只向上游提交一次，可重试的失败返回 retry_after 由客户端重试，不占用请求线程等待）"""
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({
-                'error': '请求数据为空',
-                'status': 'error'
-            }), 400
-            
-        prompt = data.get('prompt', '').strip()
-        image_url = data.get('image_url', '').strip()
-        quality = data.get('quality', 'speed')
-        size = data.get('size', '1920x1080')
-        duration = data.get('duration', 5)
-        fps = data.get('fps', 30)
-        with_audio = data.get('with_audio', False)
-        
-        print(f"🎬 接收到视频生成请求:")
-        print(f"   - 提示词: {prompt}")
-        print(f"   - 图片URL: {image_url}")
-        print(f"   - 质量: {quality}")
-        print(f"   - 尺寸: {size}")
-        print(f"   - 时长: {duration}秒")
-        print(f"   - 帧率: {fps}")
-        print(f"   - 音频: {with_audio}")
-        
-        # 参数验证
-        if not prompt and not image_url:
-            return jsonify({
-                'error': '请提供视频描述文本或基础图片',
-                'status': 'error'
-            }), 400
+        video_request, error_response = parse_create_video_request(request.get_json())
+        if error_response:
+            payload, status_code = error_response
+            return jsonify(payload), status_code
         
-        if prompt and len(prompt) > 1500:
-            return jsonify({
-                'error': f'视频描述过长（{len(prompt)}字符），最多支持1500字符',
-                'status': 'error'
-            }), 400
+        content_key, reused_response = find_reusable_video(video_request)
+        if reused_response:
+            return jsonify(reused_response)
         
-        # 验证质量、尺寸等参数
-        cogvideo_api = api_clients['cogvideo']
-        supported_options = cogvideo_api.get_supported_options()
-        
-        if quality not in supported_options["qualities"]:
-            return jsonify({
-                'error': f'不支持的质量模式: {quality}，支持的模式: {supported_options["qualities"]}',
-                'status': 'error'
-            }), 400
-        
-        if size not in supported_options["sizes"]:
-            return jsonify({
-                'error': f'不支持的分辨率: {size}，支持的分辨率: {supported_options["sizes"]}',
-                'status': 'error'
-            }), 400
-        
-        if fps not in supported_options["fps_options"]:
-            return jsonify({
-                'error': f'不支持的帧率: {fps}，支持的帧率: {supported_options["fps_options"]}',
-                'status': 'error'
-            }), 400
-        
-        if duration not in supported_options["durations"]:
-            return jsonify({
-                'error': f'不支持的时长: {duration}，支持的时长: {supported_options["durations"]}',
-                'status': 'error'
-            }), 400
+        started_at = time.time()
+        result = create_video_once(video_request, content_key)
+        payload, status_code = build_create_video_response(video_request, content_key, result, started_at)
+        return jsonify(payload), status_code
+            
+    except Exception as e:
+        payload, status_code = video_creation_error(e)
+        return jsonify(payload), status_code
+
+async def acreate_video(data):
+    """
+    创建视频任务的异步实现 - 每次提交是一次短的阻塞HTTP调用，放到线程池中执行；
+    可重试的失败在事件循环上退避后重新提交，等待期间不占用线程
+    
+    Returns:
+        tuple: (响应数据, 状态码)
+    """
+    try:
+        video_request, error_response = parse_create_video_request(data)
+        if error_response:
+            return error_response
         
-        print(f"📡 调用 GLM CogVideo API...")
+        content_key, reused_response = await asyncio.to_thread(find_reusable_video, video_request)
+        if reused_response:
+            return reused_response, 200
         
-        result = cogvideo_api.create_video_task(
-            prompt=prompt,
-            image_url=image_url,
-            quality=quality,
-            size=size,
-            fps=fps,
-            duration=duration,
-            with_audio=with_audio
+        started_at = time.time()
+        result = await aretry_result(
+            lambda: create_video_once(video_request, content_key), name="cogvideo.create_video_task"
         )
+        return await asyncio.to_thread(build_create_video_response, video_request, content_key, result, started_at)
         
-        print(f"🔄 API 调用结果: {result}")
-        
-        if result['success']:
-            print(f"✅ 任务创建成功: {result['task_id']}")
-            
-            response_data = {
-                'task_id': result['task_id'],
-                'status': result.get('status', 'processing'),
-                'prompt': prompt,
-                'image_url': image_url,
-                'quality': quality,
-                'size': size,
-                'duration': duration,
-                'fps': fps,
-                'with_audio': with_audio,
-                'model': result.get('model', 'cogvideox-3'),
-                'request_id': result.get('request_id'),
-                'task_status': result.get('task_status', 'PROCESSING'),
-                'message': '视频生成任务创建成功，请使用task_id查询结果',
-                'estimated_time': f"预计生成时间: {duration * 10}-{duration * 20}秒"  # 估算时间
-            }
-            
-            return jsonify(response_data)
-        else:
-            error_msg = result.get('error', '视频生成任务创建失败')
-            status_code = result.get('status_code', 500)
-            error_code = result.get('error_code', 'unknown')
-            
-            print(f"❌ 任务创建失败: {error_msg}")
-            
-            return jsonify({
-                'error': error_msg,
-                'status': 'error',
-                'error_code': error_code,
-                'status_code': status_code
-            }), status_code
-            
     except Exception as e:
-        error_msg = f'处理视频生成请求时发生异常: {str(e)}'
-        print(f"❌ 异常: {error_msg}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'error': error_msg,
-            'status': 'error'
-        }), 500
+        return video_creation_error(e)
 
 @app.route('/video-task-status/<task_id>', methods=['GET'])
 def get_video_task_status(task_id):
@@ -526,11 +1348,9 @@ def get_video_task_status(task_id):
                 'status': 'error'
             }), 400
         
-        print(f"📊 查询视频任务状态: {task_id}")
         cogvideo_api = api_clients['cogvideo']
         result = cogvideo_api.query_task_status(task_id)
-        
-        print(f"📋 任务状态查询结果: {result}")
+        logger.debug("📋 视频任务 %s 状态查询结果: %s", task_id, result)
         
         # 添加额外信息
         if result.get('success') and result.get('status') == 'completed':
@@ -545,9 +1365,7 @@ def get_video_task_status(task_id):
         
     except Exception as e:
         error_msg = f'查询视频任务状态时发生异常: {str(e)}'
-        print(f"❌ 状态查询异常: {error_msg}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 状态查询异常: %s", error_msg)
         return jsonify({
             'error': error_msg,
             'status': 'error'
@@ -581,6 +1399,230 @@ def get_video_options():
             'default_duration': 5
         })
 
+def estimate_task_progress(kind, task_id):
+    """根据任务已运行时间和同类任务的历史耗时估算进度"""
+    task = task_watcher.get_task(kind, task_id)
+    if task is None:
+        # 尚未跟踪的任务不知道何时创建，按刚开始估算
+        return progress_estimator.estimate(kind, {}, 0)
+    return progress_estimator.estimate(kind, task['params'], time.time() - task['created_at'])
+
+def decorate_image_progress(result, task_id):
+    """根据文生图任务状态添加进度信息"""
+    if result.get('success'):
+        if result.get('status') == 'running':
+            progress = dict(result.get('progress') or {})
+            progress.setdefault('message', '图像正在生成中...')
+            progress.update(estimate_task_progress('image', task_id))
+            result['progress'] = progress
+        elif result.get('status') == 'completed':
+            result['progress'] = {
+                'percentage': 100,
+                'message': '图像生成完成！',
+                'estimated_time': '已完成'
+            }
+            # 本地副本下载完成后提供，上游链接过期后仍可访问
+            local_image_url = artifact_url(task_id)
+            if local_image_url:
+                result['local_image_url'] = local_image_url
+            variants = image_variant_urls(task_id)
+            if variants:
+                result['image_variants'] = variants
+    return result
+
+def decorate_video_progress(result, task_id):
+    """根据视频任务状态添加详细进度信息"""
+    if result.get('success'):
+        if result.get('status') == 'processing':
+            progress = dict(result.get('progress') or {})
+            progress.setdefault('message', '视频正在生成中，请耐心等待...')
+            progress.setdefault('current_stage', '视频渲染中')
+            progress.update(estimate_task_progress('video', task_id))
+            result['progress'] = progress
+        elif result.get('status') == 'completed':
+            result['progress'] = {
+                'percentage': 100,
+                'message': '视频生成完成！',
+                'estimated_time': '已完成',
+                'current_stage': '完成'
+            }
+            # 本地代理地址：缓存完成前重定向到上游，完成后从本地文件提供并支持 Range
+            result['local_video_url'] = f'/videos/{task_id}'
+    return result
+
+PROGRESS_DECORATORS = {
+    'image': decorate_image_progress,
+    'video': decorate_video_progress
+}
+
+def refresh_progress(kind, task_id, result):
+    """按当前时间重新估算进行中任务的进度（监视器中的状态只在轮询时更新）"""
+    return PROGRESS_DECORATORS[kind](result, task_id)
+
+def fetch_image_task(task_id):
+    """查询文生图任务状态并附加进度（供任务监视器调用）"""
+    return decorate_image_progress(api_clients['wanx'].query_task_status(task_id), task_id)
+
+def fetch_video_task(task_id):
+    """查询视频任务状态并附加进度（供任务监视器调用，查询失败由监视器退避后重新查询）"""
+    return decorate_video_progress(api_clients['cogvideo'].query_task_status(task_id), task_id)
+
+# 后台任务监视器：每个进行中的任务只由服务端轮询一次，浏览器通过 /tasks/events 接收推送
+# 轮询节奏按历史完成耗时自适应调整
+task_durations = TaskDurationStats()
+poll_scheduler = PollScheduler(task_durations)
+progress_estimator = ProgressEstimator(task_durations)
+task_watcher = TaskWatcher(scheduler=poll_scheduler)
+# 生成结果去重：任务完成或失败时由监视器通知
+result_store = ResultStore()
+generation_flight = SingleFlight()
+task_watcher.subscribe(result_store.on_task_event)
+
+# 本地生成结果存储：图像任务完成后在后台下载到本地
+artifact_store = ArtifactStore()
+
+def on_image_completed(event):
+    """任务监视器回调：图像任务完成时下载图片到本地"""
+    result = event['result'] or {}
+    if event['kind'] == 'image' and event['status'] == 'completed' and result.get('image_url'):
+        artifact_store.fetch_async(event['task_id'], result['image_url'])
+
+task_watcher.subscribe(on_image_completed, None)
+
+def artifact_url(task_id):
+    """任务图片的本地地址，尚未下载完成时返回 None"""
+    digest = artifact_store.lookup(task_id)
+    return f'/artifacts/{digest}' if digest else None
+
+# 图片派生版本：原图保存到本地后在进程池中生成缩略图和多宽度 WebP
+image_variants = ImageVariants()
+
+def on_artifact_saved(ref, digest, path):
+    """本地存储回调：原图保存完成后生成派生版本"""
+    image_variants.generate_async(digest, path)
+
+artifact_store.subscribe(on_artifact_saved)
+
+def image_variant_urls(task_id):
+    """任务图片的缩略图和 srcset 地址，尚未生成时返回 None"""
+    digest = artifact_store.lookup(task_id)
+    return image_variants.describe(digest) if digest else None
+
+# 本地视频缓存：视频任务完成后在后台下载，浏览器拖动进度条时的 Range 请求由本地文件响应
+video_cache = VideoCache()
+
+def on_video_completed(event):
+    """任务监视器回调：视频任务完成时下载视频到本地"""
+    result = event['result'] or {}
+    if event['kind'] == 'video' and event['status'] == 'completed' and result.get('video_url'):
+        video_cache.fetch_async(event['task_id'], result['video_url'])
+
+task_watcher.subscribe(on_video_completed, None)
+
+def upstream_video_url(task_id):
+    """监视器中已完成视频任务的上游地址"""
+    result = task_watcher.get('video', task_id)
+    if result and result.get('status') == 'completed':
+        return result.get('video_url')
+    return None
+
+def wait_image_task(task_id, params, started_at, timeout):
+    """等待生图任务完成（注入万象客户端，由任务监视器轮询上游）"""
+    task_watcher.track('image', task_id, params, started_at=started_at)
+    return task_watcher.wait('image', task_id, timeout)
+
+api_clients['wanx'].task_waiter = wait_image_task
+task_watcher.register('image', fetch_image_task, TASK_WATCHER_CONFIG['image_poll_interval'])
+task_watcher.register('video', fetch_video_task, TASK_WATCHER_CONFIG['video_poll_interval'])
+
+def get_watched_task(kind, task_id, fetcher):
+    """优先返回监视器中的最新状态，未跟踪的任务查询一次后交给监视器"""
+    result = task_watcher.get(kind, task_id)
+    if result is None:
+        result = fetcher(task_id)
+        if result.get('status') != 'error':
+            task_watcher.track(kind, task_id, result=result)
+    else:
+        result = refresh_progress(kind, task_id, result)
+    
+    # 提示客户端下一次有新状态的时间，轮询模式下与服务端查询节奏对齐；
+    # 上游查询间隔较长时也按进度刷新间隔返回，让进度条平滑前进
+    next_poll_in = task_watcher.next_poll_in(kind, task_id)
+    if next_poll_in is not None:
+        next_poll_in = min(next_poll_in, PROGRESS_ESTIMATOR_CONFIG['refresh_interval'])
+        result['next_poll_ms'] = int(next_poll_in * 1000) + 200
+    return result
+
+@app.route('/videos/<task_id>', methods=['GET'])
+def get_video(task_id):
+    """提供缓存的视频 - 支持 Range/If-Range，未缓存时重定向到上游地址"""
+    video = video_cache.open_video(task_id)
+    if video is None:
+        upstream_url = upstream_video_url(task_id) if video_cache.is_valid_task_id(task_id) else None
+        if not upstream_url:
+            return jsonify({
+                'error': '视频不存在或任务尚未完成',
+                'status': 'error'
+            }), 404
+        video_cache.fetch_async(task_id, upstream_url)
+        video_cache.record_redirect()
+        return redirect(upstream_url, 302)
+    
+    status, start, length, headers = plan_video_response(
+        video,
+        request.headers.get('Range'),
+        request.headers.get('If-Range'),
+        request.headers.get('If-None-Match'),
+        VIDEO_CACHE_CONFIG['cache_max_age']
+    )
+    if status in (304, 416):
+        return Response(status=status, headers=headers)
+    
+    body = FileRange(video['path'], start, length)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None:
+        # 任意区间都交给服务器的 file_wrapper（如 gunicorn 按偏移和 Content-Length 调用 sendfile 零拷贝发送）
+        body = file_wrapper(body, 1024 * 1024)
+    return Response(body, status=status, headers=headers, direct_passthrough=True)
+
+@app.route('/artifacts/<digest>', methods=['GET'])
+def get_artifact(digest):
+    """提供本地保存的生成图片 - 内容哈希即强ETag，内容不会变化，可永久缓存"""
+    path, content_type = artifact_store.open_artifact(digest)
+    if path is None:
+        return jsonify({
+            'error': '文件不存在或已被清理',
+            'status': 'error'
+        }), 404
+    
+    response = send_file(path, mimetype=content_type, conditional=True, etag=digest,
+                         max_age=ARTIFACT_STORE_CONFIG['cache_max_age'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/artifacts/<digest>/<variant>', methods=['GET'])
+def get_artifact_variant(digest, variant):
+    """提供图片的派生版本（thumb.webp、w<宽度>.webp），尚未生成时先返回原图并开始生成"""
+    path = image_variants.open_variant(digest, variant)
+    if path is None:
+        source_path, _ = artifact_store.open_artifact(digest)
+        if source_path is None:
+            return jsonify({
+                'error': '文件不存在或已被清理',
+                'status': 'error'
+            }), 404
+        image_variants.generate_async(digest, source_path)
+        image_variants.record_fallback()
+        # 临时重定向不会被浏览器长期缓存，生成完成后再次请求即可拿到派生版本
+        return redirect(f'/artifacts/{digest}', 302)
+    
+    response = send_file(path, mimetype='image/webp', conditional=True, etag=f'{digest}-{variant}',
+                         max_age=ARTIFACT_STORE_CONFIG['cache_max_age'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/image-task-progress/<task_id>', methods=['GET'])
 def get_image_task_progress(task_id):
     """查询文生图任务进度"""
@@ -591,25 +1633,7 @@ def get_image_task_progress(task_id):
                 'status': 'error'
             }), 400
         
-        wanx_api = api_clients['wanx']
-        result = wanx_api.query_task_status(task_id)
-        
-        # 根据任务状态添加进度信息
-        if result.get('success'):
-            if result.get('status') == 'running':
-                # 为运行中的任务添加估算进度
-                result['progress'] = {
-                    'percentage': 50,  # 估算50%
-                    'message': '图像正在生成中...',
-                    'estimated_time': '预计还需30-60秒'
-                }
-            elif result.get('status') == 'completed':
-                result['progress'] = {
-                    'percentage': 100,
-                    'message': '图像生成完成！',
-                    'estimated_time': '已完成'
-                }
-        
+        result = get_watched_task('image', task_id, fetch_image_task)
         return jsonify(result)
         
     except Exception as e:
@@ -628,43 +1652,200 @@ def get_video_task_progress(task_id):
                 'status': 'error'
             }), 400
         
-        print(f"📊 查询视频任务进度: {task_id}")
-        cogvideo_api = api_clients['cogvideo']
-        result = cogvideo_api.query_task_status(task_id)
-        
-        print(f"📋 任务进度查询结果: {result}")
-        
-        # 根据任务状态添加详细进度信息
-        if result.get('success'):
-            if result.get('status') == 'processing':
-                # 为处理中的任务添加估算进度
-                # 可以根据任务创建时间来估算进度
-                result['progress'] = {
-                    'percentage': 60,  # 估算60%
-                    'message': '视频正在生成中，请耐心等待...',
-                    'estimated_time': '预计还需2-5分钟',
-                    'current_stage': '视频渲染中'
-                }
-            elif result.get('status') == 'completed':
-                result['progress'] = {
-                    'percentage': 100,
-                    'message': '视频生成完成！',
-                    'estimated_time': '已完成',
-                    'current_stage': '完成'
-                }
+        result = get_watched_task('video', task_id, fetch_video_task)
+        logger.debug("📋 视频任务 %s 进度查询结果: %s", task_id, result)
         
         return jsonify(result)
         
     except Exception as e:
         error_msg = f'查询视频任务进度时发生异常: {str(e)}'
-        print(f"❌ 进度查询异常: {error_msg}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ 进度查询异常: %s", error_msg)
         return jsonify({
             'error': error_msg,
             'status': 'error'
         }), 500
 
+def parse_task_keys(args):
+    """
+    解析任务事件订阅参数，如 ?image=<id>&video=<id1>,<id2>
+    
+    Args:
+        args (dict): 参数名到取值列表的映射
+    
+    Returns:
+        list: (任务类型, 任务ID) 列表
+    """
+    task_keys = []
+    for kind in ('image', 'video'):
+        for value in args.get(kind, []):
+            for task_id in value.split(','):
+                task_id = task_id.strip()
+                if task_id and (kind, task_id) not in task_keys:
+                    task_keys.append((kind, task_id))
+    return task_keys
+
+def _task_event_frame(kind, task_id, result):
+    """构造任务事件数据帧，内容与进度查询接口一致"""
+    payload = refresh_progress(kind, task_id, dict(result))
+    payload['kind'] = kind
+    payload['task_id'] = task_id
+    return format_sse(payload)
+
+def _task_done(kind, task_id):
+    """任务是否已结束（或已不再被跟踪）"""
+    task = task_watcher.get_task(kind, task_id)
+    return task is None or task['finished_at'] is not None
+
+def _initial_task_frames(task_keys, pending):
+    """开始跟踪任务并返回已知状态的数据帧"""
+    frames = []
+    for kind, task_id in task_keys:
+        result = task_watcher.track(kind, task_id)
+        if result is not None:
+            frames.append(_task_event_frame(kind, task_id, result))
+        if _task_done(kind, task_id):
+            pending.discard((kind, task_id))
+    return frames
+
+def _progress_frames(pending):
+    """为进行中的任务生成按当前时间刷新进度的数据帧"""
+    frames = []
+    for kind, task_id in pending:
+        result = task_watcher.get(kind, task_id)
+        if result is not None and not _task_done(kind, task_id):
+            frames.append(_task_event_frame(kind, task_id, result))
+    return frames
+
+def _event_wait_timeout():
+    """事件流等待超时：兼顾心跳间隔和进度刷新间隔"""
+    return min(TASK_WATCHER_CONFIG['heartbeat_interval'], PROGRESS_ESTIMATOR_CONFIG['refresh_interval'])
+
+def task_events_stream(task_keys):
+    """任务状态事件流 - 所有任务结束后关闭"""
+    events = queue.Queue()
+    subscriber_id = task_watcher.subscribe(events.put, task_keys)
+    timeout = _event_wait_timeout()
+    SSE_STREAMS.inc('task_events')
+    try:
+        pending = set(task_keys)
+        for frame in _initial_task_frames(task_keys, pending):
+            yield frame
+        
+        while pending:
+            try:
+                event = events.get(timeout=timeout)
+            except queue.Empty:
+                # 刷新进度估算；没有可刷新的任务时发送心跳，用于保持连接并及时发现已断开的客户端
+                pending = {key for key in pending if not _task_done(*key)}
+                frames = _progress_frames(pending)
+                for frame in frames:
+                    yield frame
+                if not frames:
+                    yield ": heartbeat\n\n"
+                continue
+            
+            yield _task_event_frame(event['kind'], event['task_id'], event['result'])
+            if event['finished']:
+                pending.discard((event['kind'], event['task_id']))
+    finally:
+        SSE_STREAMS.dec('task_events')
+        task_watcher.unsubscribe(subscriber_id)
+
+async def atask_events_stream(task_keys):
+    """任务状态事件流（异步版本，供 ASGI 模式使用）"""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    subscriber_id = task_watcher.subscribe(
+        lambda event: loop.call_soon_threadsafe(events.put_nowait, event),
+        task_keys
+    )
+    timeout = _event_wait_timeout()
+    SSE_STREAMS.inc('task_events')
+    try:
+        pending = set(task_keys)
+        for frame in _initial_task_frames(task_keys, pending):
+            yield frame
+        
+        while pending:
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pending = {key for key in pending if not _task_done(*key)}
+                frames = _progress_frames(pending)
+                for frame in frames:
+                    yield frame
+                if not frames:
+                    yield ": heartbeat\n\n"
+                continue
+            
+            yield _task_event_frame(event['kind'], event['task_id'], event['result'])
+            if event['finished']:
+                pending.discard((event['kind'], event['task_id']))
+    finally:
+        SSE_STREAMS.dec('task_events')
+        task_watcher.unsubscribe(subscriber_id)
+
+@app.route('/tasks/events', methods=['GET'])
+def task_events():
+    """订阅任务状态推送（SSE）"""
+    task_keys = parse_task_keys(request.args.to_dict(flat=False))
+    if not task_keys:
+        return jsonify({
+            'error': '请提供要订阅的任务ID，如 ?image=<task_id> 或 ?video=<task_id>',
+            'status': 'error'
+        }), 400
+    
+    return Response(
+        task_events_stream(task_keys),
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+
+@app.route('/router/status', methods=['GET'])
+def get_router_status():
+    """自动路由状态：延迟目标、各候选模型的当前估计和最近的路由决策及其输入"""
+    return jsonify(model_router.status())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 文本格式的运行指标"""
+    if not METRICS_CONFIG['enabled']:
+        return jsonify({'error': '指标导出未启用', 'status': 'error'}), 404
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/system/stats', methods=['GET'])
+def get_system_stats():
+    """获取运行时统计信息（连接池、上游熔断、重试预算、任务监视器、任务耗时、响应缓存、状态缓存、请求合并、日志队列、链路追踪、自动路由等）"""
+    return jsonify({
+        'http_pools': get_transport().stats(),
+        'circuit_breakers': get_transport().circuit_stats(),
+        'retry': retry_stats(),
+        'task_watcher': task_watcher.stats(),
+        'task_durations': task_durations.snapshot(),
+        'response_cache': response_cache.stats(),
+        'similarity_cache': similarity_cache.stats(),
+        'conversation_store': conversation_store.stats(),
+        'context_window': context_window.stats(),
+        'sse_coalescing': sse_coalesce_stats.stats(),
+        'conversation_summarizer': conversation_summarizer.stats(),
+        'result_store': result_store.stats(),
+        'artifact_store': artifact_store.stats(),
+        'image_variants': image_variants.stats(),
+        'video_cache': video_cache.stats(),
+        'logging': logging_stats(),
+        'tracing': tracing_stats(),
+        'hedged_chat': api_clients['fastest'].stats(),
+        'model_router': model_router.stats(),
+        'status_cache': {
+            'wanx': api_clients['wanx'].status_cache.stats(),
+            'cogvideo': api_clients['cogvideo'].status_cache.stats()
+        },
+        'single_flight': {
+            'wanx': api_clients['wanx'].single_flight.stats(),
+            'cogvideo': api_clients['cogvideo'].single_flight.stats()
+        }
+    })
+
 if __name__ == '__main__':
     from config import APP_CONFIG
     print("🚀 多模型AI对话应用启动中...")
@@ -0,0 +1,387 @@
+"""
+ASGI 入口 - 在事件循环上处理 /chat、/tasks/events 流式响应、/generate-image 长等待、/create-video 退避重试和 /videos 文件发送
+
+启动方式:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+
+流式 /chat 请求直接在事件循环上调用各模型客户端的 achat 方法，
+一个进程即可同时保持大量SSE连接；其余路由通过 WsgiToAsgi 交给 Flask 处理，
+并在大小为 APP_CONFIG["wsgi_threads"] 的线程池中并发执行。
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from werkzeug.datastructures import Headers
+
+from app import (
+    app, parse_chat_request, chat_error_response, chat_cache_key, achat_stream_internal, record_chat_turn,
+    chat_response_headers, CHAT_EXPOSED_HEADERS, SSE_HEADERS, parse_task_keys, atask_events_stream, agenerate_image,
+    acreate_video, video_cache, observe_request
+)
+from apis.http_client import get_transport
+from apis.log import get_logger
+from apis.tracing import atrace_iter, span
+from config import APP_CONFIG, VIDEO_CACHE_CONFIG
+from services.video_cache import plan_video_response
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=APP_CONFIG["wsgi_threads"], thread_name_prefix="wsgi")
+
+
+class _PooledWsgiInstance(WsgiToAsgiInstance):
+    """在线程池中运行 WSGI 应用（asgiref 默认 thread_sensitive，所有请求会串行在同一线程上）"""
+
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False, executor=_wsgi_executor
+    )
+
+
+class _PooledWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi，每个请求使用 _PooledWsgiInstance"""
+
+    async def __call__(self, scope, receive, send):
+        await _PooledWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+flask_app = _PooledWsgiToAsgi(app)
+
+logger = get_logger("asgi")
+
+# 与 flask_cors 的默认行为保持一致
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*'
+}
+
+
+async def application(scope, receive, send):
+    """ASGI 应用入口"""
+    if scope['type'] == 'lifespan':
+        await _handle_lifespan(receive, send)
+        return
+
+    # 交给 Flask 的请求由 Flask 记录指标，这里只记录在事件循环上直接处理的请求
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/chat':
+        metered = _MeteredSend(send)
+        if await _handle_chat(scope, receive, metered):
+            metered.observe('POST', '/chat')
+        return
+
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/generate-image':
+        metered = _MeteredSend(send)
+        with span("POST /generate-image", **{"http.route": "/generate-image"}):
+            await _handle_generate_image(receive, metered)
+        metered.observe('POST', '/generate-image')
+        return
+
+    if scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/create-video':
+        metered = _MeteredSend(send)
+        with span("POST /create-video", **{"http.route": "/create-video"}):
+            await _handle_create_video(receive, metered)
+        metered.observe('POST', '/create-video')
+        return
+
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/tasks/events':
+        metered = _MeteredSend(send)
+        with span("GET /tasks/events", **{"http.route": "/tasks/events"}):
+            await _handle_task_events(scope, receive, metered)
+        metered.observe('GET', '/tasks/events')
+        return
+
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD') and scope['path'].startswith('/videos/'):
+        metered = _MeteredSend(send)
+        if await _handle_video(scope, metered):
+            metered.observe(scope['method'], '/videos/<task_id>')
+            return
+
+    await flask_app(scope, receive, send)
+
+
+class _MeteredSend:
+    """包装 ASGI send，记录响应状态码和从请求开始到响应结束的耗时"""
+
+    def __init__(self, send):
+        self._send = send
+        self.started = time.monotonic()
+        self.status = None
+
+    async def __call__(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        await self._send(message)
+
+    def observe(self, method, route):
+        """记录指标（未发送响应头时按客户端已断开记为499）"""
+        observe_request(method, route, self.status or 499, time.monotonic() - self.started)
+
+
+async def _handle_lifespan(receive, send):
+    """处理应用启动和关闭事件"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # 关闭共享的异步连接池
+            try:
+                await get_transport().aclose()
+            except Exception as e:
+                logger.error("关闭连接池失败: %s", e)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def _handle_chat(scope, receive, send):
+    """
+    处理对话请求 - 流式请求在事件循环上完成，非流式请求交给 Flask
+
+    Returns:
+        bool: 是否在事件循环上处理；交给 Flask 时返回 False
+    """
+    body = await _read_body(receive)
+
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+
+    if not isinstance(data, dict) or not data.get('stream', True):
+        await flask_app(scope, _replay_receive(body, receive), send)
+        return False
+
+    with span("POST /chat", **{"http.route": "/chat"}):
+        # 会话历史可能需要从磁盘层读取，放到线程池中执行
+        request_headers = Headers([
+            (name.decode('latin-1'), value.decode('latin-1')) for name, value in scope.get('headers', [])
+        ])
+        chat_request, error = await asyncio.to_thread(parse_chat_request, data, request_headers)
+        if error:
+            payload, status_code = chat_error_response(error)
+            await _send_json(send, status_code, payload)
+            return True
+
+        frames = atrace_iter(
+            achat_stream_internal(
+                chat_request['messages'], chat_request['model'], chat_cache_key(chat_request, 'stream'),
+                on_answer=lambda answer: record_chat_turn(chat_request, answer),
+                coalesce_ms=chat_request['coalesce_ms']
+            ),
+            "chat.stream", model=chat_request['model']
+        )
+        headers = chat_response_headers(chat_request)
+        headers['Access-Control-Expose-Headers'] = ', '.join(CHAT_EXPOSED_HEADERS)
+        await stream_sse(receive, send, frames, headers)
+    return True
+
+
+async def _handle_generate_image(receive, send):
+    """同步生图 - 在事件循环上等待任务完成，不占用工作线程"""
+    body = await _read_body(receive)
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+
+    payload, status_code = await agenerate_image(data if isinstance(data, dict) else None)
+    await _send_json(send, status_code, payload)
+
+
+async def _handle_create_video(receive, send):
+    """创建视频任务 - 上游暂时失败时在事件循环上退避后重新提交，不占用工作线程"""
+    body = await _read_body(receive)
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+
+    payload, status_code = await acreate_video(data if isinstance(data, dict) else None)
+    await _send_json(send, status_code, payload)
+
+
+async def _handle_task_events(scope, receive, send):
+    """任务状态推送 - 在事件循环上等待监视器事件，不占用线程"""
+    args = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    task_keys = parse_task_keys(args)
+    if not task_keys:
+        await _send_json(send, 400, {
+            'error': '请提供要订阅的任务ID，如 ?image=<task_id> 或 ?video=<task_id>',
+            'status': 'error'
+        })
+        return
+
+    await stream_sse(receive, send, atask_events_stream(task_keys))
+
+
+async def _handle_video(scope, send):
+    """
+    从本地缓存提供视频 - 支持零拷贝扩展时交给服务器发送文件，否则在线程中分块读取后发送
+
+    Returns:
+        bool: 是否已处理；视频尚未缓存时返回 False，交给 Flask 重定向到上游
+    """
+    video = video_cache.open_video(scope['path'][len('/videos/'):])
+    if video is None:
+        return False
+    with span(f"{scope['method']} /videos/<task_id>", **{"http.route": "/videos/<task_id>"}):
+        await _send_video(scope, send, video)
+    return True
+
+
+async def _send_video(scope, send, video):
+    """发送已缓存的视频（Range、条件请求、零拷贝或线程中分块读取）"""
+    request_headers = {
+        name.decode('latin-1').lower(): value.decode('latin-1')
+        for name, value in scope.get('headers', [])
+    }
+    status, start, length, headers = plan_video_response(
+        video,
+        request_headers.get('range'),
+        request_headers.get('if-range'),
+        request_headers.get('if-none-match'),
+        VIDEO_CACHE_CONFIG['cache_max_age']
+    )
+    headers.update(CORS_HEADERS)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': _encode_headers(headers)
+    })
+    if status in (304, 416) or scope['method'] == 'HEAD' or length == 0:
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        return
+
+    if 'http.response.zerocopysend' in scope.get('extensions', {}):
+        # 服务器支持零拷贝扩展时按偏移和长度交给服务器 sendfile；打开文件放到线程中，不阻塞事件循环
+        f = await asyncio.to_thread(open, video['path'], 'rb')
+        try:
+            await send({
+                'type': 'http.response.zerocopysend',
+                'file': f,
+                'offset': start,
+                'count': length,
+                'more_body': False
+            })
+        finally:
+            await asyncio.to_thread(f.close)
+        return
+
+    # ASGI 响应体只能是 bytes（uvicorn 不支持零拷贝扩展），在线程中按偏移 pread 分块读取，
+    # 磁盘读取不占用事件循环
+    fd = await asyncio.to_thread(os.open, video['path'], os.O_RDONLY)
+    try:
+        chunk_size = 1024 * 1024
+        position, end = start, start + length
+        while position < end:
+            chunk = await asyncio.to_thread(os.pread, fd, min(chunk_size, end - position), position)
+            if not chunk:
+                break
+            position += len(chunk)
+            await send({
+                'type': 'http.response.body',
+                'body': chunk,
+                'more_body': position < end
+            })
+        if position < end:
+            # 文件被截断时结束响应，避免客户端一直等待剩余内容
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        await asyncio.to_thread(os.close, fd)
+
+
+async def stream_sse(receive, send, frames, headers=None):
+    """
+    以SSE方式发送异步帧序列
+
+    客户端断开时取消正在进行的流，从而关闭上游模型连接。
+    """
+    response_headers = dict(SSE_HEADERS)
+    response_headers.update(CORS_HEADERS)
+    if headers:
+        response_headers.update(headers)
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': _encode_headers(response_headers)
+    })
+
+    async def pump():
+        try:
+            async for frame in frames:
+                await send({
+                    'type': 'http.response.body',
+                    'body': frame.encode('utf-8'),
+                    'more_body': True
+                })
+        finally:
+            await frames.aclose()
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+    async def wait_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    pump_task = asyncio.ensure_future(pump())
+    disconnect_task = asyncio.ensure_future(wait_disconnect())
+    try:
+        await asyncio.wait({pump_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (pump_task, disconnect_task):
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(pump_task, disconnect_task, return_exceptions=True)
+
+
+async def _read_body(receive):
+    """读取完整的请求体"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+def _replay_receive(body, receive):
+    """构造重放已读取请求体的 receive，供转交 Flask 使用"""
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return await receive()
+
+    return replay
+
+
+async def _send_json(send, status, payload):
+    """发送JSON响应"""
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    headers = {
+        'Content-Type': 'application/json',
+        'Content-Length': str(len(body))
+    }
+    headers.update(CORS_HEADERS)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': _encode_headers(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+
+def _encode_headers(headers):
+    """将响应头转换为ASGI格式"""
+    return [(key.lower().encode('latin-1'), str(value).encode('latin-1')) for key, value in headers.items()]
@@ -5,6 +5,43 @@ from dotenv import load_dotenv
 # 加载 .env（如果存在）
 load_dotenv()
 
+# 共享HTTP连接池配置（所有上游客户端共用）
+HTTP_CONFIG = {
+    "pool_connections": int(os.getenv('HTTP_POOL_CONNECTIONS', 10)),  # 每个主机缓存的连接池数量
+    "pool_maxsize": int(os.getenv('HTTP_POOL_MAXSIZE', 50)),  # 每个主机保持的最大连接数
+    "pool_block": False,  # 连接池满时是否阻塞等待
+    "connect_timeout": float(os.getenv('HTTP_CONNECT_TIMEOUT', 5)),
+    "read_timeout": float(os.getenv('HTTP_READ_TIMEOUT', 60)),
+    "keepalive_expiry": 30,  # 空闲连接保持时间（秒）
+    "openai_max_retries": 0  # SDK 自带的重试关闭，统一由 apis/retry.py 重试
+}
+
+# 上游熔断配置（按主机统计，时间窗口内错误率或慢调用比例超过阈值时熔断，熔断期间请求立即失败）
+CIRCUIT_BREAKER_CONFIG = {
+    "enabled": os.getenv('CIRCUIT_BREAKER_ENABLED', 'true').lower() == 'true',
+    "window_seconds": 60,  # 统计时间窗口（秒）
+    "min_calls": int(os.getenv('CIRCUIT_BREAKER_MIN_CALLS', 10)),  # 窗口内调用数达到该值才判断是否熔断
+    "error_rate_threshold": float(os.getenv('CIRCUIT_BREAKER_ERROR_RATE', 0.5)),
+    "slow_call_seconds": float(os.getenv('CIRCUIT_BREAKER_SLOW_CALL_SECONDS', 20)),  # 耗时超过该值计为慢调用
+    "slow_call_rate_threshold": float(os.getenv('CIRCUIT_BREAKER_SLOW_CALL_RATE', 0.8)),
+    "open_seconds": float(os.getenv('CIRCUIT_BREAKER_OPEN_SECONDS', 30)),  # 熔断持续时间，到期后放行试探请求
+    "half_open_max_calls": 2,  # 半开状态放行的试探请求数，全部成功后恢复
+    "trial_timeout": float(os.getenv('CIRCUIT_BREAKER_TRIAL_TIMEOUT', 30))  # 试探请求超过该时间仍无结果时作废，重新放行试探
+}
+
+# 上游重试配置（所有 apis/ 客户端共用的抖动指数退避）
+RETRY_CONFIG = {
+    "max_attempts": int(os.getenv('RETRY_MAX_ATTEMPTS', 3)),  # 最多尝试次数（含首次）
+    "base_delay": float(os.getenv('RETRY_BASE_DELAY', 1)),  # 首次重试的退避上限（秒），之后每次翻倍
+    "max_delay": 10,  # 单次退避上限（秒）
+    "max_retry_after": 30,  # 上游 Retry-After 超过该值时按该值等待
+    "budget_seconds": float(os.getenv('RETRY_BUDGET_SECONDS', 15)),  # 一次请求所有退避的总时长上限（秒）
+    "sync_budget_seconds": float(os.getenv('RETRY_SYNC_BUDGET_SECONDS', 4)),  # 同步对话请求在请求线程中退避的总时长上限（秒）
+    "budget_ratio": float(os.getenv('RETRY_BUDGET_RATIO', 0.2)),  # 全局重试量不超过请求量的该比例
+    "budget_min_per_second": 1,  # 请求很少时每秒仍允许的重试数
+    "budget_max_tokens": 20  # 令牌桶容量，限制故障开始时的重试突发
+}
+
 # 通义千问API配置
 QWEN_CONFIG = {
     "api_base": "https://dashscope.aliyuncs.com/compatible-mode/v1",
@@ -25,6 +62,7 @@ WANX_CONFIG = {
     "poll_timeout": 10,
     "max_poll_attempts": 30,
     "poll_interval": 2,
+    "generate_deadline": 120,  # /generate-image 同步等待任务完成的最长时间（秒）
     "default_style": "<auto>",
     "default_size": "1024*1024",
     "default_n": 1
@@ -59,11 +97,236 @@ COGVIDEO_CONFIG = {
     "supported_durations": [5, 10]
 }
 
+# 任务状态缓存配置（终态结果常驻，进行中状态短时缓存）
+TASK_STATUS_CACHE_CONFIG = {
+    "running_ttl": 2,  # 进行中状态的缓存时间（秒）
+    "max_pinned": 10000,  # 终态结果最大缓存条数
+    "max_transient": 10000  # 进行中状态最大缓存条数
+}
+
+# 后台任务监视器配置（统一轮询图像/视频任务并推送状态）
+TASK_WATCHER_CONFIG = {
+    "image_poll_interval": 3,  # 图像任务固定轮询间隔（秒），任务开始时间未知时使用
+    "video_poll_interval": 8,  # 视频任务固定轮询间隔（秒），任务开始时间未知时使用
+    "tick_interval": 1,
+    "batch_size": 16,  # 每批并发查询的任务数
+    "max_workers": 8,
+    "max_error_duration": 60,  # 连续查询失败超过该时长（秒）后停止跟踪
+    "error_backoff_max": 60,  # 查询失败后的退避上限（秒），退避不短于正常轮询间隔
+    "max_unknown_polls": 3,  # 上游连续返回未知状态的次数达到该值后停止跟踪
+    "finished_retention": 600,  # 已结束任务保留时间（秒）
+    "abandoned_retention": 30,  # 因查询失败或状态未知而停止跟踪的任务保留时间（秒），之后再请求时重新查询上游
+    "max_task_age": 1800,  # 任务最长跟踪时间（秒）
+    "heartbeat_interval": 15  # SSE 心跳间隔（秒）
+}
+
+# 任务完成耗时统计配置（按任务类型和参数组合学习，供轮询计划使用）
+TASK_DURATION_CONFIG = {
+    "decay": 0.98,  # 每个新样本写入时旧样本的权重保留比例
+    "min_samples": 5,  # 参数组合样本少于该值时退回任务类型统计或先验值
+    # 先验分布：各分位数相对中位数的倍数
+    "prior_spread": [(0.1, 0.6), (0.5, 1.0), (0.9, 1.6), (1.0, 2.5)],
+    "priors": {
+        "image": {
+            "median": 20  # 文生图耗时中位数（秒）
+        },
+        "video": {
+            "seconds_per_video_second": 20,  # 每秒视频的生成耗时（秒）
+            "quality_factor": {"speed": 1.0, "quality": 1.5},
+            "high_fps_factor": 1.3,  # 60fps
+            "uhd_factor": 1.5  # 4K
+        }
+    }
+}
+
+# 自适应轮询配置：预计完成前稀疏查询，预计完成区间内密集查询，超出预期后退避
+POLL_SCHEDULER_CONFIG = {
+    "min_interval": {"image": 1.5, "video": 4},  # 密集区间内的查询间隔（秒）
+    "max_interval": {"image": 15, "video": 60},  # 查询间隔上限（秒）
+    "dense_start_quantile": 0.2,  # 耗时达到该分位数后开始密集查询
+    "dense_end_quantile": 0.9,  # 耗时超过该分位数后开始退避
+    "early_fraction": 0.5,  # 早期每次等待距离密集区间剩余时间的比例
+    "backoff_factor": 0.5  # 退避等待时间占超出时长的比例
+}
+
+# 任务进度估算配置（基于任务耗时统计）
+PROGRESS_ESTIMATOR_CONFIG = {
+    "confidence": 0.8,  # 剩余时间置信区间覆盖的概率
+    "min_percentage": 1,
+    "max_percentage": 99,  # 未完成任务的进度上限
+    "max_done_share": 0.98,  # 已运行时间超出历史分布时的分位数上限
+    "refresh_interval": 5  # 进度刷新间隔（秒），用于事件流和轮询提示
+}
+
+# 对话响应缓存配置（相同消息、模型和采样参数直接返回缓存的回答）
+RESPONSE_CACHE_CONFIG = {
+    "enabled": os.getenv('CHAT_CACHE_ENABLED', 'true').lower() != 'false',
+    "ttl": int(os.getenv('CHAT_CACHE_TTL', 3600)),  # 缓存有效期（秒）
+    "max_memory_bytes": 32 * 1024 * 1024,  # 内存层容量（字节）
+    "max_entry_bytes": 256 * 1024,  # 单条响应超过该大小时不缓存
+    "disk_path": os.getenv('CHAT_CACHE_DB', ''),  # sqlite 磁盘层路径，为空时只使用内存层
+    "max_disk_bytes": 512 * 1024 * 1024,  # 磁盘层容量（字节）
+    "disk_prune_every": 100  # 每写入多少条清理一次磁盘层
+}
+
+# 对话会话配置（客户端只发送会话ID和新消息，历史保存在服务端）
+CONVERSATION_STORE_CONFIG = {
+    "disk_path": os.getenv('CHAT_SESSION_DB', ''),  # sqlite 持久化路径，为空时只保存在内存
+    "idle_ttl": int(os.getenv('CHAT_SESSION_IDLE_TTL', 1800)),  # 空闲多久后从内存淘汰（秒）
+    "disk_ttl": 7 * 24 * 3600,  # 磁盘层会话保留时间（秒）
+    "max_sessions": 10000,  # 内存中最多保留的会话数
+    "max_messages_per_session": 200,  # 单会话最多保留的消息数
+    "max_bytes_per_session": 256 * 1024,  # 单会话历史字节数上限，超出时丢弃最早的对话
+    "sweep_interval": 60  # 空闲会话清理间隔（秒）
+}
+
+# 会话滚动摘要配置（回答结束后在后台用普通模式模型把较早的对话压缩成摘要）
+CONVERSATION_SUMMARY_CONFIG = {
+    "enabled": os.getenv('CHAT_SUMMARY_ENABLED', 'true').lower() != 'false',
+    "model": os.getenv('CHAT_SUMMARY_MODEL', QWEN_CONFIG['model']),  # 生成摘要使用的模型
+    "trigger_tokens": 3000,  # 会话历史（不含摘要）超过该 token 数时生成摘要，应小于上下文预算
+    "keep_recent_turns": 2,  # 保留原文的最近对话轮数
+    "max_summary_chars": 600,  # 摘要长度上限（字）
+    "workers": 2
+}
+
+# 上下文窗口配置（按模型的 token 预算裁剪转发给模型的对话历史，预算越小首字延迟越低）
+CONTEXT_WINDOW_CONFIG = {
+    "budgets": {  # 各模型的输入 token 预算（本地估算值）
+        "qwen_normal": int(os.getenv('QWEN_CONTEXT_BUDGET', 8000)),
+        "qwen_thinking": int(os.getenv('QWEN_CONTEXT_BUDGET', 8000)),
+        "hunyuan": int(os.getenv('HUNYUAN_CONTEXT_BUDGET', 6000)),
+        "fastest": int(os.getenv('HUNYUAN_CONTEXT_BUDGET', 6000))  # 对冲请求可能由任一模型回答，取较小的预算
+    },
+    "default_budget": 8000,
+    "keep_recent_turns": 2,  # 始终保留的最近对话轮数（不含当前消息）
+    "message_overhead": 4,  # 每条消息的格式开销（token）
+    "min_truncated_tokens": 64  # 必留消息超出预算时，截断后至少保留的 token 数
+}
+
+# SSE 帧合并配置（把连续的 thinking/content 增量合并为一帧，客户端通过 coalesce_ms 或 X-SSE-Coalesce-Ms 请求头协商）
+SSE_COALESCE_CONFIG = {
+    "default_window_ms": int(os.getenv('SSE_COALESCE_DEFAULT_MS', 0)),  # 客户端未指定时的合并窗口，0 表示不合并
+    "max_window_ms": 200,  # 客户端可请求的最大合并窗口（毫秒）
+    "max_bytes": 4096  # 缓冲内容达到该字节数时立即发送
+}
+
+# 近似提示词缓存配置（单轮提示词的 MinHash/LSH 相似度索引，命中后复用响应缓存中的回答）
+SIMILARITY_CACHE_CONFIG = {
+    "enabled": os.getenv('CHAT_SIMILARITY_CACHE_ENABLED', 'false').lower() == 'true',
+    "threshold": float(os.getenv('CHAT_SIMILARITY_THRESHOLD', 0.85)),  # 估计的 Jaccard 相似度阈值
+    "num_perm": 64,  # MinHash 签名长度
+    "bands": 8,  # LSH 分段数（每段8行，相似度0.85时召回约92%）
+    "ngram": 3,  # 字符 n-gram 长度
+    "max_prompt_chars": 500,  # 超过该长度的提示词不参与近似匹配
+    "max_entries_per_model": 100000  # 每个索引（模型 + 响应类型）的最大条目数
+}
+
+# 生成结果去重配置（相同参数的文生图/视频请求复用已完成的结果或进行中的任务）
+RESULT_STORE_CONFIG = {
+    "max_entries": 5000,  # 最大条目数，超出时淘汰最久未使用的
+    "max_bytes": int(os.getenv('RESULT_STORE_MAX_BYTES', 64 * 1024 * 1024)),  # 已保存结果的字节预算，超出时淘汰最久未使用的
+    "max_age": 12 * 3600,  # 已完成结果的复用期限（秒），需短于上游结果链接的有效期
+    "pending_ttl": 1800  # 进行中任务的复用期限（秒）
+}
+
+# 本地生成结果存储配置（图像任务完成后下载到本地，按内容哈希保存）
+ARTIFACT_STORE_CONFIG = {
+    "root": os.getenv('ARTIFACT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'artifacts')),
+    "max_bytes": int(os.getenv('ARTIFACT_MAX_BYTES', 1024 * 1024 * 1024)),  # 磁盘预算（字节）
+    "max_artifact_bytes": 20 * 1024 * 1024,  # 单个文件大小上限（字节）
+    "download_workers": 2,
+    "download_timeout": 60,
+    # 同步生图接口等待本地副本保存的上限（秒），超时则响应中 local_image_url 为空
+    "response_wait": float(os.getenv('ARTIFACT_RESPONSE_WAIT', 3)),
+    "cache_max_age": 365 * 24 * 3600  # 浏览器缓存时间（秒），内容不可变
+}
+
+# 本地视频缓存配置（视频任务完成后断点续传下载，/videos/<task_id> 支持 Range 请求）
+VIDEO_CACHE_CONFIG = {
+    "root": os.getenv('VIDEO_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'videos')),
+    "max_bytes": int(os.getenv('VIDEO_CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024)),  # 磁盘预算（字节）
+    "download_workers": 2,
+    "download_timeout": 120,
+    "max_attempts": 5,  # 下载中断后的最大续传次数
+    "cache_max_age": 24 * 3600  # 浏览器缓存时间（秒）
+}
+
+# 图片派生版本配置（缩略图和多宽度 WebP，供 srcset 使用）
+IMAGE_VARIANTS_CONFIG = {
+    "root": os.getenv('IMAGE_VARIANTS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'variants')),
+    "max_bytes": int(os.getenv('IMAGE_VARIANTS_MAX_BYTES', 256 * 1024 * 1024)),  # 磁盘预算（字节）
+    "widths": [320, 640, 1024],  # 生成的宽度（不放大，原图更窄时跳过）
+    "thumbnail_size": 256,  # 正方形缩略图边长
+    "quality": 80,  # WebP 质量
+    "workers": 2  # 进程池大小
+}
+
+# 日志配置（分级结构化日志，后台线程写出；逐 token 的调试日志按类别采样）
+LOGGING_CONFIG = {
+    "level": os.getenv('LOG_LEVEL', 'INFO'),  # DEBUG 时输出流式内容等调试日志
+    "format": os.getenv('LOG_FORMAT', 'text'),  # text 或 json
+    "queue_size": 10000,  # 日志队列容量，写出跟不上时丢弃新日志
+    "sample_rates": {  # DEBUG 日志采样率，1 表示全部保留，0 表示全部丢弃
+        "stream": float(os.getenv('LOG_STREAM_SAMPLE_RATE', 0.01))
+    }
+}
+
+# 对冲对话配置（model 为 "fastest" 时先请求主模型，超过学习到的首字延迟分位数仍无输出时再请求备用模型，先出字的胜出）
+HEDGED_CHAT_CONFIG = {
+    "primary": os.getenv('HEDGE_PRIMARY_MODEL', 'qwen_normal'),
+    "hedge": os.getenv('HEDGE_BACKUP_MODEL', 'hunyuan'),
+    "quantile": 0.9,  # 按主模型首字延迟的该分位数决定何时发出对冲请求
+    "default_delay": float(os.getenv('HEDGE_DEFAULT_DELAY', 1.5)),  # 样本不足时的对冲等待时间（秒）
+    "min_delay": 0.2,
+    "max_delay": 5,
+    "min_samples": 20,  # 主模型首字延迟样本达到该数量后使用学习到的分位数
+    "decay": 0.98  # 首字延迟统计的衰减系数
+}
+
+# 自动路由配置（model 为 "auto" 时按各模型近期的首字延迟、生成速度和错误率选择最能满足延迟目标的模型）
+MODEL_ROUTER_CONFIG = {
+    "candidates": [
+        name.strip() for name in os.getenv('ROUTER_CANDIDATES', 'qwen_normal,hunyuan').split(',') if name.strip()
+    ],
+    "ttft_slo": float(os.getenv('ROUTER_TTFT_SLO', 2.0)),  # 首字延迟目标（秒）
+    "min_tokens_per_sec": float(os.getenv('ROUTER_MIN_TOKENS_PER_SEC', 15)),  # 生成速度下限
+    "max_error_rate": float(os.getenv('ROUTER_MAX_ERROR_RATE', 0.1)),
+    "expected_tokens": 300,  # 估算完整回答耗时时假设的回答长度
+    "alpha": 0.2,  # 指数衰减平均中新观测值的权重
+    "probe_interval": int(os.getenv('ROUTER_PROBE_INTERVAL', 60)),  # 超过该时间（秒）没有观测的模型分配一次请求，保持估计新鲜
+    "history": 100  # /router/status 保留的最近路由决策数
+}
+
+# 指标配置（/metrics 以 Prometheus 文本格式导出，各线程分片记录、抓取时合并）
+METRICS_CONFIG = {
+    "enabled": os.getenv('METRICS_ENABLED', 'true').lower() == 'true',  # 为 false 时 /metrics 返回404
+    "latency_buckets": [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60],  # 请求/上游耗时分桶（秒）
+    "ttft_buckets": [0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 13, 20],  # 首字延迟分桶（秒）
+    "throughput_buckets": [5, 10, 20, 30, 50, 75, 100, 150, 200, 300]  # 生成速度分桶（tokens/秒）
+}
+
+# 请求链路追踪配置（路由、客户端方法、上游HTTP调用和SSE阶段的 span；整条链路结束后尾部采样，再由后台线程导出）
+TRACING_CONFIG = {
+    "enabled": os.getenv('TRACING_ENABLED', 'true').lower() == 'true',
+    "exporter": os.getenv('TRACING_EXPORTER', 'jsonl'),  # jsonl 写入本地文件；otlp 以 OTLP/HTTP JSON 格式发送到收集器
+    "jsonl_path": os.getenv('TRACING_JSONL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'traces.jsonl')),
+    "otlp_endpoint": os.getenv('TRACING_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces'),
+    "service_name": "my_ai",
+    "sample_rate": float(os.getenv('TRACING_SAMPLE_RATE', 0.05)),  # 正常且不慢的链路的保留比例
+    "slow_threshold_ms": int(os.getenv('TRACING_SLOW_MS', 3000)),  # 根 span 超过该耗时的链路全部保留（出错的链路也全部保留）
+    "max_open_traces": 2000,  # 未结束链路的上限，超出时丢弃最早的
+    "max_spans_per_trace": 500,  # 单条链路最多记录的 span 数
+    "queue_size": 1000,  # 导出队列容量（链路数），满时丢弃
+    "batch_size": 50  # 每次导出的最大链路数
+}
+
 # Flask应用配置
 APP_CONFIG = {
     'host': '0.0.0.0',
     'port': int(os.getenv('PORT', 5000)),
-    'debug': os.getenv('FLASK_ENV') != 'production'
+    'debug': os.getenv('FLASK_ENV') != 'production',
+    'wsgi_threads': int(os.getenv('ASGI_WSGI_THREADS', 32))  # ASGI 入口下运行 Flask 路由的线程数
 }
 
 # 模型信息配置
@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import ARTIFACT_STORE_CONFIG
+from apis.http_client import get_transport
+from apis.log import get_logger
+
+logger = get_logger("artifacts")
+
+# 内容类型与文件扩展名
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".webp": "image/webp",
+    ".gif": "image/gif"
+}
+
+_DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_REF_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+
+class ArtifactStore:
+    """本地生成结果存储 - 后台下载上游图片，按内容哈希保存，超出磁盘预算时淘汰最久未访问的文件"""
+
+    def __init__(self, config=None):
+        """初始化存储目录并扫描已有文件"""
+        self.config = config or ARTIFACT_STORE_CONFIG
+        self.root = self.config['root']
+        self._objects_dir = os.path.join(self.root, "objects")
+        self._refs_dir = os.path.join(self.root, "refs")
+        self._lock = threading.Lock()
+        self._objects = {}  # 内容哈希 -> {"path", "size", "last_access"}
+        self._total_bytes = 0
+        self._pending = set()
+        self._executor = None
+        self._listeners = []
+        self._waiters = {}  # 引用名 -> 下载结束时调用的回调列表
+        self._stats = {
+            "downloads": 0,
+            "download_errors": 0,
+            "deduplicated": 0,
+            "evictions": 0,
+            "served": 0
+        }
+
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._refs_dir, exist_ok=True)
+        self._scan()
+
+    def fetch_async(self, ref, url):
+        """
+        在后台下载上游文件（同一引用只下载一次）
+
+        Args:
+            ref (str): 引用名，如任务ID
+            url (str): 上游文件地址
+        """
+        if not url or not _REF_PATTERN.match(ref):
+            return
+        with self._lock:
+            if ref in self._pending:
+                return
+            self._pending.add(ref)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config.get('download_workers', 2),
+                    thread_name_prefix="artifact-download"
+                )
+        self._executor.submit(self._download, ref, url)
+
+    def subscribe(self, callback):
+        """
+        订阅保存完成通知
+
+        Args:
+            callback: 回调函数，参数为 (引用名, 内容哈希, 文件路径)
+        """
+        self._listeners.append(callback)
+
+    def wait(self, ref, timeout):
+        """
+        等待引用的后台下载结束（有上限），用于在响应中直接返回本地地址
+
+        Returns:
+            str: 内容哈希，下载失败或超时返回 None
+        """
+        done = threading.Event()
+        holder = {}
+
+        def on_done(digest):
+            holder["digest"] = digest
+            done.set()
+
+        digest = self._add_waiter(ref, on_done)
+        if digest is not None:
+            return digest
+        try:
+            done.wait(timeout)
+            return holder.get("digest")
+        finally:
+            self._remove_waiter(ref, on_done)
+
+    async def async_wait(self, ref, timeout):
+        """
+        等待引用的后台下载结束（异步版本）- 在事件循环上挂起，不占用线程
+
+        Returns:
+            str: 内容哈希，下载失败或超时返回 None
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(digest):
+            if not future.done():
+                future.set_result(digest)
+
+        def on_done(digest):
+            loop.call_soon_threadsafe(resolve, digest)
+
+        digest = self._add_waiter(ref, on_done)
+        if digest is not None:
+            return digest
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._remove_waiter(ref, on_done)
+
+    def lookup(self, ref):
+        """
+        查找引用对应的内容哈希
+
+        Returns:
+            str: 内容哈希，尚未下载或已被淘汰时返回 None
+        """
+        if not _REF_PATTERN.match(ref):
+            return None
+        try:
+            with open(os.path.join(self._refs_dir, ref), encoding="utf-8") as f:
+                digest = f.read().strip()
+        except OSError:
+            return None
+        with self._lock:
+            return digest if digest in self._objects else None
+
+    def open_artifact(self, digest):
+        """
+        获取文件路径和内容类型，同时更新访问时间
+
+        Returns:
+            tuple: (文件路径, 内容类型)，不存在时返回 (None, None)
+        """
+        if not _DIGEST_PATTERN.match(digest):
+            return None, None
+        with self._lock:
+            entry = self._objects.get(digest)
+            if entry is None:
+                return None, None
+            entry["last_access"] = time.time()
+            self._stats["served"] += 1
+            path = entry["path"]
+        return path, CONTENT_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+
+    def stats(self):
+        """获取存储统计"""
+        with self._lock:
+            return dict(
+                self._stats,
+                objects=len(self._objects),
+                total_bytes=self._total_bytes,
+                max_bytes=self.config.get('max_bytes'),
+                pending_downloads=len(self._pending)
+            )
+
+    def _download(self, ref, url):
+        """下载文件并边写边计算哈希，完成后按内容哈希落盘"""
+        temp_path = None
+        saved = None
+        try:
+            response = get_transport().get(url, stream=True, timeout=self.config.get('download_timeout', 60))
+            try:
+                if response.status_code != 200:
+                    raise IOError(f"HTTP {response.status_code}")
+                extension = _extension_for(response.headers.get("Content-Type", ""), url)
+                max_size = self.config.get('max_artifact_bytes', 20 * 1024 * 1024)
+
+                hasher = hashlib.sha256()
+                size = 0
+                fd, temp_path = tempfile.mkstemp(dir=self._objects_dir, suffix=".part")
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        size += len(chunk)
+                        if size > max_size:
+                            raise IOError(f"文件超过大小上限 {max_size} 字节")
+                        hasher.update(chunk)
+                        f.write(chunk)
+            finally:
+                response.close()
+
+            digest = hasher.hexdigest()
+            path = self._object_path(digest, extension)
+            with self._lock:
+                if digest in self._objects:
+                    # 相同内容已存在，只记录引用
+                    os.remove(temp_path)
+                    self._stats["deduplicated"] += 1
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+                    self._objects[digest] = {"path": path, "size": size, "last_access": time.time()}
+                    self._total_bytes += size
+                    self._stats["downloads"] += 1
+                temp_path = None
+                self._write_ref(ref, digest)
+                self._evict()
+                path = self._objects[digest]["path"] if digest in self._objects else None
+            logger.info("📥 已保存生成结果 %s -> %.12s (%s 字节)", ref, digest, size)
+            if path is not None:
+                saved = digest
+                self._notify(ref, digest, path)
+
+        except Exception as e:
+            with self._lock:
+                self._stats["download_errors"] += 1
+            logger.error("下载生成结果失败 %s: %s", ref, e)
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            with self._lock:
+                self._pending.discard(ref)
+            self._wake_waiters(ref, saved)
+
+    def _add_waiter(self, ref, callback):
+        """登记下载结束回调；已保存时直接返回内容哈希，不登记"""
+        digest = self.lookup(ref)
+        if digest is not None or not _REF_PATTERN.match(ref):
+            return digest
+        with self._lock:
+            self._waiters.setdefault(ref, []).append(callback)
+        # 登记前下载可能刚好完成
+        digest = self.lookup(ref)
+        if digest is not None:
+            self._remove_waiter(ref, callback)
+        return digest
+
+    def _remove_waiter(self, ref, callback):
+        with self._lock:
+            callbacks = self._waiters.get(ref)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self._waiters[ref]
+
+    def _wake_waiters(self, ref, digest):
+        """下载结束（成功或失败）时唤醒等待该引用的调用方"""
+        with self._lock:
+            callbacks = self._waiters.pop(ref, [])
+        for callback in callbacks:
+            callback(digest)
+
+    def _notify(self, ref, digest, path):
+        """通知订阅者，单个回调出错不影响其他订阅者"""
+        for callback in self._listeners:
+            try:
+                callback(ref, digest, path)
+            except Exception as e:
+                logger.error("生成结果保存通知失败: %s", e)
+
+    def _write_ref(self, ref, digest):
+        """记录引用到内容哈希的映射（重启后仍可查找）"""
+        ref_path = os.path.join(self._refs_dir, ref)
+        with open(ref_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(digest)
+        os.replace(ref_path + ".tmp", ref_path)
+
+    def _evict(self):
+        """超出磁盘预算时删除最久未访问的文件（需持有锁）"""
+        max_bytes = self.config.get('max_bytes', 1024 * 1024 * 1024)
+        if self._total_bytes <= max_bytes:
+            return
+        for digest, entry in sorted(self._objects.items(), key=lambda item: item[1]["last_access"]):
+            if self._total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(entry["path"])
+            except OSError:
+                pass
+            del self._objects[digest]
+            self._total_bytes -= entry["size"]
+            self._stats["evictions"] += 1
+
+    def _object_path(self, digest, extension):
+        return os.path.join(self._objects_dir, digest[:2], digest + extension)
+
+    def _scan(self):
+        """启动时扫描已有文件，按修改时间初始化访问顺序"""
+        for directory, _, files in os.walk(self._objects_dir):
+            for name in files:
+                path = os.path.join(directory, name)
+                digest, extension = os.path.splitext(name)
+                if extension == ".part":
+                    os.remove(path)
+                    continue
+                if not _DIGEST_PATTERN.match(digest):
+                    continue
+                stat = os.stat(path)
+                self._objects[digest] = {"path": path, "size": stat.st_size, "last_access": stat.st_mtime}
+                self._total_bytes += stat.st_size
+
+
+def _extension_for(content_type, url):
+    """根据响应类型或URL确定文件扩展名"""
+    content_type = content_type.split(";")[0].strip().lower()
+    for extension, known_type in CONTENT_TYPES.items():
+        if content_type == known_type:
+            return extension
+    path_extension = os.path.splitext(url.split("?")[0])[1].lower()
+    if path_extension == ".jpeg":
+        return ".jpg"
+    return path_extension if path_extension in CONTENT_TYPES else ".png"
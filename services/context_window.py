@@ -0,0 +1,180 @@
+import math
+import re
+import threading
+from functools import lru_cache
+
+from config import CONTEXT_WINDOW_CONFIG
+
+# 中日韩字符、拉丁字母串、数字串、其余单个非空白字符
+_TOKEN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]|[A-Za-z]+|\d+|\S")
+
+_ELLIPSIS = "\n……（中间内容已省略）……\n"
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text):
+    """
+    离线估算文本的 token 数（近似 BPE 分词：汉字约1个 token，英文单词每4个字母约1个，数字每3位约1个）
+
+    会话历史中的消息在每次请求时重复出现，结果按文本缓存。
+    """
+    tokens = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        first = piece[0]
+        if first.isascii() and first.isalpha():
+            tokens += math.ceil(len(piece) / 4)
+        elif first.isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += 1
+    return tokens
+
+
+class ContextWindow:
+    """上下文窗口管理 - 按模型的 token 预算裁剪对话历史，始终保留系统消息和最近几轮对话"""
+
+    def __init__(self, config=None):
+        """初始化"""
+        self.config = config or CONTEXT_WINDOW_CONFIG
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "trimmed_requests": 0,
+            "tokens_sent": 0,
+            "tokens_saved": 0,
+            "dropped_messages": 0,
+            "truncated_messages": 0
+        }
+
+    def budget_for(self, model):
+        """模型的历史 token 预算"""
+        return self.config.get('budgets', {}).get(model, self.config.get('default_budget', 8000))
+
+    def count(self, message):
+        """单条消息的 token 数（含角色等格式开销）"""
+        return estimate_tokens(str(message.get("content", ""))) + self.config.get('message_overhead', 4)
+
+    def fit(self, model, messages):
+        """
+        裁剪消息使其不超过模型预算
+
+        优先整轮丢弃最早的对话；系统消息、最后一条消息和最近 keep_recent_turns 轮始终保留，
+        这些消息本身超出预算时截断其中较长消息的中间部分。
+
+        Args:
+            model (str): 模型标识
+            messages (list): 完整的对话消息
+
+        Returns:
+            tuple: (裁剪后的消息列表, 统计dict：original_tokens、tokens、saved_tokens、dropped_messages、truncated_messages)
+        """
+        budget = self.budget_for(model)
+        counts = [self.count(message) for message in messages]
+        original_tokens = sum(counts)
+
+        if original_tokens <= budget or len(messages) <= 1:
+            kept = list(range(len(messages)))
+            truncated = {}
+        else:
+            kept, truncated = self._select(messages, counts, budget)
+
+        fitted = []
+        for index in kept:
+            if index in truncated:
+                fitted.append(dict(messages[index], content=truncated[index][0]))
+            else:
+                fitted.append(messages[index])
+        tokens = sum(truncated[index][1] if index in truncated else counts[index] for index in kept)
+
+        info = {
+            "original_tokens": original_tokens,
+            "tokens": tokens,
+            "saved_tokens": original_tokens - tokens,
+            "dropped_messages": len(messages) - len(kept),
+            "truncated_messages": len(truncated)
+        }
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["tokens_sent"] += tokens
+            if info["saved_tokens"] > 0:
+                self._stats["trimmed_requests"] += 1
+                self._stats["tokens_saved"] += info["saved_tokens"]
+                self._stats["dropped_messages"] += info["dropped_messages"]
+                self._stats["truncated_messages"] += info["truncated_messages"]
+        return fitted, info
+
+    def stats(self):
+        """获取裁剪统计"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _select(self, messages, counts, budget):
+        """
+        选出要保留的消息
+
+        Returns:
+            tuple: (保留的消息下标列表, 被截断的消息 {下标: (截断后的内容, token数)})
+        """
+        last = len(messages) - 1
+        required = {index for index, message in enumerate(messages) if message.get("role") == "system"}
+        required.add(last)
+
+        # 从最后一条消息往前按轮分组：每轮从一条用户消息开始
+        turns = []
+        current = []
+        for index in range(last - 1, -1, -1):
+            if index in required:
+                continue
+            current.append(index)
+            if messages[index].get("role") == "user":
+                turns.append(current)
+                current = []
+        if current:
+            turns.append(current)
+
+        keep_recent = self.config.get('keep_recent_turns', 2)
+        for turn in turns[:keep_recent]:
+            required.update(turn)
+
+        used = sum(counts[index] for index in required)
+        kept = set(required)
+        for turn in turns[keep_recent:]:
+            cost = sum(counts[index] for index in turn)
+            if used + cost > budget:
+                # 保持时间顺序连续，不跳过较大的一轮去保留更早的对话
+                break
+            kept.update(turn)
+            used += cost
+
+        truncated = {}
+        if used > budget:
+            truncated = self._truncate(messages, counts, required - {last}, used - budget)
+        return sorted(kept), truncated
+
+    def _truncate(self, messages, counts, candidates, excess):
+        """从最长的必留消息开始截断中间部分，直到超出的 token 数被消除"""
+        min_tokens = self.config.get('min_truncated_tokens', 64)
+        truncated = {}
+        for index in sorted(candidates, key=lambda i: counts[i], reverse=True):
+            if excess <= 0:
+                break
+            if messages[index].get("role") == "system" or counts[index] <= min_tokens:
+                continue
+            target = max(min_tokens, counts[index] - excess)
+            overhead = self.config.get('message_overhead', 4)
+            content = _elide_middle(str(messages[index].get("content", "")), counts[index] - overhead, target - overhead)
+            tokens = self.count({"content": content})
+            if tokens < counts[index]:
+                truncated[index] = (content, tokens)
+                excess -= counts[index] - tokens
+        return truncated
+
+
+def _elide_middle(text, tokens, target):
+    """按 token 比例保留文本开头和结尾，省略中间部分"""
+    keep_chars = int(len(text) * (target - estimate_tokens(_ELLIPSIS)) / max(tokens, 1))
+    if keep_chars >= len(text):
+        return text
+    head = keep_chars // 2
+    tail = keep_chars - head
+    return text[:head] + _ELLIPSIS + (text[-tail:] if tail else "")
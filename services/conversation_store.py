@@ -0,0 +1,270 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from config import CONVERSATION_STORE_CONFIG
+from apis.log import get_logger
+
+logger = get_logger("sessions")
+
+_SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+
+class ConversationStore:
+    """服务端会话存储 - 按会话ID保存对话历史，空闲会话从内存淘汰，可选 sqlite 持久化"""
+
+    def __init__(self, config=None):
+        """初始化存储（配置了 disk_path 时打开磁盘层）"""
+        self.config = config or CONVERSATION_STORE_CONFIG
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # 会话ID -> {"messages": [(角色, 内容)], "summary", "bytes", "last_active"}
+        self._db = None
+        self._last_sweep = time.time()
+        self._stats = {
+            "created": 0,
+            "turns": 0,
+            "disk_loads": 0,
+            "trimmed_messages": 0,
+            "summarized_messages": 0,
+            "evictions": 0
+        }
+
+        disk_path = self.config.get('disk_path')
+        if disk_path:
+            self._open_disk(disk_path)
+
+    @staticmethod
+    def new_session_id():
+        """生成新的会话ID"""
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def is_valid_session_id(session_id):
+        """会话ID格式是否合法"""
+        return isinstance(session_id, str) and bool(_SESSION_ID_PATTERN.match(session_id))
+
+    def snapshot(self, session_id):
+        """
+        获取会话摘要和摘要之后的历史
+
+        Returns:
+            tuple: (摘要或 None, messages 格式的历史消息)，会话不存在（从未创建或已过期）时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            session = self._load(session_id)
+            if session is None:
+                return None
+            session["last_active"] = now
+            messages = [{"role": role, "content": content} for role, content in session["messages"]]
+            return session["summary"], messages
+
+    def replace_with_summary(self, session_id, covered, summary):
+        """
+        用摘要替换会话最早的一段消息
+
+        Args:
+            session_id (str): 会话ID
+            covered (list): 被摘要覆盖的消息（snapshot 返回的历史开头部分），
+                期间历史已被裁剪或改变时放弃替换
+            summary (str): 新的摘要（已包含旧摘要的内容）
+
+        Returns:
+            bool: 是否已替换
+        """
+        covered = [(message["role"], message["content"]) for message in covered]
+        count = len(covered)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session["messages"][:count] != covered:
+                return False
+            for _, content in covered:
+                session["bytes"] -= len(content.encode("utf-8"))
+            del session["messages"][:count]
+            session["bytes"] += len(summary.encode("utf-8")) - len((session["summary"] or "").encode("utf-8"))
+            session["summary"] = summary
+            self._stats["summarized_messages"] += count
+            self._save(session_id, session, time.time())
+            return True
+
+    def restore(self, session_id, history):
+        """
+        用客户端重新发送的历史恢复不存在（已过期）的会话，会话仍存在时不覆盖
+
+        Args:
+            session_id (str): 会话ID
+            history (list): [{"user": 用户消息, "assistant": 模型回答}, ...]
+        """
+        now = time.time()
+        with self._lock:
+            if self._load(session_id) is not None:
+                return
+            session = self._create(session_id, now)
+            for turn in history if isinstance(history, list) else []:
+                if not isinstance(turn, dict):
+                    continue
+                for role in ("user", "assistant"):
+                    content = turn.get(role)
+                    if isinstance(content, str) and content:
+                        session["messages"].append((role, content))
+                        session["bytes"] += len(content.encode("utf-8"))
+            self._trim(session)
+            self._save(session_id, session, now)
+
+    def append_turn(self, session_id, user_message, assistant_message):
+        """
+        追加一轮对话，超出单会话上限时从最早的一轮开始丢弃
+
+        Args:
+            session_id (str): 会话ID
+            user_message (str): 用户消息
+            assistant_message (str): 模型回答
+        """
+        now = time.time()
+        with self._lock:
+            session = self._load(session_id)
+            if session is None:
+                session = self._create(session_id, now)
+
+            for role, content in (("user", user_message), ("assistant", assistant_message)):
+                session["messages"].append((role, content))
+                session["bytes"] += len(content.encode("utf-8"))
+            session["last_active"] = now
+            self._stats["turns"] += 1
+            self._trim(session)
+            self._save(session_id, session, now)
+
+    def clear(self, session_id):
+        """删除会话"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._db.commit()
+
+    def stats(self):
+        """获取会话统计"""
+        with self._lock:
+            stats = dict(
+                self._stats,
+                memory_sessions=len(self._sessions),
+                memory_bytes=sum(session["bytes"] for session in self._sessions.values()),
+                disk_enabled=self._db is not None
+            )
+            if self._db is not None:
+                stats["disk_sessions"] = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return stats
+
+    def _load(self, session_id):
+        """从内存读取会话，内存中没有时从磁盘层加载（需持有锁）"""
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            return session
+        if self._db is None:
+            return None
+
+        row = self._db.execute(
+            "SELECT messages, summary FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        messages = [tuple(message) for message in json.loads(row[0])]
+        summary = row[1]
+        session = self._sessions[session_id] = {
+            "messages": messages,
+            "summary": summary,
+            "bytes": sum(len(content.encode("utf-8")) for _, content in messages)
+                     + len((summary or "").encode("utf-8")),
+            "last_active": time.time()
+        }
+        self._stats["disk_loads"] += 1
+        return session
+
+    def _create(self, session_id, now):
+        """创建空会话，超出内存会话数上限时淘汰最久未使用的会话（需持有锁）"""
+        session = self._sessions[session_id] = {
+            "messages": [],
+            "summary": None,
+            "bytes": 0,
+            "last_active": now
+        }
+        self._stats["created"] += 1
+        while len(self._sessions) > self.config.get('max_sessions', 10000):
+            self._sessions.popitem(last=False)
+            self._stats["evictions"] += 1
+        return session
+
+    def _trim(self, session):
+        """超出单会话消息数或字节数上限时按轮丢弃最早的消息，保证历史以用户消息开头（需持有锁）"""
+        max_messages = self.config.get('max_messages_per_session', 200)
+        max_bytes = self.config.get('max_bytes_per_session', 256 * 1024)
+        messages = session["messages"]
+        drop = 0
+        dropped_bytes = 0
+        # 至少保留最新一轮
+        while len(messages) - drop > 2 and (
+                len(messages) - drop > max_messages or session["bytes"] - dropped_bytes > max_bytes):
+            for role, content in messages[drop:drop + 2]:
+                dropped_bytes += len(content.encode("utf-8"))
+            drop += 2
+        if drop:
+            del messages[:drop]
+            session["bytes"] -= dropped_bytes
+            self._stats["trimmed_messages"] += drop
+
+    def _sweep(self, now):
+        """定期从内存中淘汰空闲会话，并清理磁盘层中过期的会话（需持有锁）"""
+        if now - self._last_sweep < self.config.get('sweep_interval', 60):
+            return
+        self._last_sweep = now
+
+        idle_ttl = self.config.get('idle_ttl', 1800)
+        for session_id, session in list(self._sessions.items()):
+            if now - session["last_active"] <= idle_ttl:
+                # 按最近使用顺序排列，后面的会话更活跃
+                break
+            del self._sessions[session_id]
+            self._stats["evictions"] += 1
+
+        if self._db is not None:
+            self._db.execute(
+                "DELETE FROM sessions WHERE updated_at <= ?", (now - self.config.get('disk_ttl', 7 * 24 * 3600),)
+            )
+            self._db.commit()
+
+    def _save(self, session_id, session, now):
+        """写入磁盘层（需持有锁）"""
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, messages, summary, updated_at) VALUES (?, ?, ?, ?)",
+                (session_id, json.dumps(session["messages"], ensure_ascii=False), session["summary"], now)
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.error("会话写入磁盘失败: %s", e)
+
+    def _open_disk(self, path):
+        """打开 sqlite 磁盘层，失败时只使用内存"""
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, summary TEXT, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            logger.info("💾 对话会话磁盘层: %s", path)
+        except sqlite3.Error as e:
+            logger.error("打开会话磁盘层失败，仅使用内存存储: %s", e)
+            self._db = None
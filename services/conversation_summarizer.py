@@ -0,0 +1,121 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CONVERSATION_SUMMARY_CONFIG
+from apis.log import get_logger
+from services.context_window import estimate_tokens
+
+logger = get_logger("summary")
+
+SUMMARY_INSTRUCTION = (
+    "你是对话摘要助手。请把下面的对话记录（以及已有摘要）合并成一份简洁的中文摘要，"
+    "保留用户的目标、偏好、已确认的事实、结论和尚未解决的问题，省略寒暄和重复内容。"
+    "只输出摘要正文，不超过{max_chars}字。"
+)
+
+
+def summary_message(summary):
+    """把会话摘要包装为系统消息，放在历史消息之前"""
+    return {"role": "system", "content": f"以下是此前对话的摘要，请结合摘要继续对话：\n{summary}"}
+
+
+def build_summary_prompt(previous_summary, messages, max_chars):
+    """构造生成摘要的请求消息"""
+    lines = []
+    if previous_summary:
+        lines.append(f"【已有摘要】\n{previous_summary}\n")
+    lines.append("【对话记录】")
+    for message in messages:
+        speaker = "用户" if message["role"] == "user" else "助手"
+        lines.append(f"{speaker}：{message['content']}")
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTION.format(max_chars=max_chars)},
+        {"role": "user", "content": "\n".join(lines)}
+    ]
+
+
+class ConversationSummarizer:
+    """对话滚动摘要 - 回答结束后在后台把较早的对话压缩进会话摘要，之后的请求用摘要代替原始对话"""
+
+    def __init__(self, store, complete, config=None):
+        """
+        Args:
+            store: ConversationStore 实例
+            complete: 调用模型生成文本的函数，参数为 messages，返回文本，失败时返回 None
+            config (dict): 摘要配置
+        """
+        self.store = store
+        self.complete = complete
+        self.config = config or CONVERSATION_SUMMARY_CONFIG
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = None
+        self._stats = {
+            "scheduled": 0,
+            "summarized": 0,
+            "skipped": 0,
+            "errors": 0,
+            "tokens_condensed": 0
+        }
+
+    def schedule(self, session_id):
+        """回答结束后调用：历史超过阈值时在后台生成摘要（同一会话同时只有一个摘要任务）"""
+        if not self.config.get('enabled', True):
+            return
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+            self._stats["scheduled"] += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config.get('workers', 2),
+                    thread_name_prefix="conversation-summary"
+                )
+        self._executor.submit(self._run, session_id)
+
+    def stats(self):
+        """获取摘要统计"""
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending))
+
+    def _run(self, session_id):
+        """历史超过阈值时把最近几轮之前的对话并入摘要"""
+        try:
+            snapshot = self.store.snapshot(session_id)
+            if snapshot is None:
+                with self._lock:
+                    self._stats["skipped"] += 1
+                return
+            summary, messages = snapshot
+            tokens = sum(estimate_tokens(message["content"]) for message in messages)
+            keep = self.config.get('keep_recent_turns', 2) * 2
+            if tokens < self.config.get('trigger_tokens', 3000) or len(messages) <= keep:
+                with self._lock:
+                    self._stats["skipped"] += 1
+                return
+
+            covered = messages[:len(messages) - keep]
+            new_summary = self.complete(
+                build_summary_prompt(summary, covered, self.config.get('max_summary_chars', 600))
+            )
+            if not new_summary:
+                raise RuntimeError("模型未返回摘要")
+
+            if self.store.replace_with_summary(session_id, covered, new_summary.strip()):
+                condensed = sum(estimate_tokens(message["content"]) for message in covered)
+                with self._lock:
+                    self._stats["summarized"] += 1
+                    self._stats["tokens_condensed"] += condensed
+                logger.info("📝 会话 %.8s 已将 %s 条消息并入摘要（约 %s tokens）", session_id, len(covered), condensed)
+            else:
+                with self._lock:
+                    self._stats["skipped"] += 1
+
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            logger.error("生成会话摘要失败 %.8s: %s", session_id, e)
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
@@ -0,0 +1,355 @@
+import asyncio
+import queue
+import threading
+import time
+
+from config import HEDGED_CHAT_CONFIG
+from apis.log import get_logger
+from apis.tracing import current_span
+from services.latency_stats import DecayingHistogram
+
+logger = get_logger("hedged_chat")
+
+# 首字延迟分桶（秒）
+TTFT_BUCKETS = (0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 8, 13, 20)
+
+# 同步流中各路请求向主线程报告的消息类型
+_CHUNK = "chunk"
+_END = "end"
+
+
+def is_error_chunk(chunk):
+    """是否为错误数据块"""
+    return "error" in chunk or chunk.get("type") == "error"
+
+
+def is_token_chunk(chunk):
+    """是否包含实际输出（思考或回答内容），兼容带 type 的格式和 choices 格式"""
+    if chunk.get("type") in ("thinking", "content"):
+        return bool(chunk.get("content"))
+    choices = chunk.get("choices")
+    if choices:
+        delta = choices[0].get("delta") or {}
+        return bool(delta.get("content") or delta.get("reasoning_content"))
+    return False
+
+
+class _Leg:
+    """同步对冲中的一路请求 - 在后台线程中读取客户端的流，把数据块交给主线程"""
+
+    def __init__(self, name, client, messages, kwargs, events):
+        self.name = name
+        self.started = time.monotonic()
+        self.buffer = []  # 出字之前的数据块，胜出后先发送
+        self.cancelled = threading.Event()
+        self.finished = False
+        self._events = events
+        self._stream = None
+        self._stream_lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, args=(client, messages, kwargs), name=f"hedge-{name}", daemon=True
+        )
+        self._thread.start()
+
+    def cancel(self):
+        """取消这一路：立即中断上游连接，阻塞在读取上的线程随即返回并关闭客户端的流"""
+        with self._stream_lock:
+            if self.cancelled.is_set():
+                return
+            self.cancelled.set()
+            stream = self._stream
+        self._abort(stream)
+
+    def _run(self, client, messages, kwargs):
+        stream = None
+        try:
+            stream = client.chat(messages, stream=True, **kwargs)
+            if isinstance(stream, dict):
+                self._events.put((self, _CHUNK, stream))
+                return
+            with self._stream_lock:
+                self._stream = stream
+                cancelled = self.cancelled.is_set()
+            if cancelled:
+                # 建立连接期间已被取消
+                self._abort(stream)
+            for chunk in stream:
+                if self.cancelled.is_set():
+                    break
+                self._events.put((self, _CHUNK, chunk))
+        except Exception as e:
+            self._events.put((self, _CHUNK, {"error": f"API请求失败: {str(e)}"}))
+        finally:
+            if stream is not None and hasattr(stream, "close"):
+                stream.close()
+            self._events.put((self, _END, None))
+
+    @staticmethod
+    def _abort(stream):
+        """中断客户端的流（客户端返回普通生成器时只能等读取线程收到下一个数据块）"""
+        if stream is not None and hasattr(stream, "abort"):
+            stream.abort()
+
+
+class HedgedChat:
+    """
+    对冲对话 - 先请求主模型，超过主模型首字延迟的 p90 仍没有输出时再请求备用模型，
+    哪一路先输出内容就转发哪一路，另一路立即取消并关闭上游连接
+
+    对外提供与对话客户端相同的 chat/achat 接口，可直接放入 api_clients。
+    非流式调用不做对冲，主模型失败时改用备用模型。
+    """
+
+    def __init__(self, primary, hedge, config=None):
+        """
+        Args:
+            primary: 主模型客户端
+            hedge: 备用模型客户端
+            config (dict): 对冲配置
+        """
+        self.primary = primary
+        self.hedge = hedge
+        self.config = config or HEDGED_CHAT_CONFIG
+        self._lock = threading.Lock()
+        self._ttft = DecayingHistogram(TTFT_BUCKETS, decay=self.config.get('decay', 0.98))
+        self._stats = {
+            "requests": 0,
+            "hedged": 0,
+            "primary_wins": 0,
+            "hedge_wins": 0,
+            "failed": 0,
+            "cancelled": 0
+        }
+
+    def get_model_info(self):
+        """获取模型信息"""
+        return {
+            "name": "最快响应",
+            "description": "同时准备两个模型，首字较慢时由另一个模型接手",
+            "type": "chat"
+        }
+
+    def hedge_delay(self):
+        """发出对冲请求前等待的时间（秒）：主模型首字延迟的分位数，样本不足时使用默认值"""
+        with self._lock:
+            if self._ttft.samples < self.config.get('min_samples', 20):
+                delay = self.config.get('default_delay', 1.5)
+            else:
+                delay = self._ttft.quantile(self.config.get('quantile', 0.9))
+        return min(max(delay, self.config.get('min_delay', 0.2)), self.config.get('max_delay', 5))
+
+    def stats(self):
+        """获取对冲统计"""
+        delay = self.hedge_delay()
+        with self._lock:
+            return dict(
+                self._stats,
+                hedge_delay=round(delay, 3),
+                ttft_samples=self._ttft.samples
+            )
+
+    def chat(self, messages, stream=True, **kwargs):
+        """对话（同步），流式调用时返回数据块生成器"""
+        if not stream:
+            return self._complete(messages, kwargs)
+        return self._stream(messages, kwargs)
+
+    async def achat(self, messages, stream=True, **kwargs):
+        """对话（异步），流式调用时返回异步数据块生成器"""
+        if not stream:
+            return await asyncio.to_thread(self._complete, messages, kwargs)
+        return self._astream(messages, kwargs)
+
+    def _complete(self, messages, kwargs):
+        """非流式：主模型失败时改用备用模型"""
+        result = self.primary.chat(messages, stream=False, **kwargs)
+        if isinstance(result, dict) and "error" in result:
+            logger.warning("主模型请求失败，改用备用模型: %s", result["error"])
+            return self.hedge.chat(messages, stream=False, **kwargs)
+        return result
+
+    def _stream(self, messages, kwargs):
+        """同步流式对冲：两路请求在后台线程中读取，由当前线程决定胜者并转发"""
+        events = queue.Queue()
+        primary = _Leg("primary", self.primary, messages, kwargs, events)
+        legs = [primary]
+        deadline = primary.started + self.hedge_delay()
+        winner = None
+        last_error = None
+        self._record("requests")
+        try:
+            while True:
+                hedging = len(legs) > 1
+                timeout = None if winner is not None or hedging else max(deadline - time.monotonic(), 0)
+                try:
+                    leg, kind, chunk = events.get(timeout=timeout)
+                except queue.Empty:
+                    self._start_hedge()
+                    legs.append(_Leg("hedge", self.hedge, messages, kwargs, events))
+                    continue
+
+                if winner is not None:
+                    if leg is winner:
+                        if kind == _END:
+                            return
+                        yield chunk
+                    continue
+
+                if kind == _END:
+                    leg.finished = True
+                    if not hedging:
+                        # 主模型没有输出就结束了，立即发出对冲请求
+                        self._start_hedge()
+                        legs.append(_Leg("hedge", self.hedge, messages, kwargs, events))
+                    elif all(other.finished for other in legs):
+                        # 两路都没有输出内容：返回最后的错误，或原样返回已收到的数据块
+                        if last_error is not None:
+                            self._record("failed")
+                            yield last_error
+                        else:
+                            yield from leg.buffer
+                        return
+                    continue
+
+                if is_error_chunk(chunk):
+                    last_error = chunk
+                    continue
+                if not is_token_chunk(chunk):
+                    leg.buffer.append(chunk)
+                    continue
+
+                winner = leg
+                self._on_first_token(leg, legs)
+                yield from leg.buffer
+                yield chunk
+        finally:
+            for leg in legs:
+                leg.cancel()
+
+    async def _astream(self, messages, kwargs):
+        """异步流式对冲：取消落后一路的读取任务会直接关闭其上游连接"""
+        legs = {"primary": self._aleg(self.primary, messages, kwargs)}
+        started = {"primary": time.monotonic()}
+        pending = {"primary": asyncio.ensure_future(legs["primary"].__anext__())}
+        buffers = {"primary": []}
+        deadline = started["primary"] + self.hedge_delay()
+        winner = None
+        last_error = None
+        self._record("requests")
+
+        def start_hedge():
+            self._start_hedge()
+            legs["hedge"] = self._aleg(self.hedge, messages, kwargs)
+            started["hedge"] = time.monotonic()
+            pending["hedge"] = asyncio.ensure_future(legs["hedge"].__anext__())
+            buffers["hedge"] = []
+
+        try:
+            while winner is None:
+                if not pending:
+                    self._record("failed")
+                    if last_error is not None:
+                        yield last_error
+                    return
+
+                timeout = None if "hedge" in legs else max(deadline - time.monotonic(), 0)
+                done, _ = await asyncio.wait(set(pending.values()), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    start_hedge()
+                    continue
+
+                for name, task in list(pending.items()):
+                    if task not in done:
+                        continue
+                    del pending[name]
+                    try:
+                        chunk = task.result()
+                    except StopAsyncIteration:
+                        if "hedge" not in legs:
+                            start_hedge()
+                        continue
+                    except Exception as e:
+                        last_error = {"error": f"API请求失败: {str(e)}"}
+                        if "hedge" not in legs:
+                            start_hedge()
+                        continue
+
+                    if is_error_chunk(chunk):
+                        last_error = chunk
+                    elif is_token_chunk(chunk):
+                        buffers[name].append(chunk)
+                        winner = name
+                        break
+                    else:
+                        buffers[name].append(chunk)
+                    pending[name] = asyncio.ensure_future(legs[name].__anext__())
+
+            # 取消落后的一路：正在等待的读取任务被取消后，客户端的流随之关闭上游连接
+            losers = [name for name in pending if name != winner]
+            for task in pending.values():
+                task.cancel()
+            await asyncio.gather(*pending.values(), return_exceptions=True)
+            pending.clear()
+            self._finish(
+                winner, losers, primary_elapsed=time.monotonic() - started["primary"],
+                primary_failed=winner != "primary" and "primary" not in losers
+            )
+
+            for chunk in buffers[winner]:
+                yield chunk
+            async for chunk in legs[winner]:
+                yield chunk
+        finally:
+            # 先等被取消的读取任务结束，正在运行的异步生成器不能直接 aclose
+            for task in pending.values():
+                task.cancel()
+            await asyncio.gather(*pending.values(), return_exceptions=True)
+            for leg in legs.values():
+                await leg.aclose()
+
+    async def _aleg(self, client, messages, kwargs):
+        """一路异步请求的数据块（请求阶段的错误字典也作为数据块返回），结束或被取消时关闭客户端的流"""
+        stream = await client.achat(messages, stream=True, **kwargs)
+        if isinstance(stream, dict):
+            yield stream
+            return
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    def _start_hedge(self):
+        """记录对冲请求"""
+        self._record("hedged")
+        current_span().add_event("hedge_started")
+        logger.debug("主模型首字超时或失败，发出对冲请求")
+
+    def _on_first_token(self, winner, legs):
+        """同步流决出胜者：取消其余请求并记录主模型首字延迟"""
+        losers = [leg for leg in legs if leg is not winner and not leg.finished]
+        for leg in losers:
+            leg.cancel()
+        primary = legs[0]
+        self._finish(
+            winner.name, losers, primary_elapsed=time.monotonic() - primary.started,
+            primary_failed=primary.finished and winner is not primary
+        )
+
+    def _finish(self, winner, losers, primary_elapsed, primary_failed):
+        """
+        记录胜者、被取消的请求数和主模型首字延迟
+
+        备用模型胜出时主模型尚未出字，记录的是被取消时已等待的时间（真实首字延迟的下界），
+        避免只统计较快的样本使对冲等待时间越学越短；主模型失败时不记录。
+        """
+        current_span().set_attribute("hedge_winner", winner)
+        with self._lock:
+            self._stats["primary_wins" if winner == "primary" else "hedge_wins"] += 1
+            self._stats["cancelled"] += len(losers)
+            if not primary_failed:
+                self._ttft.observe(primary_elapsed)
+
+    def _record(self, key):
+        with self._lock:
+            self._stats[key] += 1
@@ -0,0 +1,255 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import IMAGE_VARIANTS_CONFIG
+from apis.log import get_logger
+
+logger = get_logger("image_variants")
+
+_DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_VARIANT_PATTERN = re.compile(r"^(thumb|w\d{2,4})\.webp$")
+
+
+def render_variants(source_path, output_dir, widths, thumbnail_size, quality):
+    """
+    生成缩略图和各宽度的 WebP 版本（在子进程中执行，不占用服务进程的 GIL）
+
+    Args:
+        source_path (str): 原图路径
+        output_dir (str): 输出目录
+        widths (list): 目标宽度，不超过原图宽度的才会生成
+        thumbnail_size (int): 正方形缩略图边长
+        quality (int): WebP 质量
+
+    Returns:
+        dict: files（文件名 -> 字节数）、width、height（原图尺寸）
+    """
+    from PIL import Image, ImageOps
+
+    os.makedirs(output_dir, exist_ok=True)
+    produced = {}
+
+    def save(img, name):
+        path = os.path.join(output_dir, name)
+        temp_path = path + ".part"
+        img.save(temp_path, "WEBP", quality=quality, method=4)
+        os.replace(temp_path, path)
+        produced[name] = os.path.getsize(path)
+
+    with Image.open(source_path) as source:
+        img = source.convert("RGBA" if source.mode in ("RGBA", "LA", "P") else "RGB")
+
+    # 从大到小依次缩放，每次以上一级结果为输入，减少大图重复缩放的开销
+    current = img
+    for width in sorted(set(widths), reverse=True):
+        if width >= img.width:
+            continue
+        height = max(1, round(img.height * width / img.width))
+        current = current.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        save(current, f"w{width}.webp")
+
+    thumbnail = ImageOps.fit(current, (thumbnail_size, thumbnail_size), Image.LANCZOS)
+    save(thumbnail, "thumb.webp")
+
+    # 最后写入原图尺寸，同时作为全部版本已生成的标记
+    info = {"files": produced, "width": img.width, "height": img.height}
+    with open(os.path.join(output_dir, "meta.json.part"), "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    os.replace(os.path.join(output_dir, "meta.json.part"), os.path.join(output_dir, "meta.json"))
+    return info
+
+
+class ImageVariants:
+    """生成图片的派生版本 - 在进程池中生成缩略图和多宽度 WebP，结果按内容哈希缓存到磁盘"""
+
+    def __init__(self, config=None):
+        """初始化输出目录并扫描已生成的版本"""
+        self.config = config or IMAGE_VARIANTS_CONFIG
+        self.root = self.config['root']
+        self._lock = threading.Lock()
+        self._variants = {}  # 内容哈希 -> {"files": {文件名: 字节数}, "width", "size", "last_access"}
+        self._total_bytes = 0
+        self._pending = set()
+        self._executor = None
+        self._stats = {
+            "generated": 0,
+            "errors": 0,
+            "evictions": 0,
+            "served": 0,
+            "fallbacks": 0
+        }
+
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    def generate_async(self, digest, source_path):
+        """在进程池中生成派生版本（同一图片只生成一次）"""
+        if not _DIGEST_PATTERN.match(digest):
+            return
+        with self._lock:
+            if digest in self._variants or digest in self._pending:
+                return
+            self._pending.add(digest)
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.config.get('workers', 2))
+            executor = self._executor
+
+        try:
+            future = executor.submit(
+                render_variants,
+                source_path,
+                self._variant_dir(digest),
+                self.config.get('widths', [320, 640, 1024]),
+                self.config.get('thumbnail_size', 256),
+                self.config.get('quality', 80)
+            )
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._reset_executor(executor)
+            self._on_failed(digest, e)
+            return
+        future.add_done_callback(lambda f: self._on_done(digest, executor, f))
+
+    def describe(self, digest):
+        """
+        获取图片派生版本的地址
+
+        Returns:
+            dict: thumbnail_url、srcset（包含原图作为最大候选）、widths，尚未生成时返回 None
+        """
+        with self._lock:
+            entry = self._variants.get(digest)
+            if entry is None:
+                return None
+            widths = sorted(
+                int(name[1:-5]) for name in entry["files"] if name.startswith("w")
+            )
+            source_width = entry["width"]
+        base = f"/artifacts/{digest}"
+        candidates = [f"{base}/w{width}.webp {width}w" for width in widths]
+        candidates.append(f"{base} {source_width}w")
+        return {
+            "thumbnail_url": f"{base}/thumb.webp",
+            "srcset": ", ".join(candidates),
+            "widths": widths + [source_width]
+        }
+
+    def open_variant(self, digest, name):
+        """
+        获取派生版本的文件路径，同时更新访问时间
+
+        Returns:
+            str: 文件路径，不存在或尚未生成时返回 None
+        """
+        if not _DIGEST_PATTERN.match(digest) or not _VARIANT_PATTERN.match(name):
+            return None
+        with self._lock:
+            entry = self._variants.get(digest)
+            if entry is None or name not in entry["files"]:
+                return None
+            entry["last_access"] = time.time()
+            self._stats["served"] += 1
+        return os.path.join(self._variant_dir(digest), name)
+
+    def record_fallback(self):
+        """记录一次派生版本缺失时回退到原图"""
+        with self._lock:
+            self._stats["fallbacks"] += 1
+
+    def stats(self):
+        """获取派生版本统计"""
+        with self._lock:
+            return dict(
+                self._stats,
+                images=len(self._variants),
+                total_bytes=self._total_bytes,
+                max_bytes=self.config.get('max_bytes'),
+                pending=len(self._pending)
+            )
+
+    def _on_done(self, digest, executor, future):
+        """进程池任务完成回调"""
+        try:
+            info = future.result()
+        except BrokenProcessPool as e:
+            self._reset_executor(executor)
+            self._on_failed(digest, e)
+            return
+        except Exception as e:
+            self._on_failed(digest, e)
+            return
+
+        files = info["files"]
+        size = sum(files.values())
+        with self._lock:
+            self._pending.discard(digest)
+            self._variants[digest] = {
+                "files": files,
+                "width": info["width"],
+                "size": size,
+                "last_access": time.time()
+            }
+            self._total_bytes += size
+            self._stats["generated"] += 1
+            self._evict()
+        logger.info("🖼️ 已生成图片派生版本 %.12s: %s", digest, ', '.join(sorted(files)))
+
+    def _on_failed(self, digest, error):
+        with self._lock:
+            self._pending.discard(digest)
+            self._stats["errors"] += 1
+        logger.error("生成图片派生版本失败 %.12s: %s", digest, error)
+
+    def _reset_executor(self, executor):
+        """子进程异常退出后丢弃进程池，下次提交时重新创建"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _evict(self):
+        """超出磁盘预算时删除最久未访问图片的全部派生版本（需持有锁）"""
+        max_bytes = self.config.get('max_bytes', 256 * 1024 * 1024)
+        if self._total_bytes <= max_bytes:
+            return
+        for digest, entry in sorted(self._variants.items(), key=lambda item: item[1]["last_access"]):
+            if self._total_bytes <= max_bytes:
+                break
+            shutil.rmtree(self._variant_dir(digest), ignore_errors=True)
+            del self._variants[digest]
+            self._total_bytes -= entry["size"]
+            self._stats["evictions"] += 1
+
+    def _variant_dir(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _scan(self):
+        """启动时扫描已生成的版本（没有 meta.json 的目录视为未完成，之后重新生成）"""
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for digest in os.listdir(prefix_dir):
+                directory = os.path.join(prefix_dir, digest)
+                if not _DIGEST_PATTERN.match(digest) or not os.path.isdir(directory):
+                    continue
+                meta_path = os.path.join(directory, "meta.json")
+                try:
+                    with open(meta_path, encoding="utf-8") as f:
+                        info = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                files = info["files"]
+                size = sum(files.values())
+                self._variants[digest] = {
+                    "files": files,
+                    "width": info["width"],
+                    "size": size,
+                    "last_access": os.path.getmtime(meta_path)
+                }
+                self._total_bytes += size
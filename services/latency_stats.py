@@ -0,0 +1,212 @@
+import threading
+
+from config import TASK_DURATION_CONFIG
+
+# 对数分桶边界（秒），覆盖从1秒到1小时的耗时
+DEFAULT_BUCKETS = (
+    1, 2, 3, 5, 7, 10, 15, 20, 30, 45, 60, 90, 120, 180,
+    240, 300, 420, 600, 900, 1200, 1800, 3600
+)
+
+
+class DecayingHistogram:
+    """指数衰减的分桶直方图 - 每次写入时旧样本权重衰减，统计结果跟随近期表现"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, decay=0.98):
+        """
+        Args:
+            buckets (tuple): 递增的桶上界
+            decay (float): 每写入一个样本时旧样本的保留比例
+        """
+        self.buckets = tuple(buckets)
+        self.decay = decay
+        self.counts = [0.0] * (len(self.buckets) + 1)
+        self.weight = 0.0
+        self.samples = 0
+
+    def observe(self, value):
+        """写入一个样本"""
+        if self.decay < 1:
+            self.counts = [count * self.decay for count in self.counts]
+            self.weight *= self.decay
+        self.counts[self._bucket_of(value)] += 1
+        self.weight += 1
+        self.samples += 1
+
+    def quantile(self, q):
+        """估算分位数（桶内线性插值），无样本时返回 None"""
+        if self.weight <= 0:
+            return None
+
+        target = q * self.weight
+        cumulative = 0.0
+        for index, count in enumerate(self.counts):
+            if count <= 0:
+                continue
+            if cumulative + count >= target:
+                lower, upper = self._bucket_range(index)
+                return lower + (upper - lower) * (target - cumulative) / count
+            cumulative += count
+        return self._bucket_range(len(self.counts) - 1)[1]
+
+    def cdf(self, value):
+        """估算不超过 value 的样本比例，无样本时返回 None"""
+        if self.weight <= 0:
+            return None
+
+        cumulative = 0.0
+        for index, count in enumerate(self.counts):
+            lower, upper = self._bucket_range(index)
+            if value >= upper:
+                cumulative += count
+            else:
+                if value > lower:
+                    cumulative += count * (value - lower) / (upper - lower)
+                break
+        return min(cumulative / self.weight, 1.0)
+
+    def _bucket_of(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                return index
+        return len(self.buckets)
+
+    def _bucket_range(self, index):
+        lower = self.buckets[index - 1] if index > 0 else 0
+        # 溢出桶按最后一个桶宽度的两倍估算上界
+        upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1] * 2
+        return lower, upper
+
+
+class TaskDurationStats:
+    """任务完成耗时统计 - 按任务类型和参数组合分别记录"""
+
+    def __init__(self, config=None):
+        """初始化"""
+        self.config = config or TASK_DURATION_CONFIG
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, kind, params, duration):
+        """
+        记录一次任务完成耗时（同时计入参数组合和任务类型两个维度）
+
+        Args:
+            kind (str): 任务类型，"image" 或 "video"
+            params (dict): 任务参数
+            duration (float): 从创建到完成的耗时（秒）
+        """
+        with self._lock:
+            for key in ((kind, param_key(kind, params)), (kind, None)):
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = DecayingHistogram(decay=self.config.get('decay', 0.98))
+                histogram.observe(duration)
+
+    def quantile(self, kind, params, q):
+        """
+        估算任务耗时分位数 - 样本不足时依次退回到任务类型统计和先验值
+
+        Returns:
+            float: 耗时（秒）
+        """
+        with self._lock:
+            histogram = self._histogram_for(kind, params)
+            if histogram is not None:
+                return histogram.quantile(q)
+        return self._prior_quantile(kind, params, q)
+
+    def cdf(self, kind, params, elapsed):
+        """
+        估算任务在 elapsed 秒内完成的概率
+
+        Returns:
+            float: 0-1 之间的概率
+        """
+        with self._lock:
+            histogram = self._histogram_for(kind, params)
+            if histogram is not None:
+                return histogram.cdf(elapsed)
+
+        # 先验：按分位数表线性插值
+        points = self._prior_points(kind, params)
+        previous_q, previous_value = 0.0, 0.0
+        for q, value in points:
+            if elapsed <= value:
+                return previous_q + (q - previous_q) * (elapsed - previous_value) / max(value - previous_value, 1e-9)
+            previous_q, previous_value = q, value
+        return 1.0
+
+    def sample_count(self, kind, params=None):
+        """获取样本数量（params 为 None 时返回任务类型总数）"""
+        key = (kind, param_key(kind, params) if params is not None else None)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            return histogram.samples if histogram else 0
+
+    def snapshot(self):
+        """导出各参数组合的耗时统计摘要"""
+        with self._lock:
+            return [
+                {
+                    "kind": kind,
+                    "params": list(key) if key else None,
+                    "samples": histogram.samples,
+                    "p50": round(histogram.quantile(0.5), 1),
+                    "p90": round(histogram.quantile(0.9), 1)
+                }
+                for (kind, key), histogram in self._histograms.items()
+            ]
+
+    def _histogram_for(self, kind, params):
+        """选择样本足够的直方图（需持有锁）"""
+        min_samples = self.config.get('min_samples', 5)
+        for key in ((kind, param_key(kind, params)), (kind, None)):
+            histogram = self._histograms.get(key)
+            if histogram is not None and histogram.samples >= min_samples:
+                return histogram
+        return None
+
+    def _prior_quantile(self, kind, params, q):
+        """根据先验分位数表插值"""
+        previous_q, previous_value = 0.0, 0.0
+        for point_q, value in self._prior_points(kind, params):
+            if q <= point_q:
+                return previous_value + (value - previous_value) * (q - previous_q) / (point_q - previous_q)
+            previous_q, previous_value = point_q, value
+        return previous_value
+
+    def _prior_points(self, kind, params):
+        """先验耗时分布：以中位数为基准的分位数表"""
+        median = self._prior_median(kind, params or {})
+        return [
+            (q, median * factor)
+            for q, factor in self.config.get('prior_spread', [(0.1, 0.6), (0.5, 1.0), (0.9, 1.6), (1.0, 2.5)])
+        ]
+
+    def _prior_median(self, kind, params):
+        """尚无样本时的耗时中位数估计"""
+        priors = self.config.get('priors', {})
+        if kind == "video":
+            video = priors.get('video', {})
+            median = video.get('seconds_per_video_second', 20) * int(params.get('duration') or 5)
+            median *= video.get('quality_factor', {}).get(params.get('quality'), 1.0)
+            if int(params.get('fps') or 30) >= 60:
+                median *= video.get('high_fps_factor', 1.0)
+            if params.get('size') == '3840x2160':
+                median *= video.get('uhd_factor', 1.0)
+            return median
+        return priors.get('image', {}).get('median', 20)
+
+
+def param_key(kind, params):
+    """任务参数组合的统计键"""
+    params = params or {}
+    if kind == "video":
+        return (
+            params.get('quality'),
+            params.get('size'),
+            params.get('fps'),
+            params.get('duration')
+        )
+    return (params.get('size'), params.get('style'))
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import deque
+
+from config import MODEL_ROUTER_CONFIG
+
+
+class ModelEstimate:
+    """单个模型的指数衰减估计：首字延迟、生成速度和错误率"""
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.ttft = None
+        self.tokens_per_sec = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.errors = 0
+        self.last_observed = 0.0
+
+    def observe(self, ttft=None, tokens_per_sec=None, error=False):
+        """记录一次流式调用的结果"""
+        self.samples += 1
+        self.last_observed = time.time()
+        self.error_rate = self._blend(self.error_rate, 1.0 if error else 0.0)
+        if error:
+            self.errors += 1
+            return
+        if ttft is not None:
+            self.ttft = ttft if self.ttft is None else self._blend(self.ttft, ttft)
+        if tokens_per_sec is not None:
+            self.tokens_per_sec = tokens_per_sec if self.tokens_per_sec is None else self._blend(
+                self.tokens_per_sec, tokens_per_sec
+            )
+
+    def _blend(self, current, value):
+        return current + self.alpha * (value - current)
+
+    def to_dict(self):
+        return {
+            "ttft": round(self.ttft, 3) if self.ttft is not None else None,
+            "tokens_per_sec": round(self.tokens_per_sec, 1) if self.tokens_per_sec is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "samples": self.samples,
+            "errors": self.errors,
+            "last_observed": round(self.last_observed, 3) if self.last_observed else None
+        }
+
+
+class ModelRouter:
+    """
+    自动模型路由 - 为 model="auto" 的对话选择当前最能满足延迟目标（SLO）的模型
+
+    每个候选模型的首字延迟、生成速度和错误率用指数衰减平均估计（所有流式对话都会更新，
+    不限于自动路由的请求）。选择时估算完整回答的预期耗时：
+        (首字延迟 + 预期 token 数 / 生成速度) / (1 - 错误率)
+    满足首字延迟、生成速度和错误率目标的模型中取预期耗时最短的；都不满足时取预期耗时最短的。
+    超过 probe_interval 没有观测的模型先分配一次请求，出过错的模型也能在恢复后重新被选中。
+    上游熔断中的模型不参与选择（全部熔断时仍按上述规则选择，由客户端快速返回熔断错误）。
+    """
+
+    def __init__(self, candidates=None, config=None, is_available=None):
+        """
+        Args:
+            candidates (list): 候选模型标识，默认使用配置中的 candidates
+            config (dict): 路由配置
+            is_available (callable): 接收模型标识，返回其上游当前是否可用，可选
+        """
+        self.config = config or MODEL_ROUTER_CONFIG
+        self.candidates = list(candidates if candidates is not None else self.config['candidates'])
+        self.is_available = is_available
+        self._lock = threading.Lock()
+        self._estimates = {name: ModelEstimate(self.config.get('alpha', 0.2)) for name in self.candidates}
+        self._probed_at = {name: 0.0 for name in self.candidates}
+        self._decisions = deque(maxlen=self.config.get('history', 100))
+        self._routed = {name: 0 for name in self.candidates}
+
+    def observe(self, model, ttft=None, tokens_per_sec=None, error=False):
+        """
+        记录一次流式调用的结果，非候选模型忽略
+
+        Args:
+            model (str): 模型标识
+            ttft (float): 首字延迟（秒）
+            tokens_per_sec (float): 生成速度
+            error (bool): 调用是否失败
+        """
+        estimate = self._estimates.get(model)
+        if estimate is None:
+            return
+        with self._lock:
+            estimate.observe(ttft, tokens_per_sec, error)
+
+    def choose(self):
+        """
+        选择模型并记录决策
+
+        Returns:
+            tuple: (模型标识, 决策dict)
+        """
+        now = time.time()
+        with self._lock:
+            inputs = {name: self._evaluate(name) for name in self.candidates}
+            model, reason = self._pick(inputs, now)
+            if reason == "probe":
+                self._probed_at[model] = now
+            self._routed[model] += 1
+            decision = {
+                "at": round(now, 3),
+                "model": model,
+                "reason": reason,
+                "inputs": inputs
+            }
+            self._decisions.append(decision)
+        return model, decision
+
+    def status(self):
+        """路由状态：目标、各模型的当前估计和最近的决策（最新的在前）"""
+        with self._lock:
+            return {
+                "slo": {
+                    "ttft": self.config['ttft_slo'],
+                    "min_tokens_per_sec": self.config['min_tokens_per_sec'],
+                    "max_error_rate": self.config['max_error_rate']
+                },
+                "candidates": {
+                    name: dict(self._evaluate(name), routed=self._routed[name]) for name in self.candidates
+                },
+                "decisions": list(reversed(self._decisions))
+            }
+
+    def stats(self):
+        """获取路由统计"""
+        with self._lock:
+            return {
+                "candidates": list(self.candidates),
+                "routed": dict(self._routed),
+                "decisions": len(self._decisions)
+            }
+
+    def _evaluate(self, name):
+        """计算模型的预期耗时和是否满足目标（调用方持有锁）"""
+        estimate = self._estimates[name]
+        result = estimate.to_dict()
+        result["available"] = self.is_available is None or self.is_available(name)
+        if estimate.ttft is None or not estimate.tokens_per_sec:
+            result.update(expected_latency=None, meets_slo=False)
+            return result
+
+        success_rate = max(1 - estimate.error_rate, 0.05)
+        expected = (estimate.ttft + self.config.get('expected_tokens', 300) / estimate.tokens_per_sec) / success_rate
+        result.update(
+            expected_latency=round(expected, 3),
+            meets_slo=(
+                estimate.ttft <= self.config['ttft_slo']
+                and estimate.tokens_per_sec >= self.config['min_tokens_per_sec']
+                and estimate.error_rate <= self.config['max_error_rate']
+            )
+        )
+        return result
+
+    def _pick(self, inputs, now):
+        """按探测、满足目标、预期耗时的顺序选择（调用方持有锁）"""
+        candidates = [name for name in self.candidates if inputs[name]["available"]] or self.candidates
+        interval = self.config.get('probe_interval', 60)
+        for name in candidates:
+            last_seen = max(self._estimates[name].last_observed, self._probed_at[name])
+            if now - last_seen >= interval:
+                return name, "probe"
+
+        scored = [name for name in candidates if inputs[name]["expected_latency"] is not None]
+        if not scored:
+            return candidates[0], "default"
+        within_slo = [name for name in scored if inputs[name]["meets_slo"]]
+        pool = within_slo or scored
+        best = min(pool, key=lambda name: inputs[name]["expected_latency"])
+        return best, "meets_slo" if within_slo else "best_effort"
@@ -0,0 +1,48 @@
+from config import POLL_SCHEDULER_CONFIG
+
+
+class PollScheduler:
+    """自适应轮询计划 - 根据历史完成耗时决定下一次查询任务状态的时间"""
+
+    def __init__(self, durations, config=None):
+        """
+        Args:
+            durations (TaskDurationStats): 任务耗时统计
+            config (dict): 轮询配置，默认使用 POLL_SCHEDULER_CONFIG
+        """
+        self.durations = durations
+        self.config = config or POLL_SCHEDULER_CONFIG
+
+    def next_delay(self, kind, params, elapsed):
+        """
+        计算下一次轮询前的等待时间
+
+        预计完成前稀疏轮询，在预计完成区间内密集轮询，超出预期后逐步退避。
+
+        Args:
+            kind (str): 任务类型
+            params (dict): 任务参数
+            elapsed (float): 任务已运行时间（秒）
+
+        Returns:
+            float: 等待秒数
+        """
+        min_interval = self.config['min_interval'][kind]
+        max_interval = self.config['max_interval'][kind]
+        dense_start = self.durations.quantile(kind, params, self.config.get('dense_start_quantile', 0.1))
+        dense_end = self.durations.quantile(kind, params, self.config.get('dense_end_quantile', 0.9))
+
+        if elapsed < dense_start:
+            # 早期：每次只等待剩余时间的一部分，逐步逼近密集区间
+            delay = (dense_start - elapsed) * self.config.get('early_fraction', 0.5)
+        elif elapsed <= dense_end:
+            delay = min_interval
+        else:
+            # 超出预期：等待时间随超时长度增长
+            delay = (elapsed - dense_end) * self.config.get('backoff_factor', 0.5)
+
+        return min(max(delay, min_interval), max_interval)
+
+    def record_completion(self, kind, params, duration):
+        """记录任务完成耗时"""
+        self.durations.observe(kind, params, duration)
@@ -0,0 +1,67 @@
+from config import PROGRESS_ESTIMATOR_CONFIG
+
+
+class ProgressEstimator:
+    """任务进度估算 - 根据同类任务的历史耗时分布，由已运行时间推算完成百分比和剩余时间"""
+
+    def __init__(self, durations, config=None):
+        """
+        Args:
+            durations (TaskDurationStats): 任务耗时统计
+            config (dict): 估算配置，默认使用 PROGRESS_ESTIMATOR_CONFIG
+        """
+        self.durations = durations
+        self.config = config or PROGRESS_ESTIMATOR_CONFIG
+
+    def estimate(self, kind, params, elapsed):
+        """
+        估算进行中任务的进度
+
+        已运行 elapsed 秒仍未完成时，总耗时服从历史分布在 elapsed 之后的条件分布，
+        取其中位数作为预计总耗时，取两侧分位数作为剩余时间的置信区间。
+
+        Args:
+            kind (str): 任务类型
+            params (dict): 任务参数
+            elapsed (float): 任务已运行时间（秒）
+
+        Returns:
+            dict: percentage、eta_seconds、eta_range、confidence 等进度字段
+        """
+        elapsed = max(elapsed, 0)
+        confidence = self.config.get('confidence', 0.8)
+        done_share = self.durations.cdf(kind, params, elapsed)
+        # 越过历史最大耗时后分布不再提供信息，只保留一点余量
+        overdue = done_share >= self.config.get('max_done_share', 0.98)
+        done_share = min(done_share, self.config.get('max_done_share', 0.98))
+
+        def conditional_quantile(q):
+            return self.durations.quantile(kind, params, done_share + (1 - done_share) * q)
+
+        expected_total = max(conditional_quantile(0.5), elapsed)
+        eta = expected_total - elapsed
+        eta_low = max(conditional_quantile((1 - confidence) / 2) - elapsed, 0)
+        eta_high = max(conditional_quantile((1 + confidence) / 2) - elapsed, eta)
+
+        percentage = elapsed / expected_total * 100 if expected_total > 0 else 0
+        percentage = min(max(percentage, self.config.get('min_percentage', 1)), self.config.get('max_percentage', 99))
+
+        return {
+            "percentage": int(percentage),
+            "elapsed_seconds": round(elapsed, 1),
+            "eta_seconds": round(eta, 1),
+            "eta_range": [round(eta_low, 1), round(eta_high, 1)],
+            "confidence": confidence,
+            "samples": self.durations.sample_count(kind, params),
+            "overdue": overdue,
+            "estimated_time": "已超出预计时间，请稍候..." if overdue else format_eta(eta_low, eta_high)
+        }
+
+
+def format_eta(low, high):
+    """把剩余时间区间格式化为界面文案"""
+    if high < 1:
+        return "即将完成"
+    if high < 120:
+        return f"预计还需{max(int(low), 1)}-{max(int(high + 0.5), 1)}秒"
+    return f"预计还需{max(int(low // 60), 1)}-{int(high // 60) + 1}分钟"
@@ -0,0 +1,223 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import RESPONSE_CACHE_CONFIG
+from apis.log import get_logger
+
+logger = get_logger("chat_cache")
+
+
+class ResponseCache:
+    """对话响应缓存 - 内存LRU按字节数淘汰并带TTL，可选 sqlite 磁盘层在重启后继续命中"""
+
+    def __init__(self, config=None):
+        """初始化缓存（配置了 disk_path 时打开磁盘层）"""
+        self.config = config or RESPONSE_CACHE_CONFIG
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._db = None
+        self._puts_since_prune = 0
+        self._stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "similar_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+
+        disk_path = self.config.get('disk_path')
+        if disk_path:
+            self._open_disk(disk_path)
+
+    @staticmethod
+    def make_key(kind, model, messages, params=None):
+        """
+        计算缓存键 - 对消息做规范化后与模型、采样参数一起哈希
+
+        Args:
+            kind (str): 响应形式，如 "stream"、"json"
+            model (str): 模型标识
+            messages (list): 对话消息
+            params (dict): 影响输出的采样参数
+
+        Returns:
+            str: sha256 十六进制摘要
+        """
+        normalized = [
+            {
+                "role": str(message.get("role", "")).strip().lower(),
+                "content": " ".join(str(message.get("content", "")).split())
+            }
+            for message in messages
+        ]
+        payload = json.dumps(
+            {"kind": kind, "model": model, "messages": normalized, "params": params or {}},
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, record=True):
+        """
+        读取缓存
+
+        Args:
+            key (str): 缓存键
+            record (bool): 是否计入命中统计；同一请求的后续查找传 False，避免一次未命中被重复计数
+
+        Returns:
+            缓存值的副本，未命中或已过期时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    if record:
+                        self._stats["hits"] += 1
+                        self._stats["memory_hits"] += 1
+                    return copy.deepcopy(value)
+                self._drop(key)
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    value = json.loads(row[0])
+                    # 提升到内存层
+                    self._insert(key, value, len(row[0].encode("utf-8")), row[1])
+                    if record:
+                        self._stats["hits"] += 1
+                        self._stats["disk_hits"] += 1
+                    return copy.deepcopy(value)
+
+            if record:
+                self._stats["misses"] += 1
+            return None
+
+    def put(self, key, value, ttl=None):
+        """
+        写入缓存
+
+        Args:
+            key (str): 缓存键
+            value: 可 JSON 序列化的响应数据
+            ttl (float): 过期时间（秒），默认使用配置
+        """
+        ttl = ttl if ttl is not None else self.config.get('ttl', 3600)
+        encoded = json.dumps(value, ensure_ascii=False)
+        size = len(encoded.encode("utf-8"))
+        if size > self.config.get('max_entry_bytes', 256 * 1024):
+            return
+
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._insert(key, json.loads(encoded), size, expires_at)
+            self._stats["stores"] += 1
+
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, size, expires_at, stored_at) VALUES (?, ?, ?, ?, ?)",
+                        (key, encoded, size, expires_at, time.time())
+                    )
+                    self._db.commit()
+                    self._puts_since_prune += 1
+                    if self._puts_since_prune >= self.config.get('disk_prune_every', 100):
+                        self._prune_disk()
+                except sqlite3.Error as e:
+                    logger.error("响应缓存写入磁盘失败: %s", e)
+
+    def record_similar_hit(self):
+        """精确查找未命中、近似匹配命中时，把这次查找改记为命中"""
+        with self._lock:
+            self._stats["misses"] -= 1
+            self._stats["hits"] += 1
+            self._stats["similar_hits"] += 1
+
+    def record_bypass(self):
+        """记录一次按请求跳过缓存"""
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def stats(self):
+        """获取缓存命中统计"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            stats = dict(
+                self._stats,
+                hit_rate=round(self._stats["hits"] / lookups, 4) if lookups else 0,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                disk_enabled=self._db is not None
+            )
+            if self._db is not None:
+                stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return stats
+
+    def _insert(self, key, value, size, expires_at):
+        """写入内存层并按字节数淘汰最久未访问的条目（需持有锁）"""
+        if key in self._memory:
+            self._drop(key)
+        self._memory[key] = (value, size, expires_at)
+        self._memory_bytes += size
+
+        max_bytes = self.config.get('max_memory_bytes', 32 * 1024 * 1024)
+        while self._memory_bytes > max_bytes and self._memory:
+            oldest = next(iter(self._memory))
+            self._drop(oldest)
+            self._stats["evictions"] += 1
+
+    def _drop(self, key):
+        """从内存层删除条目（需持有锁）"""
+        _, size, _ = self._memory.pop(key)
+        self._memory_bytes -= size
+
+    def _open_disk(self, path):
+        """打开 sqlite 磁盘层，失败时只使用内存层"""
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            logger.info("💾 对话响应缓存磁盘层: %s", path)
+        except sqlite3.Error as e:
+            logger.error("打开响应缓存磁盘层失败，仅使用内存缓存: %s", e)
+            self._db = None
+
+    def _prune_disk(self):
+        """清理磁盘层中过期的条目，超出容量时删除最早写入的（需持有锁）"""
+        self._puts_since_prune = 0
+        self._db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        excess = total - self.config.get('max_disk_bytes', 512 * 1024 * 1024)
+        if excess > 0:
+            rows = self._db.execute("SELECT key, size FROM responses ORDER BY stored_at").fetchall()
+            doomed = []
+            for key, size in rows:
+                if excess <= 0:
+                    break
+                doomed.append((key,))
+                excess -= size
+            self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+            self._stats["evictions"] += len(doomed)
+        self._db.commit()
@@ -0,0 +1,157 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from config import RESULT_STORE_CONFIG
+
+
+class ResultStore:
+    """生成结果去重存储 - 以生成参数的规范化哈希为键，相同请求复用已完成的结果或进行中的任务，超出条目数或字节预算时淘汰最久未使用的"""
+
+    def __init__(self, config=None):
+        """初始化"""
+        self.config = config or RESULT_STORE_CONFIG
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 内容键 -> 条目
+        self._task_keys = {}  # (任务类型, 任务ID) -> 内容键
+        self._total_bytes = 0  # 已保存结果的 JSON 字节数
+        self._stats = {
+            "completed_hits": 0,
+            "in_flight_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+
+    @staticmethod
+    def make_key(kind, params):
+        """
+        计算生成参数的内容键
+
+        Args:
+            kind (str): 任务类型，"image" 或 "video"
+            params (dict): 影响生成结果的全部参数
+
+        Returns:
+            str: sha256 十六进制摘要
+        """
+        canonical = {
+            name: " ".join(value.split()) if isinstance(value, str) else value
+            for name, value in params.items()
+        }
+        payload = json.dumps({"kind": kind, "params": canonical}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        """
+        查找可复用的任务
+
+        Returns:
+            dict: 条目副本（含 task_id、status、result），未找到或已过期时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry, time.time()):
+                self._remove(key)
+                self._stats["evictions"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            if entry["status"] == "completed":
+                self._stats["completed_hits"] += 1
+            else:
+                self._stats["in_flight_hits"] += 1
+            return copy.deepcopy(entry)
+
+    def attach(self, key, kind, task_id):
+        """记录新创建的任务，任务完成前相同请求复用该任务"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._task_keys.pop((old["kind"], old["task_id"]), None)
+            self._entries[key] = {
+                "kind": kind,
+                "task_id": task_id,
+                "status": "pending",
+                "result": None,
+                "created_at": now,
+                "completed_at": None,
+                "size": 0
+            }
+            self._task_keys[(kind, task_id)] = key
+            self._stats["stores"] += 1
+            self._evict()
+
+    def on_task_event(self, event):
+        """任务监视器回调：任务完成时保存结果，失败时删除条目以便重新生成"""
+        if not event["finished"]:
+            return
+        with self._lock:
+            key = self._task_keys.get((event["kind"], event["task_id"]))
+            if key is None:
+                return
+            entry = self._entries[key]
+            result = event["result"] or {}
+            if event["status"] == "completed" and result.get("success"):
+                entry["status"] = "completed"
+                entry["result"] = result
+                entry["completed_at"] = time.time()
+                entry["size"] = len(json.dumps(result, ensure_ascii=False, default=str).encode("utf-8"))
+                self._total_bytes += entry["size"]
+                self._evict()
+            else:
+                self._remove(key)
+
+    def stats(self):
+        """获取去重统计"""
+        with self._lock:
+            hits = self._stats["completed_hits"] + self._stats["in_flight_hits"]
+            lookups = hits + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_rate=round(hits / lookups, 4) if lookups else 0,
+                entries=len(self._entries),
+                total_bytes=self._total_bytes,
+                max_bytes=self.config.get('max_bytes')
+            )
+
+    def record_bypass(self):
+        """记录一次按请求跳过去重"""
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def _is_expired(self, entry, now):
+        """条目是否过期：已完成的结果按保存时间，进行中的任务按创建时间（长时间未完成视为失联）"""
+        if entry["status"] == "completed":
+            return now - entry["completed_at"] > self.config.get('max_age', 12 * 3600)
+        return now - entry["created_at"] > self.config.get('pending_ttl', 1800)
+
+    def _expire(self, now):
+        """清理所有过期条目（需持有锁）"""
+        for key, entry in list(self._entries.items()):
+            if self._is_expired(entry, now):
+                self._remove(key)
+                self._stats["evictions"] += 1
+
+    def _evict(self):
+        """超出条目数或字节预算时淘汰最久未使用的条目（需持有锁）"""
+        max_entries = self.config.get('max_entries', 5000)
+        max_bytes = self.config.get('max_bytes', 64 * 1024 * 1024)
+        while self._entries and (len(self._entries) > max_entries or self._total_bytes > max_bytes):
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        """删除条目（需持有锁）"""
+        entry = self._entries.pop(key)
+        self._task_keys.pop((entry["kind"], entry["task_id"]), None)
+        self._total_bytes -= entry["size"]
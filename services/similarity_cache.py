@@ -0,0 +1,232 @@
+import hashlib
+import random
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+from config import SIMILARITY_CACHE_CONFIG
+
+
+def normalize_prompt(text):
+    """规范化提示词：统一大小写和全半角，去掉空白与标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(
+        char for char in text
+        if not char.isspace() and not unicodedata.category(char).startswith("P")
+    )
+
+
+class MinHashLSH:
+    """MinHash + LSH 近似相似度索引 - 字符 n-gram 签名，按分段哈希分桶，容量满时淘汰最久未命中的条目"""
+
+    def __init__(self, num_perm=64, bands=8, ngram=3, max_entries=100000, seed=1):
+        """
+        Args:
+            num_perm (int): 签名长度（哈希函数个数）
+            bands (int): LSH 分段数，需整除 num_perm；分段越多召回越高
+            ngram (int): 字符 n-gram 长度
+            max_entries (int): 最大条目数
+            seed (int): 哈希函数随机种子，固定后签名可复现
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.max_entries = max_entries
+
+        # 每个"哈希函数"是对 n-gram 基础哈希异或一个随机掩码，最小值计算在 C 层完成
+        rng = random.Random(seed)
+        self._masks = [rng.getrandbits(32) for _ in range(num_perm)]
+        self._entries = OrderedDict()  # 条目ID -> (签名, 值)
+        self._buckets = {}  # 分段哈希 -> 条目ID 或 条目ID列表
+        self._next_id = 0
+
+    def signature(self, text):
+        """计算文本的 MinHash 签名"""
+        shingles = {
+            int.from_bytes(hashlib.blake2b(text[i:i + self.ngram].encode("utf-8"), digest_size=4).digest(), "little")
+            for i in range(max(len(text) - self.ngram + 1, 1))
+        }
+        return array("I", [min(map(mask.__xor__, shingles)) for mask in self._masks])
+
+    def add(self, signature, value):
+        """加入一个条目，超出容量时淘汰最久未命中的条目"""
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (signature, value)
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is None:
+                # 绝大多数分桶只有一个条目，直接存ID以节省内存
+                self._buckets[band_key] = entry_id
+            elif isinstance(bucket, list):
+                bucket.append(entry_id)
+            else:
+                self._buckets[band_key] = [bucket, entry_id]
+
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+
+    def query(self, signature, threshold):
+        """
+        查找最相似的条目
+
+        Returns:
+            tuple: (相似度估计, 值)，没有达到阈值的条目时返回 None
+        """
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is None:
+                continue
+            if isinstance(bucket, list):
+                candidates.update(bucket)
+            else:
+                candidates.add(bucket)
+
+        best = None
+        for entry_id in candidates:
+            stored, value = self._entries[entry_id]
+            similarity = sum(1 for x, y in zip(stored, signature) if x == y) / self.num_perm
+            if similarity >= threshold and (best is None or similarity > best[0]):
+                best = (similarity, value, entry_id)
+
+        if best is None:
+            return None
+        self._entries.move_to_end(best[2])
+        return best[0], best[1]
+
+    def remove(self, signature, value):
+        """
+        删除签名完全相同且值相等的条目
+
+        Returns:
+            bool: 是否找到并删除
+        """
+        # 签名完全相同的条目必然落在第一个分段的同一分桶中
+        bucket = self._buckets.get(self._band_keys(signature)[0])
+        if bucket is None:
+            return False
+        for entry_id in list(bucket) if isinstance(bucket, list) else [bucket]:
+            stored, stored_value = self._entries[entry_id]
+            if stored_value == value and stored == signature:
+                self._evict(entry_id)
+                return True
+        return False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _band_keys(self, signature):
+        """各分段的分桶键（包含分段序号，不同分段互不冲突）"""
+        return [
+            hash((band, signature[band * self.rows:(band + 1) * self.rows].tobytes()))
+            for band in range(self.bands)
+        ]
+
+    def _evict(self, entry_id):
+        """删除条目并从分桶中移除"""
+        signature, _ = self._entries.pop(entry_id)
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if isinstance(bucket, list):
+                if entry_id in bucket:
+                    bucket.remove(entry_id)
+                if len(bucket) == 1:
+                    self._buckets[band_key] = bucket[0]
+            elif bucket == entry_id:
+                del self._buckets[band_key]
+
+
+class SimilarityCache:
+    """
+    近似提示词缓存 - 每个模型和响应类型独立索引单轮提示词，相似度超过阈值时返回原提示词
+
+    流式和非流式回答分别缓存，按 (模型, 响应类型) 分开索引，命中的提示词一定有同类型的缓存回答。
+    """
+
+    def __init__(self, config=None):
+        """初始化（索引在模型首次使用时创建）"""
+        self.config = config or SIMILARITY_CACHE_CONFIG
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "indexed": 0,
+            "discarded": 0
+        }
+
+    def add(self, model, kind, prompt):
+        """索引一条已缓存回答的提示词"""
+        normalized = normalize_prompt(prompt)
+        if not normalized or len(prompt) > self.config.get('max_prompt_chars', 500):
+            return
+
+        index = self._index_for(model, kind)
+        signature = index.signature(normalized)
+        with self._lock:
+            existing = index.query(signature, 1.0)
+            if existing is not None and existing[1] == prompt:
+                return
+            index.add(signature, prompt)
+            self._stats["indexed"] += 1
+
+    def lookup(self, model, kind, prompt):
+        """
+        查找与 prompt 足够相似、且有同类型缓存回答的已索引提示词
+
+        Returns:
+            str: 相似的原提示词，未找到时返回 None
+        """
+        normalized = normalize_prompt(prompt)
+        if not normalized or len(prompt) > self.config.get('max_prompt_chars', 500):
+            return None
+
+        index = self._index_for(model, kind)
+        signature = index.signature(normalized)
+        with self._lock:
+            self._stats["lookups"] += 1
+            match = index.query(signature, self.config.get('threshold', 0.85))
+            if match is None:
+                return None
+            self._stats["hits"] += 1
+        return match[1]
+
+    def discard(self, model, kind, prompt):
+        """从索引中删除提示词（对应的缓存回答已过期或被淘汰时调用）"""
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            return
+        index = self._index_for(model, kind)
+        signature = index.signature(normalized)
+        with self._lock:
+            if index.remove(signature, prompt):
+                self._stats["discarded"] += 1
+
+    def stats(self):
+        """获取查找统计"""
+        with self._lock:
+            lookups = self._stats["lookups"]
+            return dict(
+                self._stats,
+                hit_rate=round(self._stats["hits"] / lookups, 4) if lookups else 0,
+                entries={name: len(index) for name, index in self._indexes.items()}
+            )
+
+    def _index_for(self, model, kind):
+        """获取模型和响应类型对应的索引"""
+        name = f"{model}:{kind}"
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is None:
+                index = self._indexes[name] = MinHashLSH(
+                    num_perm=self.config.get('num_perm', 64),
+                    bands=self.config.get('bands', 8),
+                    ngram=self.config.get('ngram', 3),
+                    max_entries=self.config.get('max_entries_per_model', 100000)
+                )
+            return index
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+
+# 可以合并的增量事件类型
+MERGEABLE_TYPES = ("thinking", "content")
+
+# AsyncChunkReader.read 的返回标记
+READ_TIMEOUT = object()
+READ_END = object()
+
+
+class SSECoalescer:
+    """
+    SSE 帧合并 - 把连续的同类增量事件（thinking/content）合并为一帧
+
+    缓冲从第一个增量开始计时，超过时间窗口或累计字节数达到上限时刷新；
+    其他类型的事件到达时先刷新缓冲再原样发出，事件类型和顺序保持不变。
+    """
+
+    def __init__(self, window_ms=0, max_bytes=4096):
+        """
+        Args:
+            window_ms (int): 合并时间窗口（毫秒），为0时不合并
+            max_bytes (int): 缓冲的增量内容达到该字节数时立即刷新
+        """
+        self.window = window_ms / 1000
+        self.max_bytes = max_bytes
+        self.enabled = window_ms > 0
+        self.events_in = 0
+        self.frames_out = 0
+        self._buffer = None
+        self._buffer_bytes = 0
+        self._started_at = 0
+
+    def push(self, events):
+        """
+        加入一批事件
+
+        Returns:
+            list: 现在需要发送的事件
+        """
+        self.events_in += len(events)
+        if not self.enabled:
+            self.frames_out += len(events)
+            return events
+
+        output = []
+        for event in events:
+            if event.get("type") not in MERGEABLE_TYPES:
+                output.extend(self.flush())
+                output.append(event)
+                self.frames_out += 1
+                continue
+
+            if self._buffer is not None and (
+                    self._buffer["type"] != event["type"] or self._buffer.get("model") != event.get("model")):
+                output.extend(self.flush())
+
+            content = event.get("content", "")
+            if self._buffer is None:
+                self._buffer = dict(event)
+                self._started_at = time.monotonic()
+            else:
+                self._buffer["content"] += content
+                if "total_length" in event:
+                    self._buffer["total_length"] = event["total_length"]
+            self._buffer_bytes += len(content.encode("utf-8"))
+
+            if self._buffer_bytes >= self.max_bytes or time.monotonic() - self._started_at >= self.window:
+                output.extend(self.flush())
+        return output
+
+    def flush(self):
+        """
+        取出缓冲中的合并事件
+
+        Returns:
+            list: 合并后的事件，缓冲为空时返回空列表
+        """
+        if self._buffer is None:
+            return []
+        event = self._buffer
+        self._buffer = None
+        self._buffer_bytes = 0
+        self.frames_out += 1
+        return [event]
+
+    def time_until_flush(self):
+        """
+        距离缓冲到期还有多久（秒），供异步流在上游没有新增量时按时刷新
+
+        Returns:
+            float: 剩余秒数，缓冲为空时返回 None
+        """
+        if self._buffer is None:
+            return None
+        return max(0.0, self._started_at + self.window - time.monotonic())
+
+
+class CoalescingStats:
+    """SSE 帧合并统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "streams": 0,
+            "coalesced_streams": 0,
+            "events": 0,
+            "frames": 0
+        }
+
+    def record(self, coalescer):
+        """流结束时记录合并前后的帧数"""
+        with self._lock:
+            self._stats["streams"] += 1
+            if coalescer.enabled:
+                self._stats["coalesced_streams"] += 1
+            self._stats["events"] += coalescer.events_in
+            self._stats["frames"] += coalescer.frames_out
+
+    def stats(self):
+        """获取合并统计"""
+        with self._lock:
+            events = self._stats["events"]
+            return dict(
+                self._stats,
+                frame_ratio=round(self._stats["frames"] / events, 4) if events else 1
+            )
+
+
+class AsyncChunkReader:
+    """带超时读取异步迭代器 - 超时不会取消正在进行的读取，下次调用继续等待同一次读取"""
+
+    def __init__(self, iterable):
+        self._iterator = iterable.__aiter__()
+        self._pending = None
+
+    async def read(self, timeout=None):
+        """
+        读取下一项
+
+        Args:
+            timeout (float): 超时时间（秒），为 None 时一直等待
+
+        Returns:
+            下一项；超时返回 READ_TIMEOUT，迭代结束返回 READ_END
+        """
+        if self._pending is None and timeout is None:
+            # 不需要超时时直接等待，避免为每个数据块创建任务
+            try:
+                return await self._iterator.__anext__()
+            except StopAsyncIteration:
+                return READ_END
+
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._iterator.__anext__())
+        done, _ = await asyncio.wait({self._pending}, timeout=timeout)
+        if not done:
+            return READ_TIMEOUT
+
+        task = self._pending
+        self._pending = None
+        try:
+            return task.result()
+        except StopAsyncIteration:
+            return READ_END
+
+    async def close(self):
+        """取消未完成的读取（关闭上游流之前调用）"""
+        if self._pending is not None:
+            self._pending.cancel()
+            await asyncio.gather(self._pending, return_exceptions=True)
+            self._pending = None
@@ -0,0 +1,442 @@
+import asyncio
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import TASK_WATCHER_CONFIG
+from apis.log import get_logger
+from apis.retry import RetryPolicy, backoff_delay
+
+logger = get_logger("task_watcher")
+
+# 任务进入这些状态后不再轮询
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class TaskWatcher:
+    """后台任务监视器 - 每个进行中的任务只轮询一次上游，状态变化推送给所有订阅者"""
+
+    def __init__(self, config=None, scheduler=None):
+        """
+        初始化任务监视器（后台线程在首次跟踪任务时启动）
+
+        Args:
+            config (dict): 监视器配置，默认使用 TASK_WATCHER_CONFIG
+            scheduler (PollScheduler): 自适应轮询计划，可选；未提供时按固定间隔轮询
+        """
+        self.config = config or TASK_WATCHER_CONFIG
+        self.scheduler = scheduler
+        self._kinds = {}
+        self._tasks = {}
+        self._subscribers = {}
+        self._next_subscriber_id = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._stats = {
+            "polls": 0,
+            "poll_errors": 0,
+            "durations_recorded": 0,
+            "events_published": 0
+        }
+
+    def register(self, kind, fetcher, poll_interval):
+        """
+        注册任务类型
+
+        Args:
+            kind (str): 任务类型，如 "image"、"video"
+            fetcher (callable): 查询函数 fetcher(task_id) -> 状态字典
+            poll_interval (float): 固定轮询间隔（秒），未启用自适应计划或任务开始时间未知时使用
+        """
+        self._kinds[kind] = {
+            "fetcher": fetcher,
+            "poll_interval": poll_interval,
+            # 查询失败后以轮询间隔为基数退避，上游故障时不会比正常轮询更频繁
+            "retry_policy": RetryPolicy(base_delay=poll_interval, max_delay=self.config.get('error_backoff_max', 60))
+        }
+
+    def track(self, kind, task_id, params=None, result=None, started_at=None):
+        """
+        开始跟踪任务（重复调用是安全的）
+
+        Args:
+            kind (str): 任务类型
+            task_id (str): 任务ID
+            params (dict): 任务参数，可选
+            result (dict): 已知的最新状态，可选
+            started_at (float): 任务创建时间，可选；提供时按自适应计划轮询并记录完成耗时
+
+        Returns:
+            dict: 任务的最新状态，尚未查询时为 None
+        """
+        if kind not in self._kinds:
+            raise ValueError(f"未注册的任务类型: {kind}")
+
+        key = (kind, task_id)
+        now = time.time()
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                task = self._tasks[key] = {
+                    "kind": kind,
+                    "task_id": task_id,
+                    "params": params or {},
+                    "created_at": started_at or now,
+                    "started_known": started_at is not None,
+                    "result": None,
+                    "status": None,
+                    "last_polled": None,
+                    "next_poll": now,
+                    "finished_at": None,
+                    "errors": 0,
+                    "errors_since": None,  # 本轮连续查询失败的开始时间
+                    "unknowns": 0  # 连续返回未知状态的次数
+                }
+                if started_at is not None:
+                    # 刚创建的任务不会立即完成，第一次查询也按计划推迟
+                    task["next_poll"] = now + self._poll_delay(task, now)
+            else:
+                if _is_abandoned(task):
+                    # 因查询失败或状态未知而停止跟踪的任务再次被请求时重新查询上游，不返回过时的错误
+                    task.update(result=None, status=None, finished_at=None, next_poll=now,
+                                errors=0, errors_since=None, unknowns=0)
+                if params and not task["params"]:
+                    task["params"] = params
+        if result is not None:
+            self._apply_result(task, result)
+
+        self._ensure_started()
+        self._wakeup.set()
+        return self.get(kind, task_id)
+
+    def get(self, kind, task_id):
+        """获取任务的最新状态副本，未跟踪或尚未查询时返回 None"""
+        with self._lock:
+            task = self._tasks.get((kind, task_id))
+            if task is None or task["result"] is None or _is_abandoned(task):
+                return None
+            return copy.deepcopy(task["result"])
+
+    def get_task(self, kind, task_id):
+        """获取任务的跟踪信息（不含状态结果）"""
+        with self._lock:
+            task = self._tasks.get((kind, task_id))
+            if task is None:
+                return None
+            return {k: v for k, v in task.items() if k != "result"}
+
+    def next_poll_in(self, kind, task_id):
+        """
+        距离该任务下一次上游查询的秒数，供客户端对齐轮询节奏
+
+        Returns:
+            float: 秒数，任务未跟踪或已结束时返回 None
+        """
+        with self._lock:
+            task = self._tasks.get((kind, task_id))
+            if task is None or task["finished_at"] is not None:
+                return None
+            now = time.time()
+            if task["next_poll"] == float("inf"):
+                # 正在查询中，按下一次的计划间隔估算
+                return self._poll_delay(task, now)
+            return max(task["next_poll"] - now, 0)
+
+    def is_finished(self, kind, task_id):
+        """任务是否已进入终态"""
+        with self._lock:
+            task = self._tasks.get((kind, task_id))
+            return task is not None and task["finished_at"] is not None
+
+    def wait(self, kind, task_id, timeout):
+        """
+        等待任务进入终态 - 由监视器推送唤醒，调用方不轮询上游
+
+        Returns:
+            dict: 任务最终状态，超时返回 None
+        """
+        done = threading.Event()
+        holder = {}
+
+        def on_event(event):
+            if event["finished"]:
+                holder["result"] = event["result"]
+                done.set()
+
+        subscriber_id = self.subscribe(on_event, [(kind, task_id)])
+        try:
+            self.track(kind, task_id)
+            result = self._finished_result(kind, task_id)
+            if result is not None:
+                return result
+            done.wait(timeout)
+            return holder.get("result")
+        finally:
+            self.unsubscribe(subscriber_id)
+
+    async def async_wait(self, kind, task_id, timeout):
+        """
+        等待任务进入终态（异步版本）- 在事件循环上挂起，不占用线程
+
+        Returns:
+            dict: 任务最终状态，超时返回 None
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result):
+            if not future.done():
+                future.set_result(result)
+
+        def on_event(event):
+            if event["finished"]:
+                loop.call_soon_threadsafe(resolve, event["result"])
+
+        subscriber_id = self.subscribe(on_event, [(kind, task_id)])
+        try:
+            self.track(kind, task_id)
+            result = self._finished_result(kind, task_id)
+            if result is not None:
+                return result
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.unsubscribe(subscriber_id)
+
+    def subscribe(self, callback, task_keys=None):
+        """
+        订阅任务状态变化
+
+        Args:
+            callback (callable): 回调 callback(event)，在监视器线程中调用，必须快速返回
+            task_keys (iterable): 关注的 (kind, task_id) 集合，None 表示全部任务
+
+        Returns:
+            int: 订阅ID，用于 unsubscribe
+        """
+        with self._lock:
+            subscriber_id = self._next_subscriber_id
+            self._next_subscriber_id += 1
+            self._subscribers[subscriber_id] = (callback, set(task_keys) if task_keys is not None else None)
+        return subscriber_id
+
+    def unsubscribe(self, subscriber_id):
+        """取消订阅"""
+        with self._lock:
+            self._subscribers.pop(subscriber_id, None)
+
+    def stats(self):
+        """获取监视器统计信息"""
+        with self._lock:
+            active = sum(1 for task in self._tasks.values() if task["finished_at"] is None)
+            return dict(
+                self._stats,
+                tracked_tasks=len(self._tasks),
+                active_tasks=active,
+                subscribers=len(self._subscribers)
+            )
+
+    def _finished_result(self, kind, task_id):
+        """已结束任务的最终状态副本，未结束时返回 None"""
+        with self._lock:
+            task = self._tasks.get((kind, task_id))
+            if task is None or task["finished_at"] is None:
+                return None
+            return copy.deepcopy(task["result"])
+
+    def _ensure_started(self):
+        """按需启动后台轮询线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config.get('max_workers', 8),
+                    thread_name_prefix="task-watcher"
+                )
+            self._thread = threading.Thread(target=self._run, name="task-watcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """后台轮询循环"""
+        while True:
+            # 先清除唤醒标记，轮询期间新加入的任务会再次唤醒循环
+            self._wakeup.clear()
+            try:
+                self._tick()
+            except Exception as e:
+                logger.error("任务监视器轮询异常: %s", e)
+
+            self._wakeup.wait(timeout=self._seconds_until_next_poll())
+
+    def _tick(self):
+        """轮询所有到期的任务，分批并发查询上游"""
+        now = time.time()
+        self._expire(now)
+
+        with self._lock:
+            due = [
+                task for task in self._tasks.values()
+                if task["finished_at"] is None and task["next_poll"] <= now
+            ]
+            # 先到期的任务先查询，并避免下一轮重复提交
+            due.sort(key=lambda task: task["next_poll"])
+            for task in due:
+                task["next_poll"] = float("inf")
+
+        batch_size = self.config.get('batch_size', 16)
+        for start in range(0, len(due), batch_size):
+            batch = due[start:start + batch_size]
+            list(self._executor.map(self._poll, batch))
+
+    def _poll(self, task):
+        """查询单个任务的上游状态"""
+        kind_info = self._kinds[task["kind"]]
+        try:
+            result = kind_info["fetcher"](task["task_id"])
+        except Exception as e:
+            result = {
+                "success": False,
+                "error": f"查询任务状态时发生异常: {str(e)}",
+                "status": "error"
+            }
+
+        with self._lock:
+            self._stats["polls"] += 1
+        self._apply_result(task, result)
+
+    def _apply_result(self, task, result):
+        """更新任务状态，状态变化时通知订阅者"""
+        now = time.time()
+        kind_info = self._kinds[task["kind"]]
+        status = result.get("status")
+        completed_in = None
+
+        with self._lock:
+            previous_poll = task["last_polled"]
+            task["last_polled"] = now
+            if status == "error":
+                # 查询失败：保留上一次的有效状态，连续失败超过 max_error_duration 时停止跟踪
+                task["errors"] += 1
+                if task["errors_since"] is None:
+                    task["errors_since"] = now
+                self._stats["poll_errors"] += 1
+                if now - task["errors_since"] >= self.config.get('max_error_duration', 60):
+                    task["finished_at"] = now
+                    changed = True
+                else:
+                    # 按抖动指数退避（遵守上游的 Retry-After）安排下一次查询，不占用轮询线程等待；
+                    # 不短于正常轮询间隔，全局重试速率达到上限时按正常间隔查询
+                    delay = backoff_delay(
+                        task["errors"] - 1, result.get("retry_after"), kind_info["retry_policy"],
+                        name=f"task_watcher.{task['kind']}"
+                    )
+                    task["next_poll"] = now + max(delay or 0, kind_info["poll_interval"])
+                    return
+            else:
+                task["errors"] = 0
+                task["errors_since"] = None
+                task["unknowns"] = task["unknowns"] + 1 if status == "unknown" else 0
+                changed = status != task["status"] or _progress_of(result) != _progress_of(task["result"])
+                if task["unknowns"] >= self.config.get('max_unknown_polls', 3):
+                    # 上游连续返回无法识别的状态，不再轮询到最长跟踪时间
+                    task["finished_at"] = now
+                    changed = True
+                elif status in TERMINAL_STATUSES:
+                    task["finished_at"] = now
+                    if status == "completed" and task["started_known"] and task["status"] != status:
+                        completed_in = _completion_duration(task, result, previous_poll, now)
+                        self._stats["durations_recorded"] += 1
+                else:
+                    task["next_poll"] = now + self._poll_delay(task, now)
+
+            task["status"] = status
+            task["result"] = result
+            if not changed:
+                return
+
+            self._stats["events_published"] += 1
+            key = (task["kind"], task["task_id"])
+            listeners = [
+                callback for callback, keys in self._subscribers.values()
+                if keys is None or key in keys
+            ]
+            event = {
+                "kind": task["kind"],
+                "task_id": task["task_id"],
+                "status": status,
+                "finished": task["finished_at"] is not None,
+                "result": copy.deepcopy(result)
+            }
+
+        if completed_in is not None and self.scheduler is not None:
+            self.scheduler.record_completion(task["kind"], task["params"], completed_in)
+
+        for callback in listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error("任务事件回调异常: %s", e)
+
+    def _poll_delay(self, task, now):
+        """计算任务下一次查询前的等待时间（需持有锁或任务尚未公开）"""
+        kind = task["kind"]
+        if self.scheduler is None or not task["started_known"]:
+            # 不知道任务何时创建，无法判断处于哪个阶段，按固定间隔轮询
+            return self._kinds[kind]["poll_interval"]
+        return self.scheduler.next_delay(kind, task["params"], now - task["created_at"])
+
+    def _expire(self, now):
+        """清理已结束或过旧的任务（非正常结束的任务只短暂保留）"""
+        retention = self.config.get('finished_retention', 600)
+        abandoned_retention = self.config.get('abandoned_retention', 30)
+        max_age = self.config.get('max_task_age', 1800)
+        with self._lock:
+            for key, task in list(self._tasks.items()):
+                if task["finished_at"] is not None:
+                    if now - task["finished_at"] > (abandoned_retention if _is_abandoned(task) else retention):
+                        del self._tasks[key]
+                elif now - task["created_at"] > max_age:
+                    # 超过最长跟踪时间仍未结束，视为失联任务
+                    task["finished_at"] = now
+
+    def _seconds_until_next_poll(self):
+        """计算距离下一个任务到期的时间"""
+        tick = self.config.get('tick_interval', 1)
+        with self._lock:
+            pending = [task["next_poll"] for task in self._tasks.values() if task["finished_at"] is None]
+        if not pending:
+            return tick * 10
+        return min(max(min(pending) - time.time(), 0.05), tick * 10)
+
+
+def _completion_duration(task, result, previous_poll, now):
+    """
+    任务完成耗时：优先使用上游记录的耗时；否则任务在上一次和本次查询之间的某一时刻完成，
+    取两次查询的中点，避免按发现完成的时间记录而多算最多一个轮询间隔
+    """
+    upstream_duration = result.get("upstream_duration")
+    if upstream_duration is not None:
+        return upstream_duration
+    if previous_poll is None:
+        return now - task["created_at"]
+    completed_at = (max(previous_poll, task["created_at"]) + now) / 2
+    return completed_at - task["created_at"]
+
+
+def _is_abandoned(task):
+    """任务是否因查询失败、状态未知或超过最长跟踪时间而停止跟踪（不是上游给出的终态）"""
+    return task["finished_at"] is not None and task["status"] not in TERMINAL_STATUSES
+
+
+def _progress_of(result):
+    """提取结果中的进度百分比，用于判断是否需要推送"""
+    if not result:
+        return None
+    return (result.get("progress") or {}).get("percentage")
@@ -0,0 +1,302 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.http import http_date, parse_if_range_header, parse_range_header, quote_etag
+
+from config import VIDEO_CACHE_CONFIG
+from apis.http_client import get_transport
+from apis.log import get_logger
+
+logger = get_logger("video_cache")
+
+_TASK_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+
+class VideoCache:
+    """本地视频缓存 - 后台断点续传下载上游视频，所有观看者共享同一份文件，超出磁盘预算时淘汰最久未访问的"""
+
+    def __init__(self, config=None):
+        """初始化缓存目录并扫描已下载的视频"""
+        self.config = config or VIDEO_CACHE_CONFIG
+        self.root = self.config['root']
+        self._lock = threading.Lock()
+        self._videos = {}  # 任务ID -> {"path", "size", "last_access"}
+        self._total_bytes = 0
+        self._pending = set()
+        self._executor = None
+        self._stats = {
+            "downloads": 0,
+            "resumed": 0,
+            "download_errors": 0,
+            "evictions": 0,
+            "served": 0,
+            "redirected": 0
+        }
+
+        os.makedirs(self.root, exist_ok=True)
+        self._scan()
+
+    def is_valid_task_id(self, task_id):
+        """任务ID是否可以安全地用作文件名"""
+        return bool(_TASK_ID_PATTERN.match(task_id))
+
+    def fetch_async(self, task_id, url):
+        """在后台下载视频（同一任务只下载一次，已缓存时跳过）"""
+        if not url or not self.is_valid_task_id(task_id):
+            return
+        with self._lock:
+            if task_id in self._videos or task_id in self._pending:
+                return
+            self._pending.add(task_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.config.get('download_workers', 2),
+                    thread_name_prefix="video-download"
+                )
+        self._executor.submit(self._download, task_id, url)
+
+    def open_video(self, task_id):
+        """
+        获取已缓存视频的文件信息，同时更新访问时间
+
+        Returns:
+            dict: path、size、etag、last_modified，未缓存时返回 None
+        """
+        if not self.is_valid_task_id(task_id):
+            return None
+        with self._lock:
+            entry = self._videos.get(task_id)
+            if entry is None:
+                return None
+            entry["last_access"] = time.time()
+            self._stats["served"] += 1
+            return {
+                "path": entry["path"],
+                "size": entry["size"],
+                # 下载完成后文件内容不再变化，任务ID加大小即可作为强ETag
+                "etag": f"{task_id}-{entry['size']:x}",
+                "last_modified": entry["mtime"]
+            }
+
+    def record_redirect(self):
+        """记录一次未缓存时重定向到上游"""
+        with self._lock:
+            self._stats["redirected"] += 1
+
+    def stats(self):
+        """获取缓存统计"""
+        with self._lock:
+            return dict(
+                self._stats,
+                videos=len(self._videos),
+                total_bytes=self._total_bytes,
+                max_bytes=self.config.get('max_bytes'),
+                pending_downloads=len(self._pending)
+            )
+
+    def _download(self, task_id, url):
+        """下载视频到 .part 文件，中断后按已下载的长度续传，完成后原子改名"""
+        path = os.path.join(self.root, task_id + ".mp4")
+        part_path = path + ".part"
+        try:
+            for attempt in range(self.config.get('max_attempts', 5)):
+                try:
+                    if self._download_part(url, part_path):
+                        break
+                except Exception as e:
+                    logger.warning("视频下载中断 %s（第%s次）: %s", task_id, attempt + 1, e)
+                    time.sleep(min(2 ** attempt, 30))
+            else:
+                raise IOError("多次续传后仍未完成")
+
+            os.replace(part_path, path)
+            stat = os.stat(path)
+            with self._lock:
+                self._videos[task_id] = {
+                    "path": path,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "last_access": time.time()
+                }
+                self._total_bytes += stat.st_size
+                self._stats["downloads"] += 1
+                self._evict()
+            logger.info("📥 已缓存视频 %s (%s 字节)", task_id, stat.st_size)
+
+        except Exception as e:
+            with self._lock:
+                self._stats["download_errors"] += 1
+            logger.error("缓存视频失败 %s: %s", task_id, e)
+        finally:
+            with self._lock:
+                self._pending.discard(task_id)
+
+    def _download_part(self, url, part_path):
+        """
+        从 .part 文件末尾继续下载
+
+        Returns:
+            bool: 是否已下载完整
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        response = get_transport().get(url, headers=headers, stream=True,
+                                       timeout=self.config.get('download_timeout', 120))
+        try:
+            if response.status_code == 416 and offset:
+                # 已下载到文件末尾
+                return True
+            if response.status_code == 206 and offset:
+                mode = "ab"
+                with self._lock:
+                    self._stats["resumed"] += 1
+            elif response.status_code == 200:
+                # 上游不支持 Range 时从头下载
+                mode = "wb"
+                offset = 0
+            else:
+                raise IOError(f"HTTP {response.status_code}")
+
+            expected = response.headers.get("Content-Length")
+            received = 0
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+                    received += len(chunk)
+            return expected is None or received >= int(expected)
+        finally:
+            response.close()
+
+    def _evict(self):
+        """超出磁盘预算时删除最久未访问的视频（需持有锁）"""
+        max_bytes = self.config.get('max_bytes', 10 * 1024 * 1024 * 1024)
+        if self._total_bytes <= max_bytes:
+            return
+        for task_id, entry in sorted(self._videos.items(), key=lambda item: item[1]["last_access"]):
+            if self._total_bytes <= max_bytes:
+                break
+            # 已打开的文件在删除后仍可继续读取，不影响正在观看的用户
+            try:
+                os.remove(entry["path"])
+            except OSError:
+                pass
+            del self._videos[task_id]
+            self._total_bytes -= entry["size"]
+            self._stats["evictions"] += 1
+
+    def _scan(self):
+        """启动时扫描已下载的视频（.part 文件保留用于续传）"""
+        for name in os.listdir(self.root):
+            task_id, extension = os.path.splitext(name)
+            if extension != ".mp4" or not self.is_valid_task_id(task_id):
+                continue
+            path = os.path.join(self.root, name)
+            stat = os.stat(path)
+            self._videos[task_id] = {
+                "path": path,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "last_access": stat.st_mtime
+            }
+            self._total_bytes += stat.st_size
+
+
+class FileRange:
+    """
+    文件的一个字节区间，按文件对象的接口读取
+
+    交给 wsgi.file_wrapper 时，支持 sendfile 的服务器（如 gunicorn）从文件当前偏移起
+    按 Content-Length 调用 os.sendfile 发送任意区间；其余服务器逐块调用 read，读到区间末尾为止。
+    """
+
+    def __init__(self, path, start, length):
+        """打开文件并定位到区间起点"""
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = length
+
+    def fileno(self):
+        """底层文件描述符（当前偏移即区间起点）"""
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        """读取不超过区间剩余长度的数据"""
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        if size <= 0:
+            return b""
+        chunk = self._file.read(size)
+        self._remaining -= len(chunk)
+        return chunk
+
+    def __iter__(self):
+        """按 1MB 分块迭代区间内容"""
+        while True:
+            chunk = self.read(1024 * 1024)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        """关闭文件"""
+        self._file.close()
+
+
+def plan_video_response(video, range_header=None, if_range_header=None, if_none_match=None, max_age=86400):
+    """
+    根据请求头确定视频响应的状态码、字节区间和响应头（WSGI 与 ASGI 入口共用）
+
+    Args:
+        video (dict): open_video 返回的文件信息
+        range_header (str): Range 请求头
+        if_range_header (str): If-Range 请求头
+        if_none_match (str): If-None-Match 请求头
+        max_age (int): 浏览器缓存时间（秒）
+
+    Returns:
+        tuple: (状态码, 起始偏移, 长度, 响应头dict)
+    """
+    size = video["size"]
+    etag = quote_etag(video["etag"])
+    headers = {
+        "Content-Type": "video/mp4",
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": http_date(video["last_modified"]),
+        "Cache-Control": f"public, max-age={max_age}"
+    }
+
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return 304, 0, 0, headers
+
+    byte_range = parse_range_header(range_header) if range_header else None
+    if byte_range is not None and _if_range_matches(if_range_header, video):
+        # 多区间请求较少见，按完整内容返回
+        if len(byte_range.ranges) == 1:
+            span = byte_range.range_for_length(size)
+            if span is None:
+                headers["Content-Range"] = f"bytes */{size}"
+                headers["Content-Length"] = "0"
+                return 416, 0, 0, headers
+            start, stop = span
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+            headers["Content-Length"] = str(stop - start)
+            return 206, start, stop - start, headers
+
+    headers["Content-Length"] = str(size)
+    return 200, 0, size, headers
+
+
+def _if_range_matches(if_range_header, video):
+    """If-Range 条件是否成立（未提供时视为成立）"""
+    if not if_range_header:
+        return True
+    if_range = parse_if_range_header(if_range_header)
+    if if_range.etag is not None:
+        return if_range.etag == video["etag"]
+    if if_range.date is not None:
+        return int(if_range.date.timestamp()) == int(video["last_modified"])
+    return False
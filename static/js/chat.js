@@ -3,6 +3,7 @@
 // 全局变量
 let currentModel = 'qwen_normal';
 let conversationHistory = [];
+let sessionId = null;  // 服务端会话ID，历史由服务端保存，每次只发送新消息
 let isTyping = false;
 
 // 页面加载完成后初始化
@@ -258,6 +259,10 @@ function closeSettings() {
 function clearChat() {
     const chatMessages = document.getElementById('chatMessages');
     conversationHistory = [];
+    if (sessionId) {
+        fetch(`/chat/sessions/${sessionId}`, { method: 'DELETE' }).catch(() => {});
+        sessionId = null;
+    }
     
     // 保留欢迎消息
     chatMessages.innerHTML = `
@@ -411,26 +416,56 @@ function hideTypingIndicator() {
     isTyping = false;
 }
 
+// 发送对话请求
+function postChat(endpoint, request) {
+    return fetch(endpoint, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(request)
+    });
+}
+
+// 把本地历史（不含刚发送的消息）整理为服务端的 history 格式
+function buildHistoryPairs() {
+    const pairs = [];
+    // 最后一条是刚发送的用户消息，由 message 字段单独发送
+    conversationHistory.slice(0, -1).forEach(item => {
+        if (item.role === 'user') {
+            pairs.push({ user: item.content });
+        } else if (item.role === 'assistant' && pairs.length && !pairs[pairs.length - 1].assistant) {
+            pairs[pairs.length - 1].assistant = item.content;
+        }
+    });
+    return pairs;
+}
+
 // 发送流式消息（深度思考模式）
 async function sendStreamMessage(message, endpoint) {
     try {
-        const response = await fetch(endpoint, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                model: currentModel,
-                message: message,
-                history: conversationHistory,
-                stream: true
-            })
-        });
+        const request = {
+            model: currentModel,
+            message: message,
+            session_id: sessionId || undefined,
+            stream: true,
+            coalesce_ms: 30  // 服务端把30毫秒内的增量合并为一帧发送
+        };
+        let response = await postChat(endpoint, request);
+        
+        if (response.status === 410 && sessionId) {
+            // 服务端会话已过期：带上本地保存的历史重新发送，服务端据此恢复会话
+            request.history = buildHistoryPairs();
+            response = await postChat(endpoint, request);
+        }
         
         if (!response.ok) {
             throw new Error(`HTTP ${response.status}: ${response.statusText}`);
         }
         
+        // 首次对话由服务端分配会话ID
+        sessionId = response.headers.get('X-Session-Id') || sessionId;
+        
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
         let buffer = '';
@@ -356,8 +356,8 @@ async function generateImage() {
         
         if (data.task_id && !data.error) {
             updateImageProgress(10, '任务创建成功，开始生成...', '请稍候...');
-            // 轮询检查任务状态
-            checkImageProgress(data.task_id);
+            // 订阅任务状态推送
+            watchImageProgress(data.task_id);
         } else {
             throw new Error(data.error || '创建图像任务失败');
         }
@@ -371,13 +371,50 @@ async function generateImage() {
     }
 }
 
-// 检查图像生成进度
-async function checkImageProgress(taskId) {
-    const loading = document.getElementById('imageLoading');
-    const result = document.getElementById('imageResult');
-    const image = document.getElementById('generatedImage');
-    const progressContainer = document.getElementById('imageProgressContainer');
+// 订阅服务端任务推送（SSE），浏览器不支持或连接失败时回退为轮询
+function watchTask(kind, taskId, onData, fallback) {
+    if (!window.EventSource) {
+        fallback();
+        return;
+    }
+    
+    const source = new EventSource(`/tasks/events?${kind}=${encodeURIComponent(taskId)}`);
+    let finished = false;
     
+    source.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.task_id !== taskId) return;
+        
+        // 回调返回 false 表示任务已结束
+        if (onData(data) === false) {
+            finished = true;
+            source.close();
+        }
+    };
+    
+    source.onerror = () => {
+        if (finished) return;
+        finished = true;
+        source.close();
+        console.warn('任务推送连接中断，改为轮询:', taskId);
+        fallback();
+    };
+}
+
+// 监听图像生成进度
+function watchImageProgress(taskId) {
+    watchTask('image', taskId, (data) => {
+        try {
+            return handleImageProgress(data);
+        } catch (error) {
+            handleImageProgressError(error);
+            return false;
+        }
+    }, () => checkImageProgress(taskId));
+}
+
+// 检查图像生成进度（轮询方式）
+async function checkImageProgress(taskId) {
     try {
         const res = await fetch(`/image-task-progress/${taskId}`);
         
@@ -388,46 +425,76 @@ async function checkImageProgress(taskId) {
         const data = await res.json();
         console.log('图像进度查询响应数据:', data);
         
-        if (data.success) {
-            if (data.status === 'completed') {
-                updateImageProgress(100, '图像生成完成！', '已完成');
-                if (data.image_url) {
-                    image.src = data.image_url;
-                    result.classList.remove('hidden');
-                }
-                loading.style.display = 'none';
-                if (progressContainer) {
-                    setTimeout(() => {
-                        progressContainer.style.display = 'none';
-                    }, 2000);
-                }
-            } else if (data.status === 'failed') {
-                throw new Error(data.error || data.message || '图像生成失败');
-            } else if (data.status === 'running') {
-                // 更新进度
-                const progress = data.progress || {};
-                updateImageProgress(
-                    progress.percentage || 50,
-                    progress.message || '图像生成中...',
-                    progress.estimated_time || '请稍候...'
-                );
-                // 继续轮询
-                setTimeout(() => checkImageProgress(taskId), 3000);
+        if (handleImageProgress(data)) {
+            // 继续轮询，优先使用服务端给出的下一次状态更新时间
+            const delay = data.next_poll_ms || (data.status === 'running' ? 3000 : 5000);
+            setTimeout(() => checkImageProgress(taskId), delay);
+        }
+    } catch (error) {
+        handleImageProgressError(error);
+    }
+}
+
+// 处理图像任务状态，返回任务是否仍在进行中
+function handleImageProgress(data) {
+    const loading = document.getElementById('imageLoading');
+    const result = document.getElementById('imageResult');
+    const image = document.getElementById('generatedImage');
+    const progressContainer = document.getElementById('imageProgressContainer');
+    
+    if (!data.success) {
+        throw new Error(data.error);
+    }
+    
+    if (data.status === 'completed') {
+        updateImageProgress(100, '图像生成完成！', '已完成');
+        if (data.local_image_url || data.image_url) {
+            // 优先使用本地副本，上游链接会过期
+            image.src = data.local_image_url || data.image_url;
+            const variants = data.image_variants;
+            if (variants && variants.srcset) {
+                // 浏览器按显示宽度选择合适的 WebP 版本，原图作为最大候选
+                image.srcset = variants.srcset;
+                image.sizes = '(max-width: 768px) 100vw, 768px';
             } else {
-                // 未知状态，继续轮询
-                updateImageProgress(30, '处理中...', '请稍候...');
-                setTimeout(() => checkImageProgress(taskId), 5000);
+                image.removeAttribute('srcset');
             }
-        } else {
-            throw new Error(data.error);
+            result.classList.remove('hidden');
         }
-    } catch (error) {
-        console.error('图像进度查询失败:', error);
-        alert('检查进度失败：' + error.message);
         loading.style.display = 'none';
         if (progressContainer) {
-            progressContainer.style.display = 'none';
+            setTimeout(() => {
+                progressContainer.style.display = 'none';
+            }, 2000);
         }
+        return false;
+    } else if (data.status === 'failed') {
+        throw new Error(data.error || data.message || '图像生成失败');
+    } else if (data.status === 'running') {
+        // 更新进度
+        const progress = data.progress || {};
+        updateImageProgress(
+            progress.percentage || 50,
+            progress.message || '图像生成中...',
+            progress.estimated_time || '请稍候...'
+        );
+    } else {
+        // 未知状态，继续等待
+        updateImageProgress(30, '处理中...', '请稍候...');
+    }
+    return true;
+}
+
+// 图像进度查询失败
+function handleImageProgressError(error) {
+    const loading = document.getElementById('imageLoading');
+    const progressContainer = document.getElementById('imageProgressContainer');
+    
+    console.error('图像进度查询失败:', error);
+    alert('检查进度失败：' + error.message);
+    loading.style.display = 'none';
+    if (progressContainer) {
+        progressContainer.style.display = 'none';
     }
 }
 
@@ -452,6 +519,42 @@ function updateImageProgress(percentage, message, timeInfo) {
     }
 }
 
+// 创建视频任务时最多尝试的次数（含首次）
+const CREATE_VIDEO_MAX_ATTEMPTS = 3;
+
+// 提交视频任务：服务端只向上游提交一次，返回 retryable 时等待 retry_after（或抖动退避）后重新提交
+async function postCreateVideo(body) {
+    for (let attempt = 1; ; attempt++) {
+        const res = await fetch('/create-video', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(body)
+        });
+        
+        let data = null;
+        try {
+            data = await res.json();
+        } catch (e) {
+            // 非 JSON 响应按 HTTP 状态报错
+        }
+        
+        if (data && data.retryable && attempt < CREATE_VIDEO_MAX_ATTEMPTS) {
+            const backoff = Math.random() * Math.pow(2, attempt - 1);
+            const delay = Math.max(data.retry_after || 0, backoff);
+            updateVideoProgress(0, '服务繁忙，正在重试...', `${Math.ceil(delay)}秒后第${attempt + 1}次尝试`, '预计时间: 计算中...');
+            await new Promise(resolve => setTimeout(resolve, delay * 1000));
+            continue;
+        }
+        
+        if (!res.ok) {
+            throw new Error((data && data.error) || `HTTP ${res.status}: ${res.statusText}`);
+        }
+        return data;
+    }
+}
+
 // 视频生成功能（增强进度显示）
 async function generateVideo() {
     const promptElement = document.getElementById('videoPrompt');
@@ -489,33 +592,21 @@ async function generateVideo() {
     }
     
     try {
-        // 创建视频任务
-        const res = await fetch('/create-video', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                prompt: prompt,
-                quality: quality,
-                size: size,
-                duration: duration,
-                fps: 30,
-                with_audio: false
-            })
+        // 创建视频任务（上游暂时不可用时按服务端给出的 retry_after 自动重试）
+        const data = await postCreateVideo({
+            prompt: prompt,
+            quality: quality,
+            size: size,
+            duration: duration,
+            fps: 30,
+            with_audio: false
         });
-        
-        if (!res.ok) {
-            throw new Error(`HTTP ${res.status}: ${res.statusText}`);
-        }
-        
-        const data = await res.json();
         console.log('视频任务创建响应数据:', data);
         
         if (data.task_id && !data.error) {
             updateVideoProgress(15, '视频任务创建成功！', '开始生成...', data.estimated_time || '预计时间: 3-8分钟');
-            // 轮询检查任务状态
-            checkVideoProgressEnhanced(data.task_id);
+            // 订阅任务状态推送
+            watchVideoProgress(data.task_id);
         } else {
             throw new Error(data.error || '创建视频任务失败');
         }
@@ -529,19 +620,20 @@ async function generateVideo() {
     }
 }
 
-// 检查视频生成状态（增强版）
+// 监听视频生成进度
+function watchVideoProgress(taskId) {
+    watchTask('video', taskId, (data) => {
+        try {
+            return handleVideoProgress(data);
+        } catch (error) {
+            handleVideoProgressError(error);
+            return false;
+        }
+    }, () => checkVideoProgressEnhanced(taskId));
+}
+
+// 检查视频生成状态（增强版，轮询方式）
 async function checkVideoProgressEnhanced(taskId) {
-    const loading = document.getElementById('videoLoading');
-    const result = document.getElementById('videoResult');
-    const video = document.getElementById('generatedVideo');
-    const progressContainer = document.getElementById('videoProgressContainer');
-    
-    // 安全检查：确保所有必要元素都存在
-    if (!loading || !result || !video) {
-        console.error('页面元素不完整，无法检查视频状态');
-        return;
-    }
-    
     try {
         const res = await fetch(`/video-task-progress/${taskId}`);
         
@@ -552,47 +644,77 @@ async function checkVideoProgressEnhanced(taskId) {
         const data = await res.json();
         console.log('视频进度查询响应数据:', data);
         
-        if (data.success) {
-            if (data.status === 'completed') {
-                updateVideoProgress(100, '视频生成完成！', '完成', '已完成');
-                if (data.video_url) {
-                    video.src = data.video_url;
-                    result.classList.remove('hidden');
-                }
-                loading.style.display = 'none';
-                if (progressContainer) {
-                    setTimeout(() => {
-                        progressContainer.style.display = 'none';
-                    }, 3000);
-                }
-            } else if (data.status === 'failed') {
-                throw new Error(data.error || data.message || '视频生成失败');
-            } else if (data.status === 'processing') {
-                // 更新详细进度
-                const progress = data.progress || {};
-                updateVideoProgress(
-                    progress.percentage || 60,
-                    progress.message || '视频正在生成中...',
-                    progress.current_stage || '视频渲染中',
-                    progress.estimated_time || '预计还需2-5分钟'
-                );
-                // 继续轮询，视频生成时间较长，适当延长轮询间隔
-                setTimeout(() => checkVideoProgressEnhanced(taskId), 7000);
-            } else {
-                // 未知状态，继续轮询
-                updateVideoProgress(40, '处理中...', '初始化...', '请稍候...');
-                setTimeout(() => checkVideoProgressEnhanced(taskId), 8000);
-            }
-        } else {
-            throw new Error(data.error);
+        if (handleVideoProgress(data)) {
+            // 继续轮询，优先使用服务端给出的下一次状态更新时间
+            const delay = data.next_poll_ms || (data.status === 'processing' ? 7000 : 8000);
+            setTimeout(() => checkVideoProgressEnhanced(taskId), delay);
         }
     } catch (error) {
-        console.error('视频状态查询失败:', error);
-        alert('检查状态失败：' + error.message);
+        handleVideoProgressError(error);
+    }
+}
+
+// 处理视频任务状态，返回任务是否仍在进行中
+function handleVideoProgress(data) {
+    const loading = document.getElementById('videoLoading');
+    const result = document.getElementById('videoResult');
+    const video = document.getElementById('generatedVideo');
+    const progressContainer = document.getElementById('videoProgressContainer');
+    
+    // 安全检查：确保所有必要元素都存在
+    if (!loading || !result || !video) {
+        console.error('页面元素不完整，无法检查视频状态');
+        return false;
+    }
+    
+    if (!data.success) {
+        throw new Error(data.error);
+    }
+    
+    if (data.status === 'completed') {
+        updateVideoProgress(100, '视频生成完成！', '完成', '已完成');
+        if (data.local_video_url || data.video_url) {
+            // 优先使用本地代理，拖动进度条时的 Range 请求由服务器本地文件响应
+            video.src = data.local_video_url || data.video_url;
+            result.classList.remove('hidden');
+        }
         loading.style.display = 'none';
         if (progressContainer) {
-            progressContainer.style.display = 'none';
+            setTimeout(() => {
+                progressContainer.style.display = 'none';
+            }, 3000);
         }
+        return false;
+    } else if (data.status === 'failed') {
+        throw new Error(data.error || data.message || '视频生成失败');
+    } else if (data.status === 'processing') {
+        // 更新详细进度
+        const progress = data.progress || {};
+        updateVideoProgress(
+            progress.percentage || 60,
+            progress.message || '视频正在生成中...',
+            progress.current_stage || '视频渲染中',
+            progress.estimated_time || '预计还需2-5分钟'
+        );
+    } else {
+        // 未知状态，继续等待
+        updateVideoProgress(40, '处理中...', '初始化...', '请稍候...');
+    }
+    return true;
+}
+
+// 视频状态查询失败
+function handleVideoProgressError(error) {
+    const loading = document.getElementById('videoLoading');
+    const progressContainer = document.getElementById('videoProgressContainer');
+    
+    console.error('视频状态查询失败:', error);
+    alert('检查状态失败：' + error.message);
+    if (loading) {
+        loading.style.display = 'none';
+    }
+    if (progressContainer) {
+        progressContainer.style.display = 'none';
     }
 }
 